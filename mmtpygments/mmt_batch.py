@@ -0,0 +1,788 @@
+# -*- coding: utf-8 -*-
+"""
+	Batch Highlighting of MMT Files
+	===============================
+
+	Highlights whole directory trees of MMT files on a process pool and renders
+	standalone HTML files, an index and an amalgamation of all render results.
+	With a manifest (see mmt_manifest.py), only files changed since the last run
+	are highlighted again. In check mode, files are only lexed up to their first
+	lexing error, which is reported with its location and state stack.
+	Installed as the console script `mmtpygmentize`.
+
+	:author: ComFreek <comfreek@outlook.com>
+	:copyright: Copyright 2020 ComFreek
+	:license: ISC, see LICENSE for details.
+"""
+
+import argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import fnmatch
+from html import escape
+import io
+import json
+import os
+import sys
+import time
+
+import pygments
+from pygments.formatters.html import DOC_FOOTER, DOC_HEADER, HtmlFormatter
+from pygments.token import Generic, Token, string_to_tokentype
+
+from .mmt_fast_lexer import MMTFastLexer
+from .mmt_html_formatter import MMTHtmlFormatter
+from .mmt_incremental import get_tokens_with_checkpoints
+from .mmt_lexer import MMTLexer
+from .mmt_manifest import Manifest, code_fingerprint
+from .mmt_parallel import preprocess_text
+from .mmt_style import MMTDefaultStyle
+
+__all__ = [
+	'FileResult', 'BatchStatistics', 'CheckResult', 'find_files', 'highlight_files', 'check_files',
+	'format_check_result', 'load_manifest', 'amalgamation_shard_filename', 'run', 'check', 'main'
+]
+
+LEXERS = {
+	'mmt': MMTLexer,
+	'mmtfast': MMTFastLexer
+}
+
+# Tokens that we interpret as signalling a lexer error
+# Token.Error is Pygment's standard error token whereas Generic.Error
+# is issued by MMTLexer for graceful degradation
+ERROR_TOKENS = (Token.Error, Generic.Error)
+
+# Result of highlighting a single file
+#
+#  - filename:     the input file
+#  - out_filename: the rendered standalone HTML file (None if not written)
+#  - erroneous:    whether lexing produced error tokens
+#  - diverging:    whether the verification lexer yielded different tokens
+#  - exception:    a message if processing the file failed altogether, otherwise None
+#  - snippet:      the rendered HTML snippet for the amalgamation as UTF-8 bytes (None if not requested)
+FileResult = namedtuple('FileResult', [
+	'filename', 'out_filename', 'erroneous', 'diverging', 'exception', 'snippet',
+	'num_lines', 'num_bytes', 'num_tokens', 'seconds'
+])
+
+BatchStatistics = namedtuple('BatchStatistics', [
+	'num_files', 'num_failing_files', 'num_succeeding_lines', 'num_lines', 'num_bytes', 'num_tokens', 'seconds'
+])
+
+# Result of checking a single file for lexing errors
+#
+#  - filename:  the input file
+#  - line:      the line of the first error token (1-based), None if there is none
+#  - column:    the column of the first error token in characters (1-based), None if there is none
+#  - stack:     the lexer's state stack (a tuple of state names) where the error token was produced
+#  - tokentype: the type of the error token
+#  - value:     the text of the error token
+#  - exception: a message if checking the file failed altogether, otherwise None
+#  - num_bytes: the size of the file
+CheckResult = namedtuple('CheckResult', [
+	'filename', 'line', 'column', 'stack', 'tokentype', 'value', 'exception', 'num_bytes'
+])
+
+def generate_index_file(out_statuses, num_succeeding_lines, num_failing_files, base_path, amalgamation_filename, index_file):
+	"""Generate index file linking to all rendered HTML files.
+
+	Args:
+		out_statuses: An iterable of dictionaries {filename: ..., error: ...}, where
+		              filename points to the rendered HTML file and error is a boolean
+		              indicating whether an error occured.
+
+		base_path:    Base path to use for links
+		amalgamation_filename: Name of the amalgamation to link to, a list of names if it is split
+		              into shards, or None.
+		index_file:   File object to write the index HTML to, opened as text with encoding UTF-8!
+	"""
+
+	def error_to_symbol(error):
+		if error:
+			return "❌"
+		else:
+			return "✓"
+
+	index_file.write("""
+<!doctype html>
+<html>
+	<head>
+		<meta charset="utf-8">
+
+		<!-- Don't cache! -->
+		<meta http-equiv="Cache-Control" content="no-cache, no-store, must-revalidate">
+		<meta http-equiv="Pragma" content="no-cache" />
+		<meta http-equiv="Expires" content="0">
+
+		<title>Index of Render Results - mmt-pygments-lexer</title>
+	""")
+	index_file.write("<base href='" + escape(base_path) + "'>")
+	index_file.write("""
+	</head>
+	<body>
+		<h1>Render Results</h1>
+		Last update:
+	""")
+	index_file.write(str(datetime.now()))
+
+	index_file.write("""
+		<hr>
+	""")
+
+	amalgamation_filenames = [amalgamation_filename] if isinstance(amalgamation_filename, str) else amalgamation_filename or []
+	for (shard, filename) in enumerate(amalgamation_filenames, 1):
+		index_file.write("<h2><a href='" + escape(filename.replace("\\", "/")) + "'>Amalgamation of Render Results" + (
+			" (part %d of %d)" % (shard, len(amalgamation_filenames)) if len(amalgamation_filenames) > 1 else ""
+		) + " (click)</a></h2>")
+	index_file.write("""
+		<h2>Overview (highlighted %d lines with success, %d failing files)</h2>
+	""" % (num_succeeding_lines, num_failing_files))
+
+	out_statuses = sorted(out_statuses, key = lambda s : s["error"])
+
+	html_anchors = list((
+		"<a href='" + escape(filename.replace("\\", "/")) + "'>" + error_to_symbol(error) + " " + escape(filename) + "</a>"
+
+		for (filename, error) in (
+			(out_status["filename"], out_status["error"])
+			for out_status in out_statuses
+		)
+	))
+
+	if len(html_anchors) == 0:
+		index_file.write("There are none, is the Travis build working? Please submit an issue.")
+	else:
+		index_file.write("<ul>")
+		index_file.write("".join("<li>" + anchor + "</li>" for anchor in html_anchors))
+		index_file.write("</ul>")
+
+	index_file.write("""
+		</ul>
+	</body>
+</html>""")
+
+
+AMALGAMATION_HEADER = b"""
+<!doctype html>
+<html>
+	<head>
+		<meta charset="utf-8">
+
+		<!-- Don't cache! -->
+		<meta http-equiv="Cache-Control" content="no-cache, no-store, must-revalidate">
+		<meta http-equiv="Pragma" content="no-cache" />
+		<meta http-equiv="Expires" content="0">
+
+		<title>Amalgamation of Render Results - mmt-pygments-lexer</title>
+	</head>
+	<body>
+		<h1>Amalgamation of Render Results</h1>
+"""
+
+AMALGAMATION_FOOTER = b"</body></html>"
+
+def _write_amalgamation_header(amalgamation_file):
+	amalgamation_file.write(AMALGAMATION_HEADER)
+	amalgamation_file.write(b"<style>")
+	amalgamation_file.write(HtmlFormatter(style = MMTDefaultStyle).get_style_defs().encode("utf-8"))
+	amalgamation_file.write(b"</style>")
+
+def amalgamation_shard_filename(amalgamation_filename, shard):
+	"""Return the filename of the shard-th (counting from 0) file of an amalgamation split into shards.
+
+	The first shard is amalgamation_filename itself, the others are numbered, e.g. amalgamation-2.html.
+	"""
+	if shard == 0:
+		return amalgamation_filename
+	(root, extension) = os.path.splitext(amalgamation_filename)
+	return "%s-%d%s" % (root, shard + 1, extension)
+
+def find_files(paths, patterns = ('*.mmt',), excludes = ()):
+	"""Return all files below paths matching one of patterns and none of excludes in sorted order.
+
+	Args:
+		paths:    An iterable of directories (searched recursively) and files (taken as is).
+		patterns: Shell-style patterns for file names to consider in directories.
+		excludes: Shell-style patterns for paths to exclude.
+	"""
+	filenames = set()
+	for path in paths:
+		if os.path.isdir(path):
+			for (directory, _, directory_filenames) in os.walk(path):
+				filenames.update(
+					os.path.join(directory, filename) for filename in directory_filenames
+					if any(fnmatch.fnmatch(filename, pattern) for pattern in patterns)
+				)
+		else:
+			filenames.add(path)
+
+	return sorted(
+		filename for filename in filenames
+		if not any(fnmatch.fnmatch(filename, exclude) for exclude in excludes)
+	)
+
+# Per process state, see _init_worker
+_worker = None
+
+_Worker = namedtuple('_Worker', ['lexer', 'verify_lexer', 'formatter', 'full_html_header', 'write_html', 'snippets'])
+
+def _full_html_header():
+	"""Return the header HtmlFormatter(full = True) writes, such that we only need to
+	format every file once for both the standalone HTML file and the amalgamation."""
+	full_formatter = HtmlFormatter(full = True, encoding = "utf-8", style = MMTDefaultStyle)
+	return DOC_HEADER % dict(
+		title = full_formatter.title,
+		styledefs = full_formatter.get_style_defs('body'),
+		encoding = full_formatter.encoding
+	)
+
+def _init_worker(lexer_name, verify_lexer_name, write_html, snippets):
+	global _worker
+
+	# We read the input files in binary mode to circumvent encoding issues,
+	# the lexers decode them as UTF-8
+	_worker = _Worker(
+		lexer = LEXERS[lexer_name](encoding = "utf-8"),
+		verify_lexer = LEXERS[verify_lexer_name](encoding = "utf-8") if verify_lexer_name else None,
+		formatter = MMTHtmlFormatter(full = False, style = MMTDefaultStyle),
+		full_html_header = _full_html_header(),
+		write_html = write_html,
+		snippets = snippets
+	)
+
+def _highlight_file(filename):
+	"""Lex filename once, check for errors and write/return all requested renderings."""
+	start_time = time.perf_counter()
+	worker = _worker
+
+	try:
+		with io.open(filename, mode = "rb") as source_file:
+			source = source_file.read()
+
+		tokens = worker.lexer.get_token_array(source)
+		erroneous = any(tokentype in ERROR_TOKENS for tokentype in tokens.tokentypes)
+		diverging = worker.verify_lexer is not None and worker.verify_lexer.get_token_array(source) != tokens
+
+		out_filename = None
+		snippet = None
+		if worker.write_html or worker.snippets:
+			html = pygments.format(tokens, worker.formatter)
+
+			if worker.write_html:
+				out_filename = filename + ".html"
+				with io.open(out_filename, mode = "wb") as out_file:
+					out_file.write((worker.full_html_header + html + DOC_FOOTER).encode("utf-8"))
+
+			if worker.snippets:
+				snippet = html.encode("utf-8")
+
+		return FileResult(
+			filename = filename,
+			out_filename = out_filename,
+			erroneous = erroneous,
+			diverging = diverging,
+			exception = None,
+			snippet = snippet,
+			num_lines = source.count(b"\n") + (0 if source.endswith(b"\n") else 1),
+			num_bytes = len(source),
+			num_tokens = len(tokens),
+			seconds = time.perf_counter() - start_time
+		)
+	except Exception as exception:
+		return FileResult(
+			filename = filename,
+			out_filename = None,
+			erroneous = False,
+			diverging = False,
+			exception = "{}: {}".format(type(exception).__name__, exception),
+			snippet = None,
+			num_lines = 0,
+			num_bytes = 0,
+			num_tokens = 0,
+			seconds = time.perf_counter() - start_time
+		)
+
+def highlight_files(filenames, jobs = None, lexer = 'mmt', verify_lexer = None, write_html = True, snippets = False):
+	"""Highlight filenames on a process pool.
+
+	Args:
+		filenames:    An iterable of MMT files.
+		jobs:         Number of processes, by default os.cpu_count(). With 1, everything runs
+		              in the current process.
+		lexer:        Name of the lexer to use, a key of LEXERS.
+		verify_lexer: Name of a lexer that must yield the very same tokens as lexer, or None.
+		write_html:   Whether to write a standalone HTML file next to every input file.
+		snippets:     Whether to return an HTML snippet for every file (for an amalgamation).
+
+	Return:
+		An iterator of FileResult objects in the order of filenames.
+	"""
+	jobs = jobs or os.cpu_count() or 1
+	initargs = (lexer, verify_lexer, write_html, snippets)
+
+	if jobs == 1:
+		_init_worker(*initargs)
+		yield from map(_highlight_file, filenames)
+	else:
+		with ProcessPoolExecutor(jobs, initializer = _init_worker, initargs = initargs) as pool:
+			yield from pool.map(_highlight_file, filenames, chunksize = 4)
+
+# Lexer of the check workers, see _init_check_worker
+_check_lexer = None
+
+def _init_check_worker(lexer_name):
+	global _check_lexer
+
+	# Keep leading and trailing newlines such that offsets map to the lines of the file
+	_check_lexer = LEXERS[lexer_name](encoding = "utf-8", stripnl = False)
+
+def _state_stack_at(lexer, text, offset):
+	"""Return the state stack in which lexer produces the token at offset of text.
+
+	Tracking the state stack is slower than plain lexing, hence this is only done for the
+	prefix of text up to offset after the error has been found.
+	"""
+	stack = ('root',)
+	for (index, tokentype, value) in get_tokens_with_checkpoints(lexer, text, delimiters = None):
+		if tokentype is None:
+			stack = value
+		elif index == offset and tokentype in ERROR_TOKENS:
+			# Not at any earlier token at offset, e.g. an empty one, whose step might change the stack
+			break
+	return stack
+
+def _check_file(filename):
+	"""Lex filename up to the first error token without formatting anything."""
+	lexer = _check_lexer
+
+	try:
+		with io.open(filename, mode = "rb") as source_file:
+			source = source_file.read()
+
+		text = preprocess_text(lexer, source)
+		for (offset, tokentype, value) in lexer.get_tokens_unprocessed(text):
+			if tokentype in ERROR_TOKENS:
+				line_start = text.rfind("\n", 0, offset) + 1
+				return CheckResult(
+					filename = filename,
+					line = text.count("\n", 0, line_start) + 1,
+					column = offset - line_start + 1,
+					stack = _state_stack_at(lexer, text, offset),
+					# token types are restored by check_files, unpickled ones would be copies
+					tokentype = str(tokentype),
+					value = value,
+					exception = None,
+					num_bytes = len(source)
+				)
+
+		return CheckResult(filename, None, None, None, None, None, None, len(source))
+	except Exception as exception:
+		return CheckResult(filename, None, None, None, None, None, "{}: {}".format(type(exception).__name__, exception), 0)
+
+def check_files(filenames, jobs = None, lexer = 'mmt'):
+	"""Check filenames for lexing errors on a process pool.
+
+	Every file is only lexed up to its first error token, no tokens are stored or formatted.
+
+	Args:
+		filenames, jobs, lexer: See highlight_files.
+
+	Return:
+		An iterator of CheckResult objects in the order of filenames.
+	"""
+	jobs = jobs or os.cpu_count() or 1
+
+	if jobs == 1:
+		_init_check_worker(lexer)
+		results = map(_check_file, filenames)
+	else:
+		pool = ProcessPoolExecutor(jobs, initializer = _init_check_worker, initargs = (lexer,))
+		results = pool.map(_check_file, filenames, chunksize = 4)
+
+	try:
+		for result in results:
+			if result.tokentype is not None:
+				result = result._replace(tokentype = string_to_tokentype(result.tokentype))
+			yield result
+	finally:
+		if jobs != 1:
+			pool.shutdown()
+
+def format_check_result(result, output_format = 'text'):
+	"""Return the line reporting a failing CheckResult.
+
+	With output_format 'text', it reads FILE:LINE:COLUMN: error: TOKENTYPE VALUE [STATE > ...],
+	with 'json', it is a JSON object with the keys file, line, column, stack, token and value
+	(or file and exception).
+	"""
+	if output_format == 'json':
+		if result.exception is not None:
+			return json.dumps({"file": result.filename, "exception": result.exception}, ensure_ascii = False)
+		return json.dumps({
+			"file": result.filename,
+			"line": result.line,
+			"column": result.column,
+			"stack": list(result.stack),
+			"token": str(result.tokentype),
+			"value": result.value
+		}, ensure_ascii = False)
+
+	if result.exception is not None:
+		return "{}: exception: {}".format(result.filename, result.exception)
+	return "{}:{}:{}: error: {} {!r} [{}]".format(
+		result.filename, result.line, result.column, result.tokentype, result.value, " > ".join(result.stack)
+	)
+
+def check(filenames, jobs = None, lexer = 'mmt', output_format = 'text', out = None, log = print):
+	"""Check all filenames for lexing errors and report every failing file as one line.
+
+	Args:
+		filenames, jobs, lexer: See check_files.
+		output_format: 'text' or 'json', see format_check_result.
+		out:           File object to write the reports of failing files to, by default sys.stdout.
+		log:           Function to call with the final statistics message.
+
+	Return:
+		A BatchStatistics object. Lines and tokens are not counted.
+	"""
+	start_time = time.perf_counter()
+	out = out if out is not None else sys.stdout
+	num_files = 0
+	num_failing_files = 0
+	num_bytes = 0
+
+	for result in check_files(filenames, jobs, lexer):
+		num_files += 1
+		num_bytes += result.num_bytes
+		if result.exception is not None or result.line is not None:
+			num_failing_files += 1
+			out.write(format_check_result(result, output_format) + "\n")
+			out.flush()
+
+	statistics = BatchStatistics(
+		num_files = num_files,
+		num_failing_files = num_failing_files,
+		num_succeeding_lines = 0,
+		num_lines = 0,
+		num_bytes = num_bytes,
+		num_tokens = 0,
+		seconds = time.perf_counter() - start_time
+	)
+
+	log("Checked %d files (%.1f KiB) in %.2f s: %.1f KiB/s; %d failing files" % (
+		statistics.num_files, statistics.num_bytes / 1024, statistics.seconds,
+		statistics.num_bytes / 1024 / max(statistics.seconds, 1e-9), statistics.num_failing_files
+	))
+
+	return statistics
+
+def load_manifest(filename, lexer = 'mmt', verify_lexer = None):
+	"""Return the manifest stored in filename (an empty one if there is none) for runs with lexer and verify_lexer.
+
+	Entries recorded with other lexers or another version of this package are not current.
+	"""
+	lexer_classes = [LEXERS[lexer]] + ([LEXERS[verify_lexer]] if verify_lexer else [])
+	return Manifest.load(filename, code_fingerprint(*lexer_classes))
+
+def _reused_result(filename, entry, header = None):
+	"""Return the FileResult recorded in a manifest entry.
+
+	Given the header of the HTML files as UTF-8 bytes, the snippet is cut out of the entry's HTML file.
+	"""
+	snippet = None
+	if header is not None:
+		with io.open(entry["out_filename"], mode = "rb") as out_file:
+			html = out_file.read()
+		footer = DOC_FOOTER.encode("utf-8")
+		if not (html.startswith(header) and html.endswith(footer)):
+			raise ValueError("unexpected contents of " + entry["out_filename"])
+		snippet = html[len(header):len(html) - len(footer)]
+
+	return FileResult(
+		filename = filename,
+		out_filename = entry["out_filename"],
+		erroneous = entry["erroneous"],
+		diverging = entry["diverging"],
+		exception = None,
+		snippet = snippet,
+		num_lines = entry["num_lines"],
+		num_bytes = entry["num_bytes"],
+		num_tokens = entry["num_tokens"],
+		seconds = 0.0
+	)
+
+def _highlight_changed_files(filenames, manifest, jobs, lexer, verify_lexer, write_html, snippets, log):
+	"""Like highlight_files, but reuse the results of all files with a current entry in manifest."""
+	filenames = list(filenames)
+
+	# Snippets for the amalgamation are cut out of the HTML files, hence those must exist
+	reused_entries = {}
+	for filename in filenames:
+		entry = manifest.current_entry(filename, require_output = write_html or snippets)
+		if entry is not None:
+			reused_entries[filename] = entry
+
+	for out_filename in manifest.prune():
+		log("Removed stale " + out_filename)
+	log("Reusing the results of %d unchanged files, highlighting %d files" % (
+		len(reused_entries), len(filenames) - len(reused_entries)
+	))
+
+	header = _full_html_header().encode("utf-8") if snippets else None
+	results = highlight_files(
+		[filename for filename in filenames if filename not in reused_entries],
+		jobs, lexer, verify_lexer, write_html, snippets
+	)
+	for filename in filenames:
+		if filename in reused_entries:
+			try:
+				yield _reused_result(filename, reused_entries[filename], header)
+				continue
+			except (OSError, ValueError) as exception:
+				# e.g. the HTML file was modified meanwhile, report it this time and highlight it next time
+				result = FileResult(
+					filename = filename,
+					out_filename = None,
+					erroneous = False,
+					diverging = False,
+					exception = "cannot reuse previous results: {}".format(exception),
+					snippet = None,
+					num_lines = 0,
+					num_bytes = 0,
+					num_tokens = 0,
+					seconds = 0.0
+				)
+		else:
+			result = next(results)
+
+		if result.exception is None:
+			manifest.record(
+				filename,
+				out_filename = result.out_filename,
+				erroneous = result.erroneous,
+				diverging = result.diverging,
+				exception = None,
+				num_lines = result.num_lines,
+				num_bytes = result.num_bytes,
+				num_tokens = result.num_tokens
+			)
+		else:
+			manifest.forget(filename)
+		yield result
+
+def run(filenames, jobs = None, lexer = 'mmt', verify_lexer = None, write_html = True,
+	index_file = None, index_file_base_path = './', amalgamation_file = None, amalgamation_filename = None,
+	log = print, manifest = None, amalgamation_shard_size = None):
+	"""Highlight all filenames, write index and amalgamation and report on the way.
+
+	Args:
+		filenames, jobs, lexer, verify_lexer, write_html: See highlight_files.
+		index_file:           A file object to write the HTML index to linking all render results,
+		                      opened as text with encoding UTF-8, or None.
+		index_file_base_path: Base path to use for links in index.
+		amalgamation_file:    A file object to write all HTML render results subsequently to, opened
+		                      in binary mode, or None.
+		amalgamation_filename: Name of the amalgamation to link to from the index.
+		log:                  Function to call with progress and statistics messages.
+		manifest:             A Manifest (see load_manifest) to reuse the results of unchanged files from
+		                      and record the results of all others to, or None. Output files of files
+		                      recorded in it that no longer exist are removed.
+		amalgamation_shard_size: Maximum number of render results per amalgamation file, or None for
+		                      a single one. Once amalgamation_file is full, the following render results
+		                      go to the files named by amalgamation_shard_filename, which are all linked
+		                      from the index.
+
+	Return:
+		A BatchStatistics object. A file fails if it could not be processed, produced
+		lexing errors or diverged under verify_lexer.
+	"""
+	start_time = time.perf_counter()
+
+	if amalgamation_file is not None:
+		_write_amalgamation_header(amalgamation_file)
+	amalgamation_filenames = [amalgamation_filename] if amalgamation_filename is not None else []
+	# Number of render results in the current amalgamation file
+	num_snippets = 0
+
+	num_files = 0
+	num_failing_files = 0
+	num_succeeding_lines = 0
+	num_lines = 0
+	num_bytes = 0
+	num_tokens = 0
+	out_statuses = []
+
+	if manifest is None:
+		results = highlight_files(filenames, jobs, lexer, verify_lexer, write_html, amalgamation_file is not None)
+	else:
+		results = _highlight_changed_files(
+			filenames, manifest, jobs, lexer, verify_lexer, write_html, amalgamation_file is not None, log
+		)
+
+	for result in results:
+		num_files += 1
+		num_lines += result.num_lines
+		num_bytes += result.num_bytes
+		num_tokens += result.num_tokens
+
+		failing = result.exception is not None or result.erroneous or result.diverging
+		if failing:
+			num_failing_files += 1
+			if result.exception is not None:
+				log("Error in " + result.filename + ": " + result.exception)
+			if result.erroneous:
+				log("Lexing error in " + result.filename + ", see corresponding .html file for details")
+			if result.diverging:
+				log(lexer + " and " + verify_lexer + " yield different tokens for " + result.filename)
+		else:
+			num_succeeding_lines += result.num_lines
+
+		if result.out_filename is not None:
+			out_statuses.append({"filename": result.out_filename, "error": failing})
+		if result.snippet is not None:
+			if amalgamation_shard_size and num_snippets >= amalgamation_shard_size:
+				amalgamation_file.write(AMALGAMATION_FOOTER)
+				if len(amalgamation_filenames) > 1:
+					# opened by us below
+					amalgamation_file.close()
+				amalgamation_filenames.append(amalgamation_shard_filename(amalgamation_filename, len(amalgamation_filenames)))
+				amalgamation_file = io.open(amalgamation_filenames[-1], "wb")
+				_write_amalgamation_header(amalgamation_file)
+				num_snippets = 0
+			amalgamation_file.write(result.snippet)
+			num_snippets += 1
+
+	if amalgamation_file is not None:
+		amalgamation_file.write(AMALGAMATION_FOOTER)
+		if len(amalgamation_filenames) > 1:
+			amalgamation_file.close()
+
+	if manifest is not None:
+		manifest.save()
+
+	if index_file is not None:
+		generate_index_file(
+			out_statuses,
+			num_succeeding_lines,
+			num_failing_files,
+			index_file_base_path,
+			amalgamation_filenames,
+			index_file
+		)
+
+	statistics = BatchStatistics(
+		num_files = num_files,
+		num_failing_files = num_failing_files,
+		num_succeeding_lines = num_succeeding_lines,
+		num_lines = num_lines,
+		num_bytes = num_bytes,
+		num_tokens = num_tokens,
+		seconds = time.perf_counter() - start_time
+	)
+
+	seconds = max(statistics.seconds, 1e-9)
+	log("Highlighted %d files (%d lines, %.1f KiB, %d tokens) in %.2f s: %.1f KiB/s, %d tokens/s; %d failing files" % (
+		statistics.num_files, statistics.num_lines, statistics.num_bytes / 1024, statistics.num_tokens,
+		statistics.seconds, statistics.num_bytes / 1024 / seconds, statistics.num_tokens / seconds,
+		statistics.num_failing_files
+	))
+
+	return statistics
+
+def main(args = None):
+	parser = argparse.ArgumentParser(
+		prog = 'mmtpygmentize',
+		description = 'Highlight MMT files in parallel and render them to HTML.'
+	)
+	parser.add_argument('paths', nargs = '+', metavar = 'PATH',
+		help = 'MMT file or directory to search recursively for MMT files')
+	parser.add_argument('-j', '--jobs', type = int, default = None,
+		help = 'number of processes (default: number of CPUs)')
+	parser.add_argument('-l', '--lexer', choices = sorted(LEXERS), default = 'mmt',
+		help = 'lexer to use (default: mmt)')
+	parser.add_argument('--verify-lexer', choices = sorted(LEXERS), default = None,
+		help = 'additionally lex with this lexer and fail on files where it yields different tokens')
+	parser.add_argument('--pattern', action = 'append', default = None,
+		help = 'file name pattern to search for in directories (default: *.mmt), can be given multiple times')
+	parser.add_argument('--exclude', action = 'append', default = [],
+		help = 'path pattern to exclude, can be given multiple times')
+	parser.add_argument('--no-html', dest = 'write_html', action = 'store_false',
+		help = 'do not write a standalone FILE.html next to every input file')
+	parser.add_argument('--index', metavar = 'FILE', default = None,
+		help = 'write an HTML index linking all render results to FILE')
+	parser.add_argument('--base-path', default = './',
+		help = 'base path to use for links in the index (default: ./)')
+	parser.add_argument('--amalgamation', metavar = 'FILE', default = None,
+		help = 'write all render results subsequently to FILE')
+	parser.add_argument('--amalgamation-shard-size', type = int, default = None, metavar = 'N',
+		help = 'split the amalgamation into files of at most N render results: FILE, then e.g. FILE-2.html etc. '
+		       'for FILE.html, all linked from the index')
+	parser.add_argument('--manifest', metavar = 'FILE', default = None,
+		help = 'only highlight files changed since the run that recorded FILE (created if missing) and remove '
+		       'the HTML files of files no longer found')
+	parser.add_argument('--check', action = 'store_true',
+		help = 'only check for lexing errors: stop lexing every file at its first error, report its location and '
+		       'state stack on stdout and render nothing')
+	parser.add_argument('--format', dest = 'output_format', choices = ['text', 'json'], default = 'text',
+		help = 'format of the error reports of --check: FILE:LINE:COLUMN lines or JSON lines (default: text)')
+	options = parser.parse_args(args)
+
+	if options.check:
+		incompatible_options = [
+			option for (option, value) in (
+				('--verify-lexer', options.verify_lexer),
+				('--index', options.index),
+				('--amalgamation', options.amalgamation),
+				('--amalgamation-shard-size', options.amalgamation_shard_size),
+				('--manifest', options.manifest)
+			)
+			if value is not None
+		]
+		if incompatible_options:
+			parser.error('--check renders nothing and cannot be combined with ' + ', '.join(incompatible_options))
+	if options.amalgamation_shard_size is not None:
+		if options.amalgamation is None:
+			parser.error('--amalgamation-shard-size requires --amalgamation')
+		if options.amalgamation_shard_size < 1:
+			parser.error('--amalgamation-shard-size must be positive')
+
+	filenames = find_files(options.paths, options.pattern or ('*.mmt',), options.exclude)
+
+	if options.check:
+		statistics = check(
+			filenames,
+			jobs = options.jobs,
+			lexer = options.lexer,
+			output_format = options.output_format,
+			log = lambda message: print(message, file = sys.stderr)
+		)
+		return 0 if statistics.num_failing_files == 0 else 1
+
+	index_file = io.open(options.index, "w", encoding = "utf-8") if options.index else None
+	amalgamation_file = io.open(options.amalgamation, "wb") if options.amalgamation else None
+	try:
+		statistics = run(
+			filenames,
+			jobs = options.jobs,
+			lexer = options.lexer,
+			verify_lexer = options.verify_lexer,
+			write_html = options.write_html,
+			index_file = index_file,
+			index_file_base_path = options.base_path,
+			amalgamation_file = amalgamation_file,
+			amalgamation_filename = options.amalgamation,
+			log = lambda message: print(message, file = sys.stderr),
+			manifest = load_manifest(options.manifest, options.lexer, options.verify_lexer) if options.manifest else None,
+			amalgamation_shard_size = options.amalgamation_shard_size
+		)
+	finally:
+		for output_file in (index_file, amalgamation_file):
+			if output_file is not None:
+				output_file.close()
+
+	return 0 if statistics.num_failing_files == 0 else 1
+
+if __name__ == "__main__":
+	sys.exit(main())
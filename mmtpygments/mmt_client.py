@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""
+	Client of the MMT Highlight Server
+	==================================
+
+	Sends highlight requests to a running `mmtpygments-server` (see mmt_server.py).
+	Installed as the console script `mmtpygmentize-client`, a drop-in replacement for
+	`pygmentize` in minted and CI scripts: it understands the options -l, -f, -O, -P, -F,
+	-o, -S and -a, falls back to `pygmentize` for all others and for lexer and formatter
+	options the server does not accept (see SERVER_OPTIONS), and highlights in-process
+	if no server is running or it rejects the batch. Results pre-rendered by `mmtpygments-minted` next to the
+	output file (see mmt_minted.py) are copied without highlighting anything.
+
+	This module deliberately imports neither Pygments nor the lexers (nor http.client),
+	since a client process is short-lived and should not pay for them.
+
+	:author: ComFreek <comfreek@outlook.com>
+	:copyright: Copyright 2020 ComFreek
+	:license: ISC, see LICENSE for details.
+"""
+
+import getopt
+import hashlib
+import json
+import os
+import socket
+import sys
+
+__all__ = [
+	'HighlightClient', 'HighlightError', 'SERVER_OPTIONS', 'default_address', 'parse_address',
+	'parse_pygmentize_args', 'prerendered_filename', 'main'
+]
+
+DEFAULT_PORT = 8719
+
+# Lexer and formatter options the server accepts: those pygmentize and minted pass for
+# highlighting. Options making lexers or formatters access files (cssfile, tagsfile,
+# cachedir, profile etc.) are rejected, since requests need not come from the server's user.
+SERVER_OPTIONS = frozenset([
+	# lexers
+	'stripnl', 'stripall', 'ensurenl', 'tabsize', 'encoding', 'inencoding', 'outencoding',
+	'compact', 'linear', 'delimited', 'combined', 'dispatch', 'blocksize',
+	# HTML formatter
+	'style', 'full', 'title', 'nowrap', 'noclasses', 'classprefix', 'cssclass', 'cssstyles', 'prestyles',
+	'linenos', 'linenostart', 'linenostep', 'linenospecial', 'hl_lines', 'lineseparator', 'lineanchors',
+	'linespans', 'anchorlinenos', 'wrapcode', 'filename', 'debug_token_types',
+	# LaTeX formatter
+	'commandprefix', 'texcomments', 'mathescape', 'escapeinside', 'envname', 'verboptions', 'docclass', 'preamble'
+])
+
+class HighlightError(Exception):
+	"""A request failed on the server, e.g. due to an unknown lexer."""
+
+def default_address():
+	"""Return the server address from the environment variable MMTPYGMENTS_SERVER or the default one.
+
+	By default, the server listens on a Unix socket private to the current user, on platforms
+	without Unix sockets on localhost:8719.
+	"""
+	address = os.environ.get('MMTPYGMENTS_SERVER')
+	if address:
+		return address
+	if hasattr(socket, 'AF_UNIX') and hasattr(os, 'getuid'):
+		directory = os.environ.get('XDG_RUNTIME_DIR') or os.environ.get('TMPDIR') or '/tmp'
+		return os.path.join(directory, 'mmtpygments-{}.sock'.format(os.getuid()))
+	return 'localhost:{}'.format(DEFAULT_PORT)
+
+def parse_address(address):
+	"""Parse a server address into ('unix', path) or ('tcp', (host, port)).
+
+	Addresses are either paths of Unix sockets (absolute or prefixed by `unix:`) or `host:port`.
+	"""
+	if address.startswith('unix:'):
+		return ('unix', address[len('unix:'):])
+	if address.startswith(('/', '.')) or ':' not in address:
+		return ('unix', address)
+	(host, port) = address.rsplit(':', 1)
+	return ('tcp', (host or 'localhost', int(port)))
+
+class HighlightClient:
+	"""
+	Connection to a highlight server
+
+	Requests are dictionaries as understood by mmt_server.HighlightService.handle; results are
+	dictionaries with the key 'output' or 'error'. Every call is one HTTP request on a fresh
+	connection, hence batch several snippets into one call of highlight_batch where possible.
+
+	Args:
+		address: The server address (see parse_address), by default default_address().
+		timeout: Seconds to wait for the server, e.g. while it is busy with other requests.
+	"""
+
+	def __init__(self, address = None, timeout = 60.0):
+		self.address = address or default_address()
+		self.timeout = timeout
+
+	def _call(self, method, url, payload = None):
+		(kind, target) = parse_address(self.address)
+		body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+
+		# A plain HTTP/1.0 exchange, the server closes the connection after its response
+		if kind == 'unix':
+			connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			connection.settimeout(self.timeout)
+			connection.connect(target)
+		else:
+			connection = socket.create_connection(target, self.timeout)
+		try:
+			connection.sendall(
+				'{} {} HTTP/1.0\r\nHost: localhost\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n'
+					.format(method, url, len(body)).encode('ascii') + body
+			)
+			chunks = []
+			while True:
+				chunk = connection.recv(65536)
+				if not chunk:
+					break
+				chunks.append(chunk)
+		finally:
+			connection.close()
+
+		(head, _, response_body) = b''.join(chunks).partition(b'\r\n\r\n')
+		try:
+			status = int(head.split(None, 2)[1])
+			data = json.loads(response_body.decode('utf-8'))
+		except (IndexError, ValueError):
+			raise HighlightError('malformed response of the server at ' + self.address)
+		if status != 200:
+			raise HighlightError(data.get('error', 'HTTP status {}'.format(status)))
+		return data
+
+	def is_running(self):
+		"""Return whether a server answers at the address."""
+		try:
+			self.status()
+		except (OSError, ValueError, HighlightError):
+			return False
+		return True
+
+	def status(self):
+		"""Return the statistics of the server, see mmt_server.HighlightService.status."""
+		return self._call('GET', '/status')
+
+	def highlight_batch(self, requests):
+		"""Send several requests at once and return the list of their results in order.
+
+		Raise:
+			OSError if the server is unreachable, HighlightError if it rejected the whole batch
+			(e.g. since it is too large or the server is busy).
+		"""
+		results = self._call('POST', '/highlight', {'requests': list(requests)}).get('results')
+		if not isinstance(results, list):
+			raise HighlightError('malformed response of the server at ' + self.address)
+		return results
+
+	def highlight(self, code, lexer = 'mmt', formatter = 'html', options = None, filters = ()):
+		"""Highlight code and return the formatted output, like pygments.highlight.
+
+		Args:
+			options: Options for both the lexer and the formatter, e.g. {'style': 'mmtdefault'}.
+			filters: A sequence of (filter name, filter options) pairs.
+		"""
+		(result,) = self.highlight_batch([{
+			'code': code,
+			'lexer': lexer,
+			'formatter': formatter,
+			'options': options or {},
+			'filters': [list(entry) for entry in filters]
+		}])
+		if 'error' in result:
+			raise HighlightError(result['error'])
+		return result['output']
+
+def _parse_options(option_strings):
+	"""Parse -O arguments like pygmentize does."""
+	options = {}
+	for option_string in option_strings:
+		for argument in option_string.split(','):
+			argument = argument.strip()
+			if not argument:
+				continue
+			if '=' in argument:
+				(key, value) = argument.split('=', 1)
+				options[key.strip()] = value.strip()
+			else:
+				options[argument] = True
+	return options
+
+def prerendered_filename(request):
+	"""Return the file name under which the output of a highlight request is pre-rendered.
+
+	The name is a hash of everything the output depends on (code, lexer, formatter, options
+	and filters), but not of the output encoding.
+	"""
+	key = json.dumps([
+		request['code'], request['lexer'], request['formatter'],
+		request.get('options', {}), request.get('filters', [])
+	], sort_keys = True)
+	return 'mmtpygments-' + hashlib.sha1(key.encode('utf-8')).hexdigest() + '.pygtex'
+
+def parse_pygmentize_args(args):
+	"""Parse pygmentize arguments as far as the client supports them.
+
+	Return:
+		A tuple (flags, options, filters, positional arguments), where flags maps the flags
+		other than -O, -P and -F to their values and options are the merged -O and -P options,
+		or None if the arguments are to be left to pygmentize.
+	"""
+	try:
+		(parsed_args, positional_args) = getopt.getopt(args, 'l:f:F:o:O:P:LS:a:N:vhVHgsx')
+	except getopt.GetoptError:
+		return None
+
+	option_strings = []
+	single_options = []
+	filters = []
+	flags = {}
+	for (flag, value) in parsed_args:
+		if flag == '-O':
+			option_strings.append(value)
+		elif flag == '-P':
+			single_options.append(value)
+		elif flag == '-F':
+			(name, _, filter_options) = value.partition(':')
+			filters.append([name, _parse_options([filter_options])])
+		else:
+			flags[flag] = value
+
+	supported = {'-l', '-f', '-o', '-S', '-a'}
+	if '-S' in flags:
+		unsupported = '-l' in flags or '-o' in flags or bool(positional_args)
+	else:
+		unsupported = '-l' not in flags or '-a' in flags or len(positional_args) > 1
+	if unsupported or set(flags) - supported or '-f' not in flags:
+		# Guessing, listings, help, usage errors etc.
+		return None
+
+	# Like pygmentize, -P options override -O options
+	options = _parse_options(option_strings)
+	for single_option in single_options:
+		(key, separator, value) = single_option.partition('=')
+		options[key] = value if separator else True
+	return (flags, options, filters, positional_args)
+
+def _read_prerendered(request, out_filename):
+	try:
+		path = os.path.join(os.path.dirname(out_filename), prerendered_filename(request))
+		with open(path, 'rb') as prerendered_file:
+			return prerendered_file.read().decode('utf-8')
+	except (OSError, UnicodeDecodeError):
+		return None
+
+def _run_pygmentize(args):
+	from pygments.cmdline import main as pygmentize_main
+
+	return pygmentize_main(['pygmentize'] + args)
+
+def _run_locally(request):
+	from .mmt_server import HighlightService
+
+	return HighlightService(warm = False).handle(request)
+
+def main(args = None):
+	"""Entry point of `mmtpygmentize-client`, see the module docstring."""
+	args = sys.argv[1:] if args is None else args
+	parsed = parse_pygmentize_args(args)
+	if parsed is None or not SERVER_OPTIONS.issuperset(parsed[1]):
+		# Guessing, listings, help, usage errors, options the server rejects etc.: leave it to pygmentize
+		return _run_pygmentize(args)
+	(flags, options, filters, positional_args) = parsed
+
+	inencoding = options.get('inencoding', options.get('encoding'))
+	outencoding = options.get('outencoding', options.get('encoding'))
+	if '-S' in flags:
+		request = {'style_defs': flags['-S'], 'formatter': flags['-f'], 'options': options, 'arg': flags.get('-a', '')}
+	else:
+		if positional_args:
+			try:
+				with open(positional_args[0], 'rb') as input_file:
+					code = input_file.read()
+			except OSError:
+				# let pygmentize report it
+				return _run_pygmentize(args)
+		else:
+			code = sys.stdin.buffer.read()
+		try:
+			code = code.decode(inencoding or 'utf-8')
+			inencoding = inencoding or 'utf-8'
+		except (UnicodeDecodeError, LookupError):
+			if positional_args:
+				return _run_pygmentize(args)
+			(code, inencoding) = (code.decode('latin1'), 'latin1')
+
+		# The output encoding pygmentize would choose, e.g. for the charset of HTML documents
+		if not outencoding:
+			outencoding = inencoding if '-o' in flags else (getattr(sys.stdout, 'encoding', None) or 'utf-8')
+		request = {
+			'code': code, 'lexer': flags['-l'], 'formatter': flags['-f'],
+			'options': options, 'filters': filters, 'encoding': outencoding
+		}
+
+	prerendered = _read_prerendered(request, flags['-o']) if '-o' in flags and '-S' not in flags else None
+	if prerendered is not None:
+		result = {'output': prerendered}
+	else:
+		client = HighlightClient()
+		try:
+			(result,) = client.highlight_batch([request])
+		except (OSError, HighlightError, ValueError):
+			# No server running, server busy, malformed response etc.: never fail the build for it
+			result = _run_locally(request)
+
+	if 'error' in result:
+		print('Error: ' + result['error'], file = sys.stderr)
+		return 1
+
+	output = result['output']
+	if '-S' in flags:
+		# pygmentize prints the style definitions
+		output += '\n'
+
+	if '-o' in flags:
+		with open(flags['-o'], 'wb') as output_file:
+			output_file.write(output.encode(outencoding))
+	elif outencoding:
+		sys.stdout.buffer.write(output.encode(outencoding))
+	else:
+		sys.stdout.write(output)
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+	Combined Master Regexes for MMT Lexer States
+	============================================
+
+	Merges the rules of every lexer state into one alternation per state, such that
+	finding the rule that matches at a position takes one call into the regex engine
+	instead of up to one per rule, see the `combined` option of MMTLexer.
+
+	:author: ComFreek <comfreek@outlook.com>
+	:copyright: Copyright 2020 ComFreek
+	:license: ISC, see LICENSE for details.
+"""
+
+import re
+
+from pygments.token import _TokenType
+
+from .mmt_engine import ERROR_TOKEN, NEWLINE_TOKEN, apply_new_state
+
+__all__ = ['combine_rules', 'combine_tokendefs', 'match_segments', 'get_tokens_combined']
+
+# Constructs whose meaning changes once the regex is embedded into a larger one:
+# numbered backreferences, named groups (and references to them), conditionals and
+# global inline flags. Rules containing them (or anything looking like them) are kept
+# as they are.
+_UNCOMBINABLE = re.compile(r'\\[1-9]|\(\?P|\(\?\(|\(\?[aiLmsux-]*\)')
+
+_Pattern = type(re.compile(''))
+
+def _combinable_pattern(rexmatch):
+	"""Return the compiled regex of a rule if it can be embedded into a master regex, else None."""
+	pattern = getattr(rexmatch, '__self__', None)
+	if type(pattern) is not _Pattern or rexmatch != pattern.match:
+		# e.g. rules guarded by the option `linear`
+		return None
+	if not isinstance(pattern.pattern, str) or _UNCOMBINABLE.search(pattern.pattern):
+		return None
+	return pattern
+
+def _compile(regex, flags):
+	try:
+		from .mmt_regex_cache import compile_regex
+	except ImportError:
+		return re.compile(regex, flags)
+	return compile_regex(regex, flags) or re.compile(regex, flags)
+
+def _entry(index, offset, rexmatch, action, new_state):
+	token = action if type(action) is _TokenType else None
+	groups = getattr(action, 'group_token_types', None)
+	if groups is not None and not all(group is None or type(group) is _TokenType for group in groups):
+		# bygroups with nested callbacks, call it on the rule's own match
+		groups = None
+	return (index, offset, rexmatch, token, groups, action, new_state)
+
+def combine_rules(rules, indices = None, combine = True):
+	"""Merge runs of combinable rules of one state into master regexes.
+
+	Every rule becomes the alternative `(...)` of its run, in order. Since the alternatives of
+	a regex are tried in order at the same position, the master regex matches the same text as
+	the first matching rule of the run would. The wrapping group of that rule is the last group
+	closed by the match, hence it is given by m.lastindex and the rule's own groups follow it.
+
+	Args:
+		rules:   The processed rules of a state, i.e. (rexmatch, action, new state) triples.
+		indices: The indices of rules within their state, by default their positions in rules.
+		combine: If false, every rule becomes a single rule segment.
+
+	Return:
+		A tuple of segments to be tried in order. A segment is either a pair (master rexmatch,
+		entries), where entries maps m.lastindex to the matched rule, or (None, entry) for a
+		single rule. Entries are tuples (rule index, group offset, rexmatch, token type, group
+		token types, action, new state), the group offset being the number of the wrapping group
+		of the rule (0 for single rules).
+	"""
+	segments = []
+	run = []
+
+	def flush():
+		if len(run) == 1:
+			(index, pattern, action, new_state) = run[0]
+			segments.append((None, _entry(index, 0, pattern.match, action, new_state)))
+		elif run:
+			alternatives = []
+			entries = [None]
+			for (index, pattern, action, new_state) in run:
+				alternatives.append('(' + pattern.pattern + ')')
+				entries.append(_entry(index, len(entries), pattern.match, action, new_state))
+				entries.extend([None] * pattern.groups)
+			try:
+				master = _compile('|'.join(alternatives), run[0][1].flags)
+			except (re.error, OverflowError, RecursionError):
+				segments.extend(
+					(None, _entry(index, 0, pattern.match, action, new_state))
+					for (index, pattern, action, new_state) in run
+				)
+			else:
+				segments.append((master.match, tuple(entries)))
+		del run[:]
+
+	for (index, (rexmatch, action, new_state)) in zip(indices or range(len(rules)), rules):
+		pattern = _combinable_pattern(rexmatch) if combine else None
+		if pattern is None:
+			flush()
+			segments.append((None, _entry(index, 0, rexmatch, action, new_state)))
+		else:
+			if run and run[0][1].flags != pattern.flags:
+				flush()
+			run.append((index, pattern, action, new_state))
+	flush()
+
+	return tuple(segments)
+
+def combine_tokendefs(tokendefs):
+	"""Return the segments (see combine_rules) of every state of the processed rules of a RegexLexer (its _tokens)."""
+	return {state: combine_rules(rules) for (state, rules) in tokendefs.items()}
+
+def match_segments(segments, text, pos):
+	"""Return (match, entry) for the first rule of segments (see combine_rules) matching at pos, None if none does.
+
+	The match is the one of the rule's segment, i.e. of its master regex if it has one.
+	"""
+	for (master, entries) in segments:
+		if master is None:
+			m = entries[2](text, pos)
+			if m:
+				return (m, entries)
+		else:
+			m = master(text, pos)
+			if m:
+				return (m, entries[m.lastindex])
+	return None
+
+def get_tokens_combined(lexer, text, stack = ('root',)):
+	"""Lex text like RegexLexer.get_tokens_unprocessed, but with one master regex call per segment.
+
+	Args:
+		lexer: A RegexLexer instance with the attribute _combined as returned by combine_tokendefs.
+	"""
+	pos = 0
+	combined = lexer._combined
+	statestack = list(stack)
+	segments = combined[statestack[-1]]
+	while 1:
+		for (master, entries) in segments:
+			if master is None:
+				entry = entries
+				m = entry[2](text, pos)
+				if not m:
+					continue
+			else:
+				m = master(text, pos)
+				if not m:
+					continue
+				entry = entries[m.lastindex]
+
+			(_, offset, rexmatch, token, groups, action, new_state) = entry
+			if token is not None:
+				yield pos, token, m.group(offset)
+			elif groups is not None:
+				# inlined bygroups, relative to the rule's wrapping group
+				for (group, group_token) in enumerate(groups, offset + 1):
+					if group_token is not None:
+						data = m.group(group)
+						if data:
+							yield m.start(group), group_token, data
+			elif action is not None:
+				if offset:
+					# Arbitrary callbacks get the match object of the rule itself
+					m = rexmatch(text, pos)
+				yield from action(lexer, m)
+			pos = m.end()
+
+			if new_state is not None:
+				apply_new_state(statestack, new_state)
+				segments = combined[statestack[-1]]
+			break
+		else:
+			# No rule matched, mirror RegexLexer's error recovery
+			try:
+				if text[pos] == '\n':
+					statestack = ['root']
+					segments = combined['root']
+					yield pos, NEWLINE_TOKEN, '\n'
+					pos += 1
+					continue
+				yield pos, ERROR_TOKEN, text[pos]
+				pos += 1
+			except IndexError:
+				break
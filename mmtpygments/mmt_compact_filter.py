@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+	Token Stream Compaction Filter
+	==============================
+
+	Pygments filter merging adjacent tokens of the same type and dropping empty ones,
+	registered as `mmtcompact` and enabled on MMT lexers by the option `compact`.
+
+	MMTLexer emits a separate Whitespace token for every whitespace group of its rules
+	and many tiny adjacent tokens of the same type in module bodies and expressions.
+	Formatters render merged tokens the same, but with proportionally less work.
+
+	:author: ComFreek <comfreek@outlook.com>
+	:copyright: Copyright 2020 ComFreek
+	:license: ISC, see LICENSE for details.
+"""
+
+import sys
+
+from pygments.filter import Filter
+from pygments.util import get_bool_opt
+
+__all__ = ['CompactFilter']
+
+class CompactFilter(Filter):
+	"""
+	Merges adjacent tokens of the same type and drops empty tokens
+
+	Unlike Pygments' `tokenmerge` filter, it also drops empty tokens (which would
+	otherwise separate tokens of the same type) and counts the tokens it receives and
+	yields over all streams it filtered in the attributes `num_input_tokens` and
+	`num_output_tokens`.
+
+	Options accepted:
+
+	`report`
+		Write the token count reduction to stderr after every stream (default: False).
+	"""
+
+	def __init__(self, **options):
+		Filter.__init__(self, **options)
+		self.report_streams = get_bool_opt(options, 'report', False)
+		self.num_input_tokens = 0
+		self.num_output_tokens = 0
+
+	def filter(self, lexer, stream):
+		num_input_tokens = 0
+		num_output_tokens = 0
+		current_type = None
+		current_values = []
+		try:
+			for (num_input_tokens, (ttype, value)) in enumerate(stream, 1):
+				if not value:
+					continue
+				if ttype is current_type:
+					current_values.append(value)
+				else:
+					if current_values:
+						num_output_tokens += 1
+						yield (current_type, current_values[0] if len(current_values) == 1 else ''.join(current_values))
+					current_type = ttype
+					current_values = [value]
+			if current_values:
+				num_output_tokens += 1
+				yield (current_type, current_values[0] if len(current_values) == 1 else ''.join(current_values))
+		finally:
+			# also when the consumer stops early
+			self.num_input_tokens += num_input_tokens
+			self.num_output_tokens += num_output_tokens
+			if self.report_streams:
+				self.report(num_input_tokens, num_output_tokens)
+
+	@property
+	def reduction(self):
+		"""The fraction of tokens saved over all streams filtered so far (0.0 if none)."""
+		if not self.num_input_tokens:
+			return 0.0
+		return 1.0 - self.num_output_tokens / self.num_input_tokens
+
+	def report(self, num_input_tokens = None, num_output_tokens = None, file = sys.stderr):
+		"""Write the token count reduction of a stream (by default: of all streams so far) to file."""
+		if num_input_tokens is None:
+			(num_input_tokens, num_output_tokens) = (self.num_input_tokens, self.num_output_tokens)
+		file.write('mmtcompact: {} tokens -> {} tokens ({:.1f}% fewer)\n'.format(
+			num_input_tokens, num_output_tokens,
+			100.0 * (1.0 - num_output_tokens / num_input_tokens) if num_input_tokens else 0.0
+		))
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+	Delimiting MMT Rules by a Delimiter Position Index
+	==================================================
+
+	Replacements for the rules of MMTLexer that match everything up to the next
+	delimiter (❘, ❙ or ❚), see the `delimited` option of MMTLexer.
+
+	Instead of scanning character classes like [^❘❙❚]* character by character, the
+	replacements look up where the match ends in an index of all delimiter positions
+	of the input, built in a single pass. Their match objects are the very same as
+	the regexes' ones, but are obtained by matching .* up to that end, which the
+	regex engine does without looking at the characters in between.
+
+	:author: ComFreek <comfreek@outlook.com>
+	:copyright: Copyright 2020 ComFreek
+	:license: ISC, see LICENSE for details.
+"""
+
+from bisect import bisect_left
+import re
+
+__all__ = ['DELIMITERS', 'DelimiterPositions', 'DELIMITED_RULES', 'delimited_tokendefs']
+
+DELIMITERS = '❘❙❚'
+
+# Matching everything up to endpos in constant time
+_SPAN = re.compile(r'.*', re.DOTALL).match
+
+class DelimiterPositions:
+	"""
+	Index of the positions of all delimiters in a text
+
+	The index is built upon the first lookup in a text, with one str.find pass per delimiter,
+	and reused as long as lookups are for the same text (i.e. the same string object). The
+	sorted positions of every set of delimiters looked up are kept as well, such that any
+	lookup is a single binary search.
+	"""
+
+	def __init__(self):
+		self.text = None
+		self.positions = {}
+
+	def reset(self, text):
+		if text is not self.text:
+			self.text = text
+			self.positions = {}
+			for delimiter in DELIMITERS:
+				positions = self.positions[delimiter] = []
+				pos = text.find(delimiter)
+				while pos >= 0:
+					positions.append(pos)
+					pos = text.find(delimiter, pos + 1)
+
+	def next(self, delimiters, pos):
+		"""Return the position of the next occurrence of any of delimiters at or after pos, None if there is none."""
+		positions = self.positions.get(delimiters)
+		if positions is None:
+			positions = self.positions[delimiters] = sorted(
+				position for delimiter in delimiters for position in self.positions[delimiter]
+			)
+		index = bisect_left(positions, pos)
+		return positions[index] if index < len(positions) else None
+
+def _up_to(delimiters):
+	"""Rule matching up to (excl.) the next of delimiters or the end of the text, like [^❘❙❚]*."""
+	def match(index, text, pos):
+		end = index.next(delimiters, pos)
+		return _SPAN(text, pos, len(text) if end is None else end)
+	return match
+
+def _through(delimiter, stops = ''):
+	"""Rule matching through the next delimiter if no stop occurs before, like [^❚]*?❙."""
+	def match(index, text, pos):
+		end = index.next(delimiter, pos)
+		if end is None:
+			return None
+		if stops:
+			stop = index.next(stops, pos)
+			if stop is not None and stop < end:
+				return None
+		return _SPAN(text, pos, end + 1)
+	return match
+
+def _unknown_structural_feature(index, text, pos):
+	"""Rule matching like [^❙❚]*?=[^❚]*?❚: an = before the next ❙ and ❚, then through the next ❚."""
+	stop = index.next('❙❚', pos)
+	equals = text.find('=', pos, len(text) if stop is None else stop)
+	if equals < 0:
+		return None
+	end = index.next('❚', equals + 1)
+	return None if end is None else _SPAN(text, pos, end + 1)
+
+# Replacements of rules of MMTLexer.tokens (matched with the flags of MMTLexer), keyed by their regexes.
+# Rules starting with a fixed prefix (comments, annotations) are left alone: they fail on their
+# first character in most attempts, which the regex engine is faster at than any lookup.
+DELIMITED_RULES = {
+	# expression
+	r'[^❘❙❚]*': _up_to('❘❙❚'),
+
+	# root, moduleBody and constantDeclaration: graceful degradation
+	r'[^❚]*?❚': _through('❚'),
+	r'[^❚]*?❙': _through('❙', '❚'),
+	r'[^❙❚]*?=[^❚]*?❚': _unknown_structural_feature,
+}
+
+def _delimited(rexmatch, rule, index):
+	def match(text, pos):
+		if text is not index.text:
+			index.reset(text)
+		return rule(index, text, pos)
+	match.__wrapped__ = rexmatch
+	return match
+
+def delimited_tokendefs(tokendefs, rules = DELIMITED_RULES):
+	"""Return a copy of the processed rules of a RegexLexer (its _tokens) with rules replaced.
+
+	All replacements share one DelimiterPositions. Rules already guarded by the option `linear`
+	(see mmt_linear.py) are replaced as well, the replacements fail immediately anyway.
+	"""
+	index = DelimiterPositions()
+	def replace(rexmatch):
+		unguarded = getattr(rexmatch, '__wrapped__', rexmatch)
+		if unguarded.__self__.pattern in rules:
+			return _delimited(unguarded, rules[unguarded.__self__.pattern], index)
+		return rexmatch
+
+	return {
+		state: [(replace(rexmatch), action, new_state) for (rexmatch, action, new_state) in rules_of_state]
+		for (state, rules_of_state) in tokendefs.items()
+	}
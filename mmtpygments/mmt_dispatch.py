@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+	First-Character Dispatch for MMT Lexer States
+	=============================================
+
+	Computes from the rules' regexes which rules of a state can possibly match at a
+	given character, such that all others are skipped without running their regex,
+	see the `dispatch` option of MMTLexer.
+
+	:author: ComFreek <comfreek@outlook.com>
+	:copyright: Copyright 2020 ComFreek
+	:license: ISC, see LICENSE for details.
+"""
+
+from .mmt_combined import combine_rules
+from .mmt_engine import ERROR_TOKEN, NEWLINE_TOKEN, apply_new_state
+
+try:
+	from re import _compiler as sre_compile, _parser as sre_parse # Python 3.11+
+except ImportError:
+	import sre_compile, sre_parse
+
+__all__ = ['FirstCharIndex', 'first_char_matchers', 'get_tokens_dispatched']
+
+# Opcodes consuming exactly one character
+_SINGLE_CHAR_OPS = (sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.IN, sre_parse.ANY)
+# Zero-width opcodes, skipping them only allows for more first characters
+_ZERO_WIDTH_OPS = (sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT)
+_REPEAT_OPS = tuple(
+	getattr(sre_parse, name) for name in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT')
+	if hasattr(sre_parse, name)
+)
+
+def _first_items(items):
+	"""Return the single-character items one of which a match of items must start with.
+
+	Return:
+		A pair (list of (opcode, argument) items, whether items may match the empty string),
+		or None if unknown.
+	"""
+	firsts = []
+	for (op, av) in items:
+		if op in _SINGLE_CHAR_OPS:
+			firsts.append((op, av))
+			return (firsts, False)
+		elif op in _ZERO_WIDTH_OPS:
+			continue
+		elif op is sre_parse.SUBPATTERN:
+			(_, add_flags, del_flags, subpattern) = av
+			if add_flags or del_flags:
+				# Scoped flags, e.g. (?i:...), would have to be applied to the items
+				return None
+			result = _first_items(subpattern.data)
+		elif op is getattr(sre_parse, 'ATOMIC_GROUP', None):
+			result = _first_items(av.data)
+		elif op is sre_parse.BRANCH:
+			(results, nullable) = ([], False)
+			for alternative in av[1]:
+				result = _first_items(alternative.data)
+				if result is None:
+					return None
+				results.extend(result[0])
+				nullable = nullable or result[1]
+			result = (results, nullable)
+		elif op in _REPEAT_OPS:
+			(minimum, _, subpattern) = av
+			result = _first_items(subpattern.data)
+			if result is not None and minimum == 0:
+				result = (result[0], True)
+		else:
+			# e.g. backreferences
+			return None
+
+		if result is None:
+			return None
+		firsts.extend(result[0])
+		if not result[1]:
+			return (firsts, False)
+	return (firsts, True)
+
+def first_char_matchers(pattern):
+	"""Return matchers for the first character of matches of a compiled regex.
+
+	Return:
+		A pair (list of rexmatch functions matching a single character, nullable), where
+		a match of pattern must start with a character matched by one of the functions
+		unless nullable, i.e. pattern may match the empty string. None if unknown.
+	"""
+	try:
+		parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+		result = _first_items(parsed.data)
+		if result is None:
+			return None
+		state = getattr(parsed, 'state', None) or parsed.pattern # Python 3.6, 3.7: pattern
+		matchers = [
+			sre_compile.compile(sre_parse.SubPattern(state, [item]), pattern.flags).match
+			for item in result[0]
+		]
+	except Exception:
+		# Unsupported regexes or Python implementations
+		return None
+	return (matchers, result[1])
+
+class FirstCharIndex:
+	"""
+	Per state, a table from characters to the ordered segments of rules that can match there
+
+	Rules that can match the empty string or whose first characters are unknown (catch-all
+	rules) are part of every bucket. The table is filled lazily upon the first occurrence
+	of every character in every state, the bucket of the empty string '' is used at the end
+	of the input.
+
+	Args:
+		tokendefs: The processed rules of a RegexLexer (its _tokens).
+		combined:  Whether to merge the rules of every bucket into master regexes
+		           (see mmt_combined.py) instead of trying them one by one.
+	"""
+
+	def __init__(self, tokendefs, combined = False):
+		self.tokendefs = tokendefs
+		self.combined = combined
+		self.buckets = {state: {} for state in tokendefs}
+		# Most characters share their bucket with many others, e.g. all letters not starting a keyword
+		self._segments = {}
+		self._matchers = {
+			state: [
+				first_char_matchers(getattr(rexmatch, '__wrapped__', rexmatch).__self__)
+				if hasattr(getattr(rexmatch, '__wrapped__', rexmatch), '__self__') else None
+				for (rexmatch, _, _) in rules
+			]
+			for (state, rules) in tokendefs.items()
+		}
+
+	def _may_match(self, matchers, c):
+		if matchers is None:
+			return True
+		(first_matchers, nullable) = matchers
+		return nullable or (c != '' and any(match(c) for match in first_matchers))
+
+	def rule_indices(self, state, c):
+		"""Return the indices of the rules of state that can possibly match at character c."""
+		return [
+			index for (index, matchers) in enumerate(self._matchers[state])
+			if self._may_match(matchers, c)
+		]
+
+	def bucket(self, state, c):
+		"""Return (and memoize) the segments (see mmt_combined.combine_rules) of state at character c."""
+		indices = tuple(self.rule_indices(state, c))
+		segments = self._segments.get((state, indices))
+		if segments is None:
+			rules = self.tokendefs[state]
+			segments = combine_rules([rules[index] for index in indices], indices, self.combined)
+			self._segments[(state, indices)] = segments
+		self.buckets[state][c] = segments
+		return segments
+
+def get_tokens_dispatched(lexer, text, stack = ('root',)):
+	"""Lex text like RegexLexer.get_tokens_unprocessed, but only try the rules that can match at the current character.
+
+	Args:
+		lexer: A RegexLexer instance with the attribute _first_char_index, a FirstCharIndex.
+	"""
+	pos = 0
+	index = lexer._first_char_index
+	buckets = index.buckets
+	text_length = len(text)
+	statestack = list(stack)
+	state = statestack[-1]
+	state_buckets = buckets[state]
+	while 1:
+		c = text[pos] if pos < text_length else ''
+		segments = state_buckets.get(c)
+		if segments is None:
+			segments = index.bucket(state, c)
+
+		for (master, entries) in segments:
+			if master is None:
+				entry = entries
+				m = entry[2](text, pos)
+				if not m:
+					continue
+			else:
+				m = master(text, pos)
+				if not m:
+					continue
+				entry = entries[m.lastindex]
+
+			(_, offset, rexmatch, token, groups, action, new_state) = entry
+			if token is not None:
+				yield pos, token, m.group(offset)
+			elif groups is not None:
+				# inlined bygroups, relative to the rule's wrapping group
+				for (group, group_token) in enumerate(groups, offset + 1):
+					if group_token is not None:
+						data = m.group(group)
+						if data:
+							yield m.start(group), group_token, data
+			elif action is not None:
+				if offset:
+					m = rexmatch(text, pos)
+				yield from action(lexer, m)
+			pos = m.end()
+
+			if new_state is not None:
+				apply_new_state(statestack, new_state)
+				state = statestack[-1]
+				state_buckets = buckets[state]
+			break
+		else:
+			# No rule matched, mirror RegexLexer's error recovery
+			if not c:
+				break
+			elif c == '\n':
+				statestack = ['root']
+				state = 'root'
+				state_buckets = buckets[state]
+				yield pos, NEWLINE_TOKEN, '\n'
+			else:
+				yield pos, ERROR_TOKEN, c
+			pos += 1
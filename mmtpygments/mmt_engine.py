@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+	State Machine of the MMT Lexing Engines
+	=======================================
+
+	The state transitions and the error recovery of RegexLexer.get_tokens_unprocessed,
+	shared by all alternative engines instead of each mirroring RegexLexer on their own.
+
+	Engines whose speed is the point of their existence (e.g. the option `dispatch`,
+	see get_tokens_dispatched) inline the matching into their own loop and only call
+	apply_new_state upon state transitions. lex_states is the whole loop with the
+	selection and matching of rules left to a callback, for engines where the cost of
+	a callback per step does not matter (e.g. profiling).
+
+	:author: ComFreek <comfreek@outlook.com>
+	:copyright: Copyright 2020 ComFreek
+	:license: ISC, see LICENSE for details.
+"""
+
+from pygments.lexer import RegexLexer
+from pygments.token import Error, _TokenType
+
+__all__ = ['NEWLINE_TOKEN', 'ERROR_TOKEN', 'apply_new_state', 'lex_states', 'rule_tokens', 'match_rules']
+
+class _RecoveryProbe(RegexLexer):
+	tokens = {'root': []}
+
+# Token types of RegexLexer's error recovery: unmatched newlines reset the state to root,
+# any other unmatched character becomes an error token. Newlines are emitted as Text by
+# older Pygments versions and as Whitespace by later ones, hence ask the installed one.
+NEWLINE_TOKEN = next(_RecoveryProbe().get_tokens_unprocessed('\n'))[1]
+ERROR_TOKEN = Error
+
+def apply_new_state(statestack, new_state):
+	"""Apply the new state of a matched rule (as processed by RegexLexer) to statestack in place."""
+	if isinstance(new_state, tuple):
+		for state in new_state:
+			if state == '#pop':
+				if len(statestack) > 1:
+					statestack.pop()
+			elif state == '#push':
+				statestack.append(statestack[-1])
+			else:
+				statestack.append(state)
+	elif isinstance(new_state, int):
+		# pop, but keep at least one state on the stack
+		if abs(new_state) >= len(statestack):
+			del statestack[1:]
+		else:
+			del statestack[new_state:]
+	else:
+		# '#push'
+		statestack.append(statestack[-1])
+
+def lex_states(select, text, pos = 0, stack = ('root',), checkpoint = None, spans = False):
+	"""Lex text like RegexLexer.get_tokens_unprocessed with the rules selected and matched by select.
+
+	Args:
+		select:     Callback select(statestack, text, pos) returning a triple (tokens, end, new state)
+		            for the first rule of the current state statestack[-1] matching at pos, or None
+		            if no rule matches. It must not modify statestack. The tokens are yielded before
+		            the new state (as processed by RegexLexer, or None) is applied.
+		pos:        Position in text to start lexing at.
+		stack:      The state stack at pos.
+		checkpoint: Callback checkpoint(text, start, end, matched) called after every step from
+		            start to end, i.e. every rule match (matched is true) and every character of
+		            the error recovery (matched is false). If it returns true, a checkpoint
+		            (end, None, state stack as a tuple) is yielded.
+		spans:      Whether the tokens of select are spans (start, end, token type) instead of
+		            (position, token type, value) triples, and those of the error recovery as well.
+	"""
+	statestack = list(stack)
+	while 1:
+		selected = select(statestack, text, pos)
+		matched = selected is not None
+		if matched:
+			(tokens, end, new_state) = selected
+			yield from tokens
+			start = pos
+			pos = end
+			if new_state is not None:
+				apply_new_state(statestack, new_state)
+		else:
+			# No rule matched: at the end of a line, reset the state, otherwise emit an error token
+			if pos >= len(text):
+				break
+			if text[pos] == '\n':
+				statestack[:] = ['root']
+				token = NEWLINE_TOKEN
+			else:
+				token = ERROR_TOKEN
+			yield (pos, pos + 1, token) if spans else (pos, token, text[pos])
+			start = pos
+			pos += 1
+
+		if checkpoint is not None and checkpoint(text, start, pos, matched):
+			yield pos, None, tuple(statestack)
+
+def rule_tokens(lexer, m, action):
+	"""Return the tokens of a rule with action for its match m, like RegexLexer."""
+	if action is None:
+		return ()
+	if type(action) is _TokenType:
+		return ((m.start(), action, m.group()),)
+	return action(lexer, m)
+
+def match_rules(lexer, tokendefs = None):
+	"""Return a select callback (see lex_states) trying the rules of the current state in order, like RegexLexer.
+
+	Args:
+		tokendefs: The processed rules to use, by default those of lexer (its _tokens).
+	"""
+	tokendefs = tokendefs if tokendefs is not None else lexer._tokens
+
+	def select(statestack, text, pos):
+		for (rexmatch, action, new_state) in tokendefs[statestack[-1]]:
+			m = rexmatch(text, pos)
+			if m:
+				return (rule_tokens(lexer, m, action), m.end(), new_state)
+		return None
+
+	return select
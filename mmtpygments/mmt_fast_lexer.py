@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+	Fast Pygments Lexer for MMT Surface Syntax
+	==========================================
+
+	Drop-in replacement for :class:`MMTLexer` that emits exactly the same token stream
+	with its own matching loop: bygroups rules are emitted inline and object expressions
+	are lexed in place instead of entering and leaving the `expression` state.
+
+	It still tries the rules of the current state one after another like RegexLexer,
+	i.e. it is not a delimiter-driven scanner. Skipping the rules that cannot match at
+	the current character is what the lexer option `dispatch` does (see mmt_dispatch.py).
+
+	:author: ComFreek <comfreek@outlook.com>
+	:copyright: Copyright 2020 ComFreek
+	:license: ISC, see LICENSE for details.
+"""
+
+import re
+
+from pygments.token import Token, Whitespace, _TokenType
+
+from .mmt_engine import ERROR_TOKEN, NEWLINE_TOKEN, apply_new_state
+from .mmt_lexer import MMTLexer
+
+__all__ = ['MMTFastLexer']
+
+_PUSH_EXPRESSION = ('expression',)
+
+class MMTFastLexer(MMTLexer):
+	"""
+	Fast Pygments Lexer for MMT Surface Syntax
+
+	Emits the very same token stream as :class:`MMTLexer`. It tries the rules of the
+	current state in order like RegexLexer, but inlines bygroups and skips the
+	`expression` state by lexing object expressions in place.
+	"""
+
+	name = 'MMT (fast)'
+	aliases = ['mmtfast']
+	# Not claiming any filenames or mimetypes on purpose: guessing should keep picking MMTLexer
+	filenames = []
+	mimetypes = []
+
+	# Equivalent to entering, running and leaving the `expression` state of MMTLexer.tokens
+	_expression_match = re.compile(r'(\s*)([^❘❙❚]*)', MMTLexer.flags).match
+
+	def __init__(self, **options):
+		super().__init__(**options)
+
+		cls = type(self)
+		if '_tokens' in self.__dict__:
+			# Rules specific to this instance, e.g. by the option `linear`
+			self._fast_rules = self._rules(self._tokens)
+		elif '_fast_rules' not in cls.__dict__:
+			cls._fast_rules = self._rules(self._tokens)
+
+	@staticmethod
+	def _rules(tokendefs):
+		"""Return a dict mapping every state to its rules (rexmatch, token type, group token types, action, new state).
+
+		Token type is set for plain token rules, group token types for bygroups rules; for any other
+		callback both are None and action is called.
+		"""
+		return {
+			state: tuple(
+				(rexmatch, action if type(action) is _TokenType else None, getattr(action, 'group_token_types', None), action, new_state)
+				for (rexmatch, action, new_state) in rules
+			)
+			for (state, rules) in tokendefs.items()
+		}
+
+	def get_tokens_unprocessed(self, text, stack=('root',)):
+		pos = 0
+		fast_rules = self._fast_rules
+		expression_match = self._expression_match
+		text_length = len(text)
+		statestack = list(stack)
+		rules = fast_rules[statestack[-1]]
+
+		while 1:
+			for (rexmatch, token, groups, action, new_state) in rules:
+				m = rexmatch(text, pos)
+				if m:
+					if token is not None:
+						yield pos, token, m.group()
+					elif groups is not None:
+						# inlined bygroups
+						for (group, group_token) in enumerate(groups, 1):
+							if group_token is not None:
+								data = m.group(group)
+								if data:
+									yield m.start(group), group_token, data
+					elif action is not None:
+						yield from action(self, m)
+					pos = m.end()
+
+					if new_state is None:
+						pass
+					elif new_state == _PUSH_EXPRESSION:
+						# The expression state is left right after its object expression,
+						# hence lex it in place instead of pushing and popping
+						m = expression_match(text, pos)
+						(whitespace, expression) = m.groups()
+						if whitespace:
+							yield pos, Whitespace, whitespace
+						yield m.start(2), Token.MMT_ObjectExpression, expression
+						pos = m.end()
+					else:
+						apply_new_state(statestack, new_state)
+						rules = fast_rules[statestack[-1]]
+					break
+			else:
+				# No rule matched, mirror RegexLexer's error recovery
+				if pos >= text_length:
+					break
+				elif text[pos] == '\n':
+					statestack = ['root']
+					rules = fast_rules['root']
+					yield pos, NEWLINE_TOKEN, '\n'
+				else:
+					yield pos, ERROR_TOKEN, text[pos]
+				pos += 1
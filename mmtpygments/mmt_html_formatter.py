@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+	Fast HTML Formatter for MMT Token Streams
+	=========================================
+
+	Drop-in replacement for Pygments' :class:`HtmlFormatter` writing exactly the same
+	HTML, but with little work per token: tokens are formatted in batches whose values
+	are escaped at once, opening tags come from a precomputed token type table (incl.
+	the MMT delimiter types), the HTML between two tags from a table as well, such that
+	adjacent tokens with the same tag share a span. Without line-wise wrappers (line
+	numbers, line anchors, highlighted lines), whole batches instead of single lines
+	are passed on, and the output is written in large blocks.
+
+	The batches replicate HtmlFormatter._format_lines of specific Pygments versions
+	(see REPLICATED_PYGMENTS_VERSIONS), on all others HtmlFormatter formats the tokens.
+
+	:author: ComFreek <comfreek@outlook.com>
+	:copyright: Copyright 2020 ComFreek
+	:license: ISC, see LICENSE for details.
+"""
+
+from itertools import islice
+from operator import itemgetter
+import re
+
+import pygments
+from pygments.formatters.html import HtmlFormatter
+from pygments.token import STANDARD_TYPES, Token
+
+__all__ = ['MMTHtmlFormatter', 'REPLICATED_PYGMENTS_VERSIONS']
+
+# Pygments versions (major.minor) whose HtmlFormatter._format_lines is replicated, e.g. later
+# versions omit the empty span before line breaks and support the option debug_token_types
+REPLICATED_PYGMENTS_VERSIONS = ('2.7',)
+
+# Options of HtmlFormatter the batches do not implement
+_UNSUPPORTED_OPTIONS = ('tagsfile', 'debug_token_types')
+
+# Token types of MMTLexer outside of Pygments' standard types
+MMT_TOKEN_TYPES = (Token.MMT_MD, Token.MMT_DD, Token.MMT_OD, Token.MMT_ObjectExpression)
+
+# Characters that HtmlFormatter escapes
+_NEEDS_ESCAPE = re.compile('[&<>"\']').search
+
+def _escape(text):
+	"""Escape text like pygments.formatters.html.escape_html, but faster on long texts."""
+	return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;').replace("'", '&#39;')
+
+_TTYPE = itemgetter(0)
+_VALUE = itemgetter(1)
+
+# Number of tokens formatted at once
+_BATCH_SIZE = 4096
+
+# Size of the writes to the output file
+_WRITE_BUFFER_SIZE = 64 * 1024
+
+class _Table(dict):
+	"""Dictionary computing missing values by compute(key) on first access."""
+
+	def __init__(self, compute):
+		super().__init__()
+		self.compute = compute
+
+	def __missing__(self, key):
+		value = self[key] = self.compute(key)
+		return value
+
+class _BufferedOutput:
+	"""Collects writes to outfile until _WRITE_BUFFER_SIZE characters are reached."""
+
+	def __init__(self, outfile):
+		self.outfile = outfile
+		self.pieces = []
+		self.size = 0
+
+	def write(self, piece):
+		self.pieces.append(piece)
+		self.size += len(piece)
+		if self.size >= _WRITE_BUFFER_SIZE:
+			self.flush()
+
+	def flush(self):
+		if self.pieces:
+			self.outfile.write(''.join(self.pieces))
+			self.pieces = []
+			self.size = 0
+
+	def __getattr__(self, name):
+		# e.g. outfile.name for the option cssfile
+		return getattr(self.outfile, name)
+
+class MMTHtmlFormatter(HtmlFormatter):
+	"""
+	HTML formatter yielding the same output as HtmlFormatter, only faster
+
+	All options of HtmlFormatter are accepted. With the options `tagsfile` or
+	`debug_token_types` and on Pygments versions not in REPLICATED_PYGMENTS_VERSIONS,
+	the tokens are formatted by HtmlFormatter itself.
+	"""
+
+	name = 'MMT HTML'
+	aliases = ['mmthtml']
+	filenames = []
+
+	def __init__(self, **options):
+		super().__init__(**options)
+		self.replicated = (
+			'.'.join(pygments.__version__.split('.')[:2]) in REPLICATED_PYGMENTS_VERSIONS
+			and not any(options.get(option) for option in _UNSUPPORTED_OPTIONS)
+		)
+		# token type -> opening tag ('' for none), other types are added on their first occurrence
+		self.ttype2span = _Table(self._get_span)
+		if self.replicated:
+			for ttype in set(STANDARD_TYPES) | {ttype for (ttype, _) in self.style} | set(MMT_TOKEN_TYPES):
+				self.ttype2span[ttype] = self._get_span(ttype)
+		# tag -> tag -> HTML in between (None: a line break), see _transition
+		self.transitions = _Table(lambda previous: _Table(lambda span: self._transition(previous, span)))
+
+	def _get_span(self, ttype):
+		"""Return the opening tag HtmlFormatter._format_lines uses for tokens of type ttype."""
+		if self.noclasses:
+			getcls = self.ttype2class.get
+			cclass = getcls(ttype)
+			while cclass is None:
+				ttype = ttype.parent
+				cclass = getcls(ttype)
+			return cclass and '<span style="%s">' % self.class2style[cclass][0] or ''
+		cls = self._get_css_classes(ttype)
+		return cls and '<span class="%s">' % cls or ''
+
+	def _needs_lines(self):
+		"""Return whether some wrapper processes the output line by line."""
+		return bool(
+			self.hl_lines or (not self.nowrap and (self.linenos or self.lineanchors or self.linespans))
+			or type(self).wrap is not HtmlFormatter.wrap
+		)
+
+	def _transition(self, previous, span):
+		"""Return the HTML between a segment with tag previous and one with tag span (None: a line break)."""
+		if previous == span and span is not None:
+			return ''
+		close = '</span>' if previous else ''
+		return close + (self.lineseparator if span is None else span)
+
+	def _render(self, tokens, previous):
+		"""Format a batch of tokens like HtmlFormatter._format_lines.
+
+		Args:
+			previous: The tag of the last segment of the batch before, None at the start of a line.
+
+		Return:
+			A pair of the HTML and the tag of the last segment.
+		"""
+		values = list(map(_VALUE, tokens))
+		if '' in values:
+			# HtmlFormatter does not output anything for empty tokens either
+			tokens = [token for token in tokens if token[1]]
+			if not tokens:
+				return ('', previous)
+			values = list(map(_VALUE, tokens))
+		spans = list(map(self.ttype2span.__getitem__, map(_TTYPE, tokens)))
+
+		# escape all values at once
+		text = '\0'.join(values)
+		if _NEEDS_ESCAPE(text):
+			if text.count('\0') == len(values) - 1:
+				values = _escape(text).split('\0')
+			else:
+				values = list(map(_escape, values))
+
+		# HtmlFormatter closes the open tag at every line end and reopens it in the next line, hence
+		# tokens containing newlines are split into their lines with a line break segment in between
+		if '\n' in text:
+			(segment_spans, segment_values) = ([], [])
+			start = 0
+			for index in [index for (index, value) in enumerate(values) if '\n' in value]:
+				segment_spans += spans[start:index]
+				segment_values += values[start:index]
+				span = spans[index]
+				parts = values[index].split('\n')
+				# like HtmlFormatter, write an empty tag before a line break if the line is not empty
+				if parts[0] or (segment_spans[-1] if segment_spans else previous) is not None:
+					segment_spans.append(span)
+					segment_values.append(parts[0])
+				for part in parts[1:]:
+					segment_spans.append(None)
+					segment_values.append('')
+					if part:
+						segment_spans.append(span)
+						segment_values.append(part)
+				start = index + 1
+			segment_spans += spans[start:]
+			segment_values += values[start:]
+			(spans, values) = (segment_spans, segment_values)
+
+		if not spans:
+			return ('', previous)
+		# the HTML between consecutive segments, interleaved with the segments
+		pieces = [None] * (2 * len(spans))
+		pieces[::2] = map(dict.__getitem__, map(self.transitions.__getitem__, [previous] + spans[:-1]), spans)
+		pieces[1::2] = values
+		return (''.join(pieces), spans[-1])
+
+	def _format_lines(self, tokensource):
+		"""Format the tokens like HtmlFormatter._format_lines, yielding several lines at once if possible."""
+		single_lines = self._needs_lines()
+		if not self.replicated or (single_lines and self.lineseparator != '\n'):
+			yield from super()._format_lines(tokensource)
+			return
+
+		tokens = iter(tokensource)
+		previous = None
+		incomplete_line = ''
+		while True:
+			batch = list(islice(tokens, _BATCH_SIZE))
+			if batch:
+				(html, previous) = self._render(batch, previous)
+			elif previous is not None:
+				# like HtmlFormatter, close the last line even without a trailing newline
+				(html, previous) = (self.transitions[previous][None], None)
+			else:
+				break
+
+			if not single_lines:
+				if html:
+					yield (1, html)
+				continue
+			lines = (incomplete_line + html).split('\n')
+			incomplete_line = lines.pop()
+			for line in lines:
+				yield (1, line + '\n')
+
+	def format_unencoded(self, tokensource, outfile):
+		buffered = _BufferedOutput(outfile)
+		super().format_unencoded(tokensource, buffered)
+		buffered.flush()
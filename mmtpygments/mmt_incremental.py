@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+	Incremental Lexing of MMT Surface Syntax
+	========================================
+
+	Keeps the tokens of an MMT document up to date under edits by re-lexing only from
+	the last state checkpoint before an edit until the lexer state converges with the
+	previous run again.
+
+	:author: ComFreek <comfreek@outlook.com>
+	:copyright: Copyright 2020 ComFreek
+	:license: ISC, see LICENSE for details.
+"""
+
+from collections import namedtuple
+
+from pygments.token import _TokenType
+
+from .mmt_engine import ERROR_TOKEN, NEWLINE_TOKEN, apply_new_state
+from .mmt_lexer import MMTLexer
+from .mmt_scan_reach import scan_reach
+
+__all__ = ['MMTIncrementalLexer', 'TokenDelta', 'get_tokens_with_checkpoints']
+
+# Module and declaration delimiters after which a checkpoint is recorded
+CHECKPOINT_DELIMITERS = '❚❙'
+
+def get_tokens_with_checkpoints(lexer, text, pos = 0, stack = ('root',), delimiters = CHECKPOINT_DELIMITERS, reach = False):
+	"""Lex text like RegexLexer.get_tokens_unprocessed, but starting at an arbitrary position and state.
+
+	Args:
+		lexer: A RegexLexer instance whose rules to use, e.g. MMTLexer().
+		text:  The text to lex. It is used verbatim, i.e. without the preprocessing done
+		       by Lexer.get_tokens (newline normalization, stripping etc.).
+		pos:   Position in text to start lexing at.
+		stack: The state stack at pos.
+		delimiters: The characters after which checkpoints are recorded, None for a checkpoint
+		       after every rule match and every step of the error recovery.
+		reach: Whether checkpoints also tell how far the rules tried since the previous
+		       checkpoint (or pos) looked ahead, see below.
+
+	Yield:
+		Tokens as (index, tokentype, value) triples as RegexLexer.get_tokens_unprocessed does.
+		Interspersed are checkpoints as (index, None, stack) triples: every time a rule match
+		ends with one of delimiters, the position after it and the state stack (a tuple) in
+		effect there are yielded. With reach, checkpoints are (index, None, (stack, scanned))
+		triples instead, where text[scanned:] has not been examined by any rule tried since
+		the previous checkpoint (see mmt_scan_reach.py).
+	"""
+	tokendefs = lexer._tokens
+	reaches = {rexmatch: scan_reach(rexmatch) for rules in tokendefs.values() for (rexmatch, _, _) in rules} if reach else None
+	scanned = pos
+	statestack = list(stack)
+	statetokens = tokendefs[statestack[-1]]
+	while 1:
+		if reaches is not None:
+			# every step examines at least the character at pos
+			c = text[pos:pos + 1]
+			scanned = max(scanned, pos + 1)
+		for rexmatch, action, new_state in statetokens:
+			if reaches is not None:
+				(bound, first, rule_reach) = reaches[rexmatch]
+				if pos + bound >= scanned and first.get(c, True):
+					scanned = rule_reach(text, pos, scanned)
+			m = rexmatch(text, pos)
+			if m:
+				if action is not None:
+					if type(action) is _TokenType:
+						yield pos, action, m.group()
+					else:
+						yield from action(lexer, m)
+				pos = m.end()
+				if new_state is not None:
+					apply_new_state(statestack, new_state)
+					statetokens = tokendefs[statestack[-1]]
+
+				if delimiters is None or (pos > m.start() and text[pos - 1] in delimiters):
+					yield pos, None, tuple(statestack) if reaches is None else (tuple(statestack), scanned)
+					scanned = pos
+				break
+		else:
+			# No rule matched, mirror RegexLexer's error recovery
+			if pos >= len(text):
+				break
+			elif text[pos] == '\n':
+				statestack = ['root']
+				statetokens = tokendefs['root']
+				yield pos, NEWLINE_TOKEN, '\n'
+			else:
+				yield pos, ERROR_TOKEN, text[pos]
+			pos += 1
+			if delimiters is None:
+				yield pos, None, tuple(statestack) if reaches is None else (tuple(statestack), scanned)
+				scanned = pos
+
+# Replace tokens[start:end] of the previous token list by the list `tokens`
+TokenDelta = namedtuple('TokenDelta', ['start', 'end', 'tokens'])
+
+class MMTIncrementalLexer:
+	"""
+	Incremental lexer for MMT documents, e.g. for editors and previews
+
+	Lexes the document once and records checkpoints -- position, token index and
+	state stack -- after every module delimiter (❚) and declaration delimiter (❙),
+	together with how far the rules tried before each checkpoint looked ahead.
+	Upon an edit, lexing restarts at the last checkpoint before the edit none of whose
+	preceding rules looked at the edited text, and stops as soon as it reaches a
+	checkpoint after the edit whose state stack equals the one of the previous run at
+	the same (shifted) position. From there on, the previous tokens are reused.
+
+	Usage:
+
+		incremental = MMTIncrementalLexer(text)
+		delta = incremental.edit(start, end, replacement)
+		# incremental.tokens now equals the old token list with
+		# old_tokens[delta.start:delta.end] replaced by delta.tokens
+
+	Positions are indices into the document text, which is lexed verbatim (no
+	newline normalization or stripping as in Lexer.get_tokens).
+	"""
+
+	def __init__(self, text, lexer = None):
+		"""
+		Args:
+			text:  The initial document text.
+			lexer: The RegexLexer whose rules to use, by default a new MMTLexer.
+		"""
+		self.lexer = lexer if lexer is not None else MMTLexer()
+		self._text = text
+
+		(tokens, checkpoints, _, _) = self._lex_from(0, 0, ('root',), 0)
+
+		# All tokens as (tokentype, value) pairs
+		self.tokens = tokens
+
+		# Checkpoints in parallel lists, sorted by offset, always starting with the
+		# initial state at offset 0
+		self._offsets = [offset for (offset, _, _, _) in checkpoints]
+		self._token_indices = [index for (_, index, _, _) in checkpoints]
+		self._stacks = [stack for (_, _, stack, _) in checkpoints]
+		# How far the rules tried between the previous checkpoint and this one looked ahead,
+		# relative to this one (hence unaffected by shifts), and the maximum of all of them
+		self._reaches = [reach for (_, _, _, reach) in checkpoints]
+		self._max_reach = max(self._reaches)
+
+		# Edits shift all following checkpoints. Instead of updating them on every edit,
+		# the shift is kept pending: checkpoints from _shift_index on are off by
+		# _shift_offset and _shift_tokens. Moving _shift_index to the next edit only
+		# touches the checkpoints in between.
+		self._shift_index = len(self._offsets)
+		self._shift_offset = 0
+		self._shift_tokens = 0
+
+	@property
+	def text(self):
+		return self._text
+
+	def checkpoints(self):
+		"""Return all checkpoints as (offset, token index, stack) triples."""
+		self._move_shift(len(self._offsets))
+		return list(zip(self._offsets, self._token_indices, self._stacks))
+
+	def _offset(self, i):
+		return self._offsets[i] + (self._shift_offset if i >= self._shift_index else 0)
+
+	def _token_index(self, i):
+		return self._token_indices[i] + (self._shift_tokens if i >= self._shift_index else 0)
+
+	def _bisect(self, offset):
+		"""Return the index of the first checkpoint at or after offset."""
+		(low, high) = (0, len(self._offsets))
+		while low < high:
+			middle = (low + high) // 2
+			if self._offset(middle) < offset:
+				low = middle + 1
+			else:
+				high = middle
+		return low
+
+	def _move_shift(self, index):
+		"""Apply the pending shift to all checkpoints between index and _shift_index."""
+		(offsets, token_indices) = (self._offsets, self._token_indices)
+		(shift_offset, shift_tokens) = (self._shift_offset, self._shift_tokens)
+
+		for i in range(self._shift_index, index):
+			offsets[i] += shift_offset
+			token_indices[i] += shift_tokens
+		for i in range(index, self._shift_index):
+			offsets[i] -= shift_offset
+			token_indices[i] -= shift_tokens
+
+		self._shift_index = index
+
+	def _lex_from(self, offset, token_index, stack, reach, converge_at = None):
+		"""Lex self._text from a checkpoint on.
+
+		Args:
+			offset, token_index, stack, reach: The checkpoint to start at.
+			converge_at: A function called on every checkpoint (offset, stack) reached, returning
+			             True if lexing can stop there. None for lexing until the end.
+
+		Return:
+			A quadruple (tokens, checkpoints, converged_offset, converged_reach) of the new tokens,
+			the new checkpoints as (offset, token_index, stack, reach) quadruples, the offset at which
+			lexing converged (None if lexing ran until the end) and the reach of the checkpoint there.
+		"""
+		tokens = []
+		checkpoints = [(offset, token_index, stack, reach)]
+
+		for (index, tokentype, value) in get_tokens_with_checkpoints(self.lexer, self._text, offset, stack, reach = True):
+			if tokentype is None:
+				# value is the stack at checkpoint index and how far the rules before it looked ahead
+				(stack, scanned) = value
+				if converge_at is not None and converge_at(index, stack):
+					return (tokens, checkpoints, index, scanned - index)
+				checkpoints.append((index, token_index + len(tokens), stack, scanned - index))
+			else:
+				tokens.append((tokentype, value))
+
+		return (tokens, checkpoints, None, None)
+
+	def edit(self, start, end, replacement):
+		"""Replace text[start:end] by replacement and update the tokens.
+
+		Return:
+			A TokenDelta naming the range of the previous token list that got replaced
+			and the tokens replacing it.
+		"""
+		old_text = self._text
+		old_tokens = self.tokens
+		stacks = self._stacks
+		num_checkpoints = len(stacks)
+
+		if not (0 <= start <= end <= len(old_text)):
+			raise ValueError('Invalid edit range [{}, {})'.format(start, end))
+
+		self._text = old_text[:start] + replacement + old_text[end:]
+		delta = len(replacement) - (end - start)
+
+		# Restart at the last checkpoint at or before the edit such that no rule tried before it
+		# looked at the edited text. Rules may look far ahead even across checkpoints, e.g. the
+		# rule for `import` failing at `import a❚ x y❚` looks up to the `y`. Only the checkpoints
+		# less than _max_reach before the edit can have been looked beyond.
+		restart = self._bisect(start + 1) - 1
+		i = restart
+		while i > 0 and self._offset(i) + self._max_reach > start:
+			if self._offset(i) + self._reaches[i] > start:
+				restart = i - 1
+			i -= 1
+
+		# Old checkpoints at or after the end of the edit are candidates for convergence
+		# (but never the initial one)
+		candidate = max(self._bisect(end), 1)
+
+		def converge_at(offset, stack):
+			nonlocal candidate
+
+			old_offset = offset - delta
+			while candidate < num_checkpoints and self._offset(candidate) < old_offset:
+				candidate += 1
+			return candidate < num_checkpoints and self._offset(candidate) == old_offset \
+				and stacks[candidate] == stack
+
+		token_start = self._token_index(restart)
+		(tokens, checkpoints, converged_offset, converged_reach) = self._lex_from(
+			self._offset(restart), token_start, stacks[restart], self._reaches[restart], converge_at
+		)
+
+		if converged_offset is None:
+			# Lexed until the end
+			(old_token_end, old_checkpoint_end) = (len(old_tokens), num_checkpoints)
+		else:
+			(old_token_end, old_checkpoint_end) = (self._token_index(candidate), candidate)
+			# The rules before the converged checkpoint ran on the new text
+			self._reaches[candidate] = converged_reach
+
+		# Splice in the new checkpoints, the following ones are shifted lazily
+		self._move_shift(old_checkpoint_end)
+		self._offsets[restart:old_checkpoint_end] = [offset for (offset, _, _, _) in checkpoints]
+		self._token_indices[restart:old_checkpoint_end] = [index for (_, index, _, _) in checkpoints]
+		self._stacks[restart:old_checkpoint_end] = [stack for (_, _, stack, _) in checkpoints]
+		self._reaches[restart:old_checkpoint_end] = [reach for (_, _, _, reach) in checkpoints]
+		self._max_reach = max([self._max_reach, converged_reach or 0] + self._reaches[restart:restart + len(checkpoints)])
+
+		self._shift_index = restart + len(checkpoints)
+		self._shift_offset += delta
+		self._shift_tokens += len(tokens) - (old_token_end - token_start)
+
+		# Narrow the delta down to the tokens that actually changed
+		replaced = old_tokens[token_start:old_token_end]
+		common = min(len(tokens), len(replaced))
+		prefix = 0
+		while prefix < common and tokens[prefix] == replaced[prefix]:
+			prefix += 1
+		suffix = 0
+		while suffix < common - prefix and tokens[-1 - suffix] == replaced[-1 - suffix]:
+			suffix += 1
+
+		old_tokens[token_start:old_token_end] = tokens
+
+		return TokenDelta(token_start + prefix, old_token_end - suffix, tokens[prefix:len(tokens) - suffix])
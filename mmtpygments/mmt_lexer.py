@@ -10,11 +10,13 @@
 	:license: ISC, see LICENSE for details.
 """
 
-import re, sys
+import os, re, sys
 
+from pygments.filter import apply_filters
 from pygments.lexer import RegexLexer
 from pygments.token import Comment, Generic, Keyword, Literal, \
 	Name, Number, Punctuation, String, Token, Whitespace
+from pygments.util import get_bool_opt, get_int_opt
 
 __all__ = ['MMTLexer']
 
@@ -25,7 +27,9 @@ __all__ = ['MMTLexer']
 # It changes the behavior of the bygroups wrapper directly below:
 # upon conversion mode, the bygroups arguments are simply output as a tuple itself
 # (for post-processing by the conversion happening in __main__); upon normal mode,
-# calls are delegated to Pygment's true bygroups function.
+# calls are delegated to Pygment's true bygroups function. The resulting callback
+# additionally exposes the bygroups arguments as `group_token_types` for alternative
+# lexing engines (e.g. MMTFastLexer) that emit the groups themselves.
 IS_CONVERSION_MODE = False
 
 def bygroups(*bygroup_args):
@@ -35,10 +39,12 @@ def bygroups(*bygroup_args):
 	if IS_CONVERSION_MODE:
 		return bygroup_args
 	else:
-		return pygments.lexer.bygroups(*bygroup_args)
+		callback = pygments.lexer.bygroups(*bygroup_args)
+		callback.group_token_types = bygroup_args
+		return callback
 
 # Use this for debugging
-if __name__ == "__main__" and sys.argv[1] == 'convert':
+if __name__ == "__main__" and sys.argv[1:2] == ['convert']:
 	IS_CONVERSION_MODE = True
 
 class MMTLexer(RegexLexer):
@@ -47,6 +53,47 @@ class MMTLexer(RegexLexer):
 
 	The MMT project can be found at https://uniformal.github.io/.
 
+	Additional options accepted:
+
+	`cachedir`
+		Directory of an on-disk token cache (see mmt_token_cache.py). If set, get_tokens
+		looks up the tokens of previously lexed inputs there instead of lexing them again.
+		Defaults to the environment variable MMTPYGMENTS_CACHE_DIR, if set, and to no
+		caching otherwise.
+
+	`cachesize`
+		Maximum size of the token cache in MiB (default: 100).
+
+	`profile`
+		Collect per-(state, rule) statistics on match attempts, hits and time spent into
+		a LexerProfile (see mmt_profile.py), available as the attribute `profile` afterwards.
+		Either True or a LexerProfile to share between lexers. Defaults to profiling into a
+		process-wide profile if the environment variable MMTPYGMENTS_PROFILE is set to a
+		file, into which collapsed state stacks for flame graphs are written upon exit.
+		Profiling lexes with the plain RegexLexer algorithm (also for MMTFastLexer) and
+		disables the token cache. When disabled, it does not cost anything.
+
+	`linear`
+		Guard the rules scanning ahead to some delimiter (comments, graceful degradation
+		etc.) by a lookup of the next delimiter (see mmt_linear.py), such that they fail
+		immediately if their delimiter is missing. The tokens stay the same, but lexing
+		malformed input (e.g. missing ❚) takes linear instead of quadratic time. Slightly
+		slower on well-formed input (default: False).
+
+	`delimited`
+		Match the rules ending at the next ❘, ❙ or ❚ (object expressions, comments, graceful
+		degradation etc.) by lookups in an index of all delimiter positions of the input,
+		built in a single pass (see mmt_delimited.py), instead of scanning for the delimiter
+		in every state. The tokens stay the same, but delimiting long object expressions
+		takes constant time. Combines with `linear` (default: False).
+
+	`compact`
+		Merge adjacent tokens of the same type (e.g. the whitespace groups of consecutive
+		rules) and drop empty tokens by a CompactFilter (see mmt_compact_filter.py), after
+		all other filters. Rendered output stays the same with fewer tokens to process.
+		`compact=report` additionally writes the token count reduction of every input
+		to stderr (default: False).
+
 	:author: ComFreek <comfreek@outlook.com>
 	:copyright: Copyright 2020 ComFreek
 	:license: ISC, see LICENSE for details.
@@ -67,6 +114,134 @@ class MMTLexer(RegexLexer):
 
 	flags = re.DOTALL | re.UNICODE | re.IGNORECASE | re.MULTILINE
 
+	@classmethod
+	def _process_regex(cls, regex, rflags, state):
+		# Called by RegexLexerMeta upon the first instantiation to compile all rules,
+		# take the compiled regexes from the opt-in table persisted across processes if possible
+		if isinstance(regex, str) and os.environ.get('MMTPYGMENTS_REGEX_CACHE') not in ('', '0'):
+			try:
+				from .mmt_regex_cache import compile_regex
+			except ImportError: # e.g. when running this file as a script
+				pass
+			else:
+				pattern = compile_regex(regex, rflags)
+				if pattern is not None:
+					return pattern.match
+		return type(cls)._process_regex(cls, regex, rflags, state)
+
+	def __init__(self, **options):
+		super().__init__(**options)
+
+		self.cachedir = options.get('cachedir', os.environ.get('MMTPYGMENTS_CACHE_DIR'))
+		self.cachesize = get_int_opt(options, 'cachesize', 100)
+		# The TokenCache of cachedir, created upon first use
+		self._token_cache = None
+
+		compact = options.get('compact', False)
+		if compact == 'report' or get_bool_opt(options, 'compact', False):
+			from .mmt_compact_filter import CompactFilter
+			self.add_filter(CompactFilter(report = compact == 'report'))
+
+		if get_bool_opt(options, 'linear', False):
+			from .mmt_linear import linear_tokendefs
+			self._tokens = linear_tokendefs(self._tokens)
+
+		if get_bool_opt(options, 'delimited', False):
+			from .mmt_delimited import delimited_tokendefs
+			self._tokens = delimited_tokendefs(self._tokens)
+
+		if get_bool_opt(options, 'dispatch', False):
+			from .mmt_dispatch import FirstCharIndex, get_tokens_dispatched
+
+			# The index fills up lazily, hence share it between all lexers with the same rules
+			combined = get_bool_opt(options, 'combined', False)
+			cls = type(self)
+			attribute = '_first_char_index_combined' if combined else '_first_char_index'
+			if '_tokens' in self.__dict__:
+				self._first_char_index = FirstCharIndex(self._tokens, combined)
+			else:
+				if attribute not in cls.__dict__:
+					setattr(cls, attribute, FirstCharIndex(self._tokens, combined))
+				self._first_char_index = getattr(cls, attribute)
+
+			self.get_tokens_unprocessed = lambda text, stack = ('root',): \
+				get_tokens_dispatched(self, text, stack)
+
+		elif get_bool_opt(options, 'combined', False):
+			from .mmt_combined import combine_tokendefs, get_tokens_combined
+
+			cls = type(self)
+			if '_tokens' in self.__dict__:
+				# Rules specific to this instance, e.g. by the option `linear`
+				self._combined = combine_tokendefs(self._tokens)
+			elif '_combined' not in cls.__dict__:
+				cls._combined = combine_tokendefs(self._tokens)
+
+			self.get_tokens_unprocessed = lambda text, stack = ('root',): \
+				get_tokens_combined(self, text, stack)
+
+		self.profile = None
+		if 'profile' in options or os.environ.get('MMTPYGMENTS_PROFILE'):
+			from .mmt_profile import LexerProfile, get_tokens_profiled, global_profile
+
+			if isinstance(options.get('profile'), LexerProfile):
+				self.profile = options['profile']
+			elif get_bool_opt(options, 'profile', False):
+				self.profile = LexerProfile()
+			elif 'profile' not in options:
+				self.profile = global_profile(os.environ['MMTPYGMENTS_PROFILE'])
+
+		if self.profile is not None:
+			self.cachedir = None
+
+			# Shadow get_tokens_unprocessed on this instance only, such that unprofiled
+			# lexers run the very same code as without profiling support
+			self.get_tokens_unprocessed = lambda text, stack = ('root',): \
+				get_tokens_profiled(self, text, stack)
+
+	def get_token_array(self, text):
+		"""Return the tokens of text as a compact TokenArray (see mmt_token_array.py).
+
+		It equals list(self.get_tokens(text)), but takes only a fraction of its memory.
+		"""
+		from .mmt_token_array import TokenArray
+
+		return TokenArray.lex(self, text)
+
+	def get_tokens(self, text, unfiltered = False):
+		"""Return an iterable of (tokentype, value) pairs of text.
+
+		Besides str and bytes, text may also be a file object (text or binary) or an mmap object,
+		which is then lexed in bounded windows (see mmt_streaming.py) yielding tokens as they are
+		lexed. Binary files are decoded with the option `encoding` or as UTF-8 if it is to be guessed.
+		"""
+		if hasattr(text, 'read'):
+			from .mmt_streaming import stream_tokens
+
+			stream = stream_tokens(self, text)
+			if not unfiltered:
+				stream = apply_filters(stream, self.filters, self)
+			return stream
+
+		if not self.cachedir:
+			return super().get_tokens(text, unfiltered)
+
+		cache = self._token_cache
+		if cache is None or cache.directory != self.cachedir:
+			from .mmt_token_cache import TokenCache
+
+			cache = self._token_cache = TokenCache(self.cachedir, self.cachesize * 1024 * 1024)
+		key = cache.key(self, text)
+		tokens = cache.load(key)
+		if tokens is None:
+			tokens = list(super().get_tokens(text, unfiltered = True))
+			cache.store(key, tokens)
+
+		stream = iter(tokens)
+		if not unfiltered:
+			stream = apply_filters(stream, self.filters, self)
+		return stream
+
 	tokens = {
 		'root': [
 			(r'\s+', Whitespace),
@@ -409,21 +584,37 @@ if __name__ == "__main__":
 	
 	# if you change the conditions here, also change it way above the MMTLexer class
 	# in the code snippet that sets IS_CONVERSION_MODE to true.
-	elif len(sys.argv) == 4 and sys.argv[1] == 'convert':
+	elif len(sys.argv) in (4, 5) and sys.argv[1] == 'convert':
+		from pygments_regex_analyzer import RegexRiskError, format_report
+
+		max_regex_risk = sys.argv[4] if len(sys.argv) == 5 else 'medium'
 		if sys.argv[2] == 'rouge':
 			from pygments_to_rouge import PygmentsToRougeConverter
-			converter = PygmentsToRougeConverter()
+			converter = PygmentsToRougeConverter(max_regex_risk)
 		elif sys.argv[2] == 'codemirror':
 			from pygments_to_codemirror import PygmentsToCodeMirrorConverter
-			converter = PygmentsToCodeMirrorConverter()
+			converter = PygmentsToCodeMirrorConverter(max_regex_risk)
+		elif sys.argv[2] == 'python':
+			from pygments_to_python import PygmentsToPythonConverter
+			converter = PygmentsToPythonConverter(max_regex_risk)
 
 		out_filename = sys.argv[3]
-	
+
+		try:
+			converted = converter.transform(MMTLexer)
+		except RegexRiskError as error:
+			print('Refusing to convert, {}'.format(error), file=sys.stderr)
+			sys.exit(1)
+
 		with io.open(out_filename, mode="w", newline="\n", encoding="utf-8") as converted_lexer:
-			converted_lexer.write(converter.transform(
-				MMTLexer
-			))
+			converted_lexer.write(converted)
+		if converter.regex_findings:
+			print(format_report(converter.regex_findings))
 		print('Successfully converted, see `{}`'.format(out_filename))
+	elif len(sys.argv) == 2 and sys.argv[1] == 'analyze':
+		from pygments_regex_analyzer import analyze_lexer, format_report
+
+		print(format_report(analyze_lexer(MMTLexer)))
 	else:
 		print("Usage\n==========")
 		print(" a) `{} debug in-filename` to debug this Pygments lexer`".format(sys.argv[0]))
@@ -431,5 +622,11 @@ if __name__ == "__main__":
 		print("")
 		print(" b) `{} convert rouge out-filename` to convert this Pygments lexer to a Rouge lexer".format(sys.argv[0]))
 		print(" c) `{} convert codemirror out-filename` to convert this Pygments lexer to a CodeMirror lexer (aka 'CodeMirror mode')".format(sys.argv[0]))
+		print(" d) `{} convert python out-filename` to convert this Pygments lexer to a standalone Python module".format(sys.argv[0]))
+		print("    without dependencies (e.g. for indexing services that only need token spans)")
+		print("    All of them refuse to convert if the lexer's regexes risk catastrophic backtracking, pass")
+		print("    none, low, medium (default) or high as additional argument for the maximum risk to accept.")
+		print("")
+		print(" e) `{} analyze` to report rules prone to backtracking or not advancing the input".format(sys.argv[0]))
 
 		sys.exit(1)
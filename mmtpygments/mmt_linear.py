@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+	Linear-time Lexing of Malformed MMT Surface Syntax
+	==================================================
+
+	Guards for the rules of MMTLexer that scan ahead to some delimiter, see the
+	`linear` option of MMTLexer.
+
+	:author: ComFreek <comfreek@outlook.com>
+	:copyright: Copyright 2020 ComFreek
+	:license: ISC, see LICENSE for details.
+"""
+
+import re
+
+__all__ = ['DelimiterIndex', 'LINEAR_GUARDS', 'linear_tokendefs']
+
+_WHITESPACE = re.compile(r'\s', re.UNICODE)
+_NON_WHITESPACE = re.compile(r'\S', re.UNICODE)
+
+class DelimiterIndex:
+	"""
+	Lookup of the next occurrence of delimiters in a text
+
+	Results are memoized per delimiter as the interval of positions they hold for,
+	hence queries at increasing positions (as a lexer does) scan every delimiter's
+	text only once in total.
+	"""
+
+	def __init__(self):
+		self.text = None
+		self._next = {}
+
+	def reset(self, text):
+		if text is not self.text:
+			self.text = text
+			self._next = {}
+
+	def next(self, delimiter, pos):
+		"""Return the position of the next occurrence of delimiter at or after pos, None if there is none.
+
+		Args:
+			delimiter: A string, or a compiled regex matching single characters (e.g. whitespace).
+		"""
+		(start, found) = self._next.get(delimiter, (1, 0))
+		if not start <= pos <= found:
+			if isinstance(delimiter, str):
+				found = self.text.find(delimiter, pos)
+			else:
+				m = delimiter.search(self.text, pos)
+				found = m.start() if m else -1
+			if found < 0:
+				found = len(self.text)
+			self._next[delimiter] = (pos, found)
+		return found if found < len(self.text) else None
+
+def _requires(*delimiters):
+	"""Guard for rules that can only match if any of delimiters occurs at or after the position."""
+	def guard(index, pos):
+		return any(index.next(delimiter, pos) is not None for delimiter in delimiters)
+	return guard
+
+def _requires_before(delimiter, stop):
+	"""Guard for rules that can only match if delimiter occurs at or after the position before any stop."""
+	def guard(index, pos):
+		found = index.next(delimiter, pos)
+		stop_found = index.next(stop, pos)
+		return found is not None and (stop_found is None or found < stop_found)
+	return guard
+
+def _requires_after_word(delimiter):
+	"""Guard for rules starting with `(\\S+)(\\s*)(delimiter)`: delimiter must occur within the word at
+	the position or right after the whitespace following it."""
+	def guard(index, pos):
+		found = index.next(delimiter, pos + 1)
+		if found is None:
+			return False
+		word_end = index.next(_WHITESPACE, pos)
+		return word_end is None or found < word_end or index.next(_NON_WHITESPACE, word_end) == found
+	return guard
+
+def _requires_all(*guards):
+	def guard(index, pos):
+		return all(guard(index, pos) for guard in guards)
+	return guard
+
+# Necessary conditions for rules of MMTLexer.tokens to match, keyed by their regexes.
+# Without them, these rules scan until the end of the text when their delimiter is missing,
+# and since upon failure the lexer advances by a single character only, lexing malformed
+# input (e.g. a missing ❚) takes quadratic time.
+LINEAR_GUARDS = {
+	# Comments
+	r'\/T .*?❚': _requires('❚'),
+	r'\/\/.*?❚': _requires('❚'),
+	r'\/T .*?(❙|❚)': _requires('❙', '❚'),
+	r'\/\/.*?(❙|❚)': _requires('❙', '❚'),
+
+	# Directives and declarations ended by a delimiter
+	r'(meta)(\s+)(\S+)(\s+)([^❚]+)(\s*)(❚)': _requires('❚'),
+	r'(namespace)(\s+)(\S+?)(\s*)(❚)': _requires('❚'),
+	r'(import)(\s+)(\S+)(\s+)(\S+?)(\s*)(❚)': _requires('❚'),
+	r'(fixmeta|ref|rule)(\s+)(\S+?)(\s*)(❚)': _requires('❚'),
+	r'(@_description)(\s+)([^❙])+(❙)': _requires('❙'),
+	r'(meta)(\s+)(\S+)(\s+)([^❙❚]+)(\s*)(❙)': _requires('❙'),
+	r'(include)(\s+)([^❙]+)(❙)': _requires('❙'),
+	r'(rule)(\s+)([^❙]+)(\s*)(❙)': _requires('❙'),
+	r'(realize)(\s+)([^❙]+)(\s*)(❙)': _requires('❙'),
+	r'(#+)([^❙]+)(❙)': _requires('❙'),
+	r'(\S+)(\s*)(:)(\s*)(\S+)(\s*)(->|→)(\s*)([^\s❚=]+)': _requires_all(_requires_after_word(':'), _requires('->', '→')),
+
+	# Graceful degradation
+	r'[^❚]*?❚': _requires('❚'),
+	r'[^❚]*?❙': _requires_before('❙', '❚'),
+	r'[^❙❚]*?=[^❚]*?❚': _requires_all(_requires_before('=', '❙'), _requires_before('=', '❚'), _requires('❚')),
+}
+
+def _guarded(rexmatch, guard, index):
+	def match(text, pos):
+		index.reset(text)
+		return rexmatch(text, pos) if guard(index, pos) else None
+	match.__wrapped__ = rexmatch
+	return match
+
+def linear_tokendefs(tokendefs, guards = LINEAR_GUARDS):
+	"""Return a copy of the processed rules of a RegexLexer (its _tokens) with guards applied.
+
+	All guards of the returned rules share one DelimiterIndex.
+	"""
+	index = DelimiterIndex()
+	return {
+		state: [
+			(
+				_guarded(rexmatch, guards[rexmatch.__self__.pattern], index)
+				if rexmatch.__self__.pattern in guards else rexmatch,
+				action,
+				new_state
+			)
+			for (rexmatch, action, new_state) in rules
+		]
+		for (state, rules) in tokendefs.items()
+	}
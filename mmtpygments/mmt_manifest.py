@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+	Manifest of Batch Highlighting Results
+	======================================
+
+	Records per input file its content hash, the fingerprint of the code that
+	processed it, its error status and its output file, such that later batch runs
+	(see mmt_batch.py) only process changed or new files and remove the outputs of
+	files that disappeared.
+
+	:author: ComFreek <comfreek@outlook.com>
+	:copyright: Copyright 2020 ComFreek
+	:license: ISC, see LICENSE for details.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import tempfile
+
+import pygments
+
+from .mmt_token_cache import lexer_fingerprint
+
+__all__ = ['Manifest', 'code_fingerprint', 'file_digest']
+
+# Increase upon any change of the manifest's format
+MANIFEST_FORMAT_VERSION = 1
+
+def code_fingerprint(*lexer_classes):
+	"""Return a hex digest identifying lexer_classes and the code of this package.
+
+	Besides the lexers' rules (see mmt_token_cache.lexer_fingerprint), it covers all modules of
+	this package (formatters, converters etc.) and the Pygments version, such that results
+	recorded under the same fingerprint would be produced the very same way again.
+	"""
+	digest = hashlib.sha256()
+	digest.update(pygments.__version__.encode('ascii'))
+	for lexer_class in lexer_classes:
+		digest.update(lexer_fingerprint(lexer_class).encode('ascii'))
+	for module_filename in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py'))):
+		with open(module_filename, 'rb') as module_file:
+			digest.update(os.path.basename(module_filename).encode('utf-8') + b'\0' + module_file.read())
+	return digest.hexdigest()
+
+def file_digest(filename):
+	"""Return the SHA-256 hex digest of the contents of filename."""
+	digest = hashlib.sha256()
+	with open(filename, 'rb') as input_file:
+		for block in iter(lambda: input_file.read(1024 * 1024), b''):
+			digest.update(block)
+	return digest.hexdigest()
+
+class Manifest:
+	"""
+	Per-file results of a batch run, stored as JSON in a file
+
+	Every entry is a dictionary with the keys
+
+	  - hash:         the SHA-256 hex digest of the file's contents
+	  - size, mtime:  the file's size and modification time (ns) when hashed
+	  - fingerprint:  the code_fingerprint under which the file was processed
+	  - out_filename: the output file written for it (None if none)
+	  - out_size:     the size of that output file
+	  - erroneous, diverging, exception, num_lines, num_bytes, num_tokens: see mmt_batch.FileResult
+
+	and possibly further keys added by callers. Entries are only current for unchanged files
+	processed under the same fingerprint, see current_entry.
+	"""
+
+	def __init__(self, filename, fingerprint, entries = None):
+		self.filename = filename
+		self.fingerprint = fingerprint
+		self.entries = entries if entries is not None else {}
+		# filename -> (size, mtime, hash) of the files hashed so far
+		self._digests = {}
+
+	@classmethod
+	def load(cls, filename, fingerprint):
+		"""Return the manifest stored in filename, an empty one if there is none or it is unreadable."""
+		try:
+			with open(filename, 'r', encoding = 'utf-8') as manifest_file:
+				data = json.load(manifest_file)
+			if data.get('format') != MANIFEST_FORMAT_VERSION:
+				raise ValueError('unsupported manifest format {!r}'.format(data.get('format')))
+			return cls(filename, fingerprint, data['files'])
+		except (OSError, ValueError, KeyError, AttributeError):
+			return cls(filename, fingerprint)
+
+	def save(self):
+		"""Write the manifest to its file atomically."""
+		directory = os.path.dirname(os.path.abspath(self.filename))
+		(handle, temp_path) = tempfile.mkstemp(dir = directory, suffix = '.tmp')
+		try:
+			with os.fdopen(handle, 'w', encoding = 'utf-8') as temp_file:
+				json.dump({'format': MANIFEST_FORMAT_VERSION, 'files': self.entries}, temp_file, indent = '\t', sort_keys = True)
+			os.replace(temp_path, self.filename)
+		except BaseException:
+			try:
+				os.remove(temp_path)
+			except OSError:
+				pass
+			raise
+
+	def digest(self, filename):
+		"""Return the content hash of filename, reusing the recorded one if size and modification time are unchanged."""
+		stat = os.stat(filename)
+		entry = self.entries.get(filename)
+		if entry is not None and entry.get('size') == stat.st_size and entry.get('mtime') == stat.st_mtime_ns:
+			return entry['hash']
+		(size, mtime, digest) = self._digests.get(filename, (None, None, None))
+		if (size, mtime) != (stat.st_size, stat.st_mtime_ns):
+			digest = file_digest(filename)
+			self._digests[filename] = (stat.st_size, stat.st_mtime_ns, digest)
+		return digest
+
+	def current_entry(self, filename, require_output = False):
+		"""Return the entry of filename if it is still current, otherwise None.
+
+		An entry is current if the file's contents and the fingerprint did not change and its
+		output file still exists with the recorded size. With require_output, entries without
+		output file are never current.
+		"""
+		entry = self.entries.get(filename)
+		if entry is None or entry.get('fingerprint') != self.fingerprint:
+			return None
+		try:
+			if self.digest(filename) != entry.get('hash'):
+				return None
+		except OSError:
+			return None
+
+		out_filename = entry.get('out_filename')
+		if out_filename is None:
+			return None if require_output else entry
+		try:
+			return entry if os.path.getsize(out_filename) == entry.get('out_size') else None
+		except OSError:
+			return None
+
+	def record(self, filename, **results):
+		"""Record results for filename (hashed now) under the manifest's fingerprint, replacing any previous entry."""
+		stat = os.stat(filename)
+		entry = dict(results, hash = self.digest(filename), size = stat.st_size, mtime = stat.st_mtime_ns, fingerprint = self.fingerprint)
+		out_filename = entry.get('out_filename')
+		entry['out_size'] = os.path.getsize(out_filename) if out_filename is not None else None
+
+		previous_out_filename = self.entries.get(filename, {}).get('out_filename')
+		if previous_out_filename is not None and previous_out_filename != out_filename:
+			_remove(previous_out_filename)
+
+		self.entries[filename] = entry
+		return entry
+
+	def invalidate(self):
+		"""Make all entries not current, such that all files are processed again (and stale outputs still removed)."""
+		for entry in self.entries.values():
+			entry['fingerprint'] = None
+
+	def forget(self, filename):
+		"""Drop the entry of filename such that it is processed again next time."""
+		self.entries.pop(filename, None)
+
+	def prune(self):
+		"""Drop the entries of all files that no longer exist and remove their output files.
+
+		Entries of existing files are kept, also if a run does not process them (e.g. since
+		it was given other paths).
+
+		Return:
+			The list of removed output files.
+		"""
+		removed = []
+		for filename in [filename for filename in self.entries if not os.path.exists(filename)]:
+			out_filename = self.entries.pop(filename).get('out_filename')
+			if out_filename is not None and _remove(out_filename):
+				removed.append(out_filename)
+		return removed
+
+def _remove(filename):
+	try:
+		os.remove(filename)
+		return True
+	except OSError:
+		return False
@@ -0,0 +1,446 @@
+# -*- coding: utf-8 -*-
+"""
+	Batch Pre-Rendering of minted Snippets
+	======================================
+
+	Scans a LaTeX project for the MMT snippets minted would highlight (`minted`
+	environments, `\\mint`, `\\mintinline`, `\\inputminted` and the shortcuts defined by
+	`\\newminted`, `\\newmint`, `\\newmintinline` and `\\newmintedfile`) and highlights all
+	of them on a process pool ahead of the first LaTeX run. Installed as the console
+	script `mmtpygments-minted`.
+
+	minted names its cache files by a hash of the pygmentize command line as expanded
+	by TeX, which cannot be reproduced reliably outside of TeX. Hence, the results are
+	written into minted's cache directory under names derived from the highlight requests
+	(see mmt_client.prerendered_filename), and minted is to call `mmtpygmentize-client`,
+	which copies a pre-rendered result to the output file minted asks for instead of
+	highlighting the snippet. The style definitions (`STYLE.pygstyle`) are written under
+	minted's own names. Starting the client process for every snippet remains.
+
+	:author: ComFreek <comfreek@outlook.com>
+	:copyright: Copyright 2020 ComFreek
+	:license: ISC, see LICENSE for details.
+"""
+
+import argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import io
+import os
+import re
+import sys
+import time
+
+from pygments.formatters.latex import LatexFormatter
+from pygments.styles import get_style_by_name
+
+from .mmt_client import parse_pygmentize_args, prerendered_filename
+from .mmt_server import STYLES, HighlightService
+
+__all__ = ['Snippet', 'Project', 'PrerenderStatistics', 'scan_project', 'snippet_request', 'prerender', 'main']
+
+# The arguments minted (version 2) passes to pygmentize for every snippet
+MINTED_ARGS = ['-f', 'latex', '-P', 'commandprefix=PYG', '-F', 'tokenmerge']
+
+# minted options passed on to pygmentize: -P options and -F filters (with the filter option
+# taking the value). All other options only concern typesetting (fancyvrb).
+MINTED_PYGMENTIZE_OPTIONS = {
+	'encoding': ('-P', 'encoding'),
+	'outencoding': ('-P', 'outencoding'),
+	'escapeinside': ('-P', 'escapeinside'),
+	'mathescape': ('-P', 'mathescape'),
+	'texcl': ('-P', 'texcomments'),
+	'texcomments': ('-P', 'texcomments'),
+	'stripnl': ('-P', 'stripnl'),
+	'stripall': ('-P', 'stripall'),
+	'gobble': ('-F', 'gobble:n'),
+	'codetagify': ('-F', 'codetagify:codetags'),
+	'keywordcase': ('-F', 'keywordcase:case')
+}
+
+# A snippet to highlight
+#
+#  - filename, line:  where it occurs
+#  - kind:            'display', 'inline' or 'file' (\inputminted)
+#  - code:            the code as minted writes it to its temporary file
+#  - options:         the effective minted options as a dictionary
+Snippet = namedtuple('Snippet', ['filename', 'line', 'kind', 'code', 'options'])
+
+# The MMT snippets of a LaTeX project, the cache directory and the styles minted is configured with
+Project = namedtuple('Project', ['snippets', 'cachedir', 'styles'])
+
+PrerenderStatistics = namedtuple('PrerenderStatistics', [
+	'num_snippets', 'num_rendered', 'num_up_to_date', 'num_failed', 'seconds'
+])
+
+_CONTROL_SEQUENCE = re.compile(r'(?<!\\)%[^\n]*|\\([A-Za-z@]+\*?|.)', re.DOTALL)
+
+def _parse_key_values(text):
+	"""Parse a LaTeX key-value list like `a=1,b={x,y},c` into a dictionary."""
+	(entries, depth, current) = ([], 0, '')
+	for c in text:
+		if c == ',' and depth == 0:
+			entries.append(current)
+			current = ''
+			continue
+		depth += (c == '{') - (c == '}')
+		current += c
+	entries.append(current)
+
+	options = {}
+	for entry in entries:
+		(key, separator, value) = entry.partition('=')
+		key = key.strip()
+		if key:
+			value = value.strip()
+			if value.startswith('{') and value.endswith('}'):
+				value = value[1:-1]
+			options[key] = value if separator else 'true'
+	return options
+
+class _Scanner:
+	"""Finds the snippets of one language in LaTeX files, following \\input and \\include."""
+
+	def __init__(self, language, root_directory):
+		self.language = language
+		# TeX resolves all file names relative to the directory of the main document
+		self.root_directory = root_directory
+		self.snippets = []
+		self.package_options = {}
+		self.global_options = {}
+		self.inline_options = {}
+		self.styles = []
+		# shortcut names -> (kind, default options)
+		self.environments = {}
+		self.commands = {}
+		self._visited = set()
+		# (position, line number) of the last snippet in the current file
+		self._line_position = (0, 1)
+
+	def scan_file(self, filename):
+		filename = os.path.normpath(filename)
+		if filename in self._visited:
+			return
+		self._visited.add(filename)
+		with io.open(filename, encoding = 'utf-8') as tex_file:
+			text = tex_file.read()
+		line_position = self._line_position
+		self._scan(filename, text)
+		# back in the including file
+		self._line_position = line_position
+
+	def _optional(self, text, pos, opening = '[', closing = ']'):
+		"""Return (the optional argument at pos or None, position after it)."""
+		match = re.compile(r'\s*' + re.escape(opening)).match(text, pos)
+		if not match:
+			return (None, pos)
+		end = text.find(closing, match.end())
+		if end < 0:
+			return (None, pos)
+		return (text[match.end():end], end + 1)
+
+	def _group(self, text, pos):
+		"""Return (the braced argument at pos or None, position after it)."""
+		match = re.compile(r'\s*\{').match(text, pos)
+		if not match:
+			return (None, pos)
+		(depth, end) = (1, match.end())
+		while end < len(text) and depth:
+			depth += (text[end] == '{') - (text[end] == '}')
+			end += 1
+		return (text[match.end():end - 1], end) if not depth else (None, pos)
+
+	def _delimited(self, text, pos):
+		"""Return (the verbatim argument at pos delimited by braces or any other character, position after it)."""
+		if pos >= len(text):
+			return (None, pos)
+		if text[pos] == '{':
+			return self._group(text, pos)
+		end = text.find(text[pos], pos + 1)
+		if end < 0:
+			return (None, pos)
+		return (text[pos + 1:end], end + 1)
+
+	def _effective_options(self, kind, *option_dicts):
+		options = dict(self.global_options)
+		if kind == 'inline':
+			options.update(self.inline_options)
+		for option_dict in option_dicts:
+			options.update(option_dict)
+		return options
+
+	def _add(self, filename, text, pos, kind, code, *option_dicts):
+		# Snippets are added in order, count the lines since the previous one
+		(previous_pos, previous_line) = self._line_position
+		line = previous_line + text.count('\n', previous_pos, pos)
+		self._line_position = (pos, line)
+		self.snippets.append(Snippet(
+			filename = filename,
+			line = line,
+			kind = kind,
+			code = code,
+			options = self._effective_options(kind, *option_dicts)
+		))
+
+	def _environment_body(self, text, pos, environment):
+		"""Return (the lines of a verbatim environment whose \\begin ends at pos, position after its \\end)."""
+		end_pattern = re.compile(r'^[ \t]*\\end\{' + re.escape(environment) + r'\}', re.MULTILINE)
+		start = text.find('\n', pos)
+		match = end_pattern.search(text, start + 1) if start >= 0 else None
+		if not match:
+			return (None, len(text))
+		# TeX drops trailing spaces of input lines, fancyvrb writes every line with a newline
+		lines = text[start + 1:match.start()].split('\n')[:-1]
+		return (''.join(line.rstrip(' ') + '\n' for line in lines), match.end())
+
+	def _scan(self, filename, text):
+		pos = 0
+		self._line_position = (0, 1)
+		while True:
+			match = _CONTROL_SEQUENCE.search(text, pos)
+			if not match:
+				return
+			(name, pos) = (match.group(1), match.end())
+			if name is None:
+				# comment
+				continue
+
+			if name in ('verb', 'verb*'):
+				(_, pos) = self._delimited(text, pos)
+			elif name in ('input', 'include'):
+				(included, pos) = self._group(text, pos)
+				if included:
+					path = os.path.join(self.root_directory, included.strip())
+					self.scan_file(path if os.path.exists(path) else path + '.tex')
+			elif name == 'usepackage':
+				(package_options, pos) = self._optional(text, pos)
+				(packages, pos) = self._group(text, pos)
+				if packages and 'minted' in (package.strip() for package in packages.split(',')):
+					self.package_options.update(_parse_key_values(package_options or ''))
+			elif name in ('setminted', 'setmintedinline'):
+				(language, pos) = self._optional(text, pos)
+				(options, pos) = self._group(text, pos)
+				if options is not None and language in (None, self.language):
+					options = _parse_key_values(options)
+					(self.global_options if name == 'setminted' else self.inline_options).update(options)
+					if name == 'setminted' and 'style' in options:
+						self.styles.append(options['style'])
+			elif name == 'usemintedstyle':
+				(language, pos) = self._optional(text, pos)
+				(style, pos) = self._group(text, pos)
+				if style and language in (None, self.language):
+					self.styles.append(style.strip())
+			elif name in ('newminted', 'newmint', 'newmintinline', 'newmintedfile'):
+				(shortcut, pos) = self._optional(text, pos)
+				(language, pos) = self._group(text, pos)
+				(options, pos) = self._group(text, pos)
+				if language is not None and language.strip() == self.language:
+					language = language.strip()
+					options = _parse_key_values(options or '')
+					if name == 'newminted':
+						self.environments[shortcut or language + 'code'] = options
+					else:
+						(kind, suffix) = {
+							'newmint': ('display', ''), 'newmintinline': ('inline', 'inline'), 'newmintedfile': ('file', 'file')
+						}[name]
+						self.commands[shortcut or language + suffix] = (kind, options)
+			elif name == 'begin':
+				start = match.start()
+				(environment, pos) = self._group(text, pos)
+				if environment == 'minted':
+					(options, pos) = self._optional(text, pos)
+					(language, pos) = self._group(text, pos)
+					if language is None or language.strip() != self.language:
+						continue
+					options = _parse_key_values(options or '')
+				elif environment in self.environments:
+					options = self.environments[environment]
+				elif environment is not None and environment.endswith('*') and environment[:-1] in self.environments:
+					(local_options, pos) = self._group(text, pos)
+					options = dict(self.environments[environment[:-1]], **_parse_key_values(local_options or ''))
+				else:
+					continue
+				(code, pos) = self._environment_body(text, pos, environment)
+				if code is not None:
+					self._add(filename, text, start, 'display', code, options)
+			elif name in ('mint', 'mintinline', 'inputminted'):
+				start = match.start()
+				(options, pos) = self._optional(text, pos)
+				(language, pos) = self._group(text, pos)
+				if language is None or language.strip() != self.language:
+					continue
+				options = _parse_key_values(options or '')
+				if name == 'inputminted':
+					(code_filename, pos) = self._group(text, pos)
+					self._add_file(filename, text, start, code_filename, options)
+				else:
+					(code, pos) = self._delimited(text, pos)
+					if code is not None:
+						self._add(filename, text, start, 'inline' if name == 'mintinline' else 'display', code + '\n', options)
+			elif name in self.commands:
+				start = match.start()
+				(kind, default_options) = self.commands[name]
+				(options, pos) = self._optional(text, pos)
+				options = dict(default_options, **_parse_key_values(options or ''))
+				if kind == 'file':
+					(code_filename, pos) = self._group(text, pos)
+					self._add_file(filename, text, start, code_filename, options)
+				else:
+					(code, pos) = self._delimited(text, pos)
+					if code is not None:
+						self._add(filename, text, start, kind, code + '\n', options)
+
+	def _add_file(self, filename, text, pos, code_filename, options):
+		if code_filename is None:
+			return
+		path = os.path.join(self.root_directory, code_filename.strip())
+		encoding = self._effective_options('file', options).get('encoding', 'utf-8')
+		try:
+			with io.open(path, mode = 'rb') as code_file:
+				code = code_file.read().decode(encoding)
+		except (OSError, UnicodeDecodeError, LookupError):
+			return
+		self._add(filename, text, pos, 'file', code, options)
+
+def scan_project(filename, language = 'mmt'):
+	"""Find all snippets of language in the LaTeX document filename and the files it includes.
+
+	Return:
+		A Project object. Its cachedir is the one given to \\usepackage{minted} relative to the
+		directory of filename, or minted's default `_minted-JOBNAME`.
+	"""
+	scanner = _Scanner(language, os.path.dirname(filename))
+	scanner.scan_file(filename)
+
+	if scanner.package_options.get('cache', 'true') == 'false':
+		cachedir = None
+	else:
+		jobname = os.path.splitext(os.path.basename(filename))[0]
+		cachedir = os.path.join(scanner.root_directory, scanner.package_options.get('cachedir', '_minted-' + jobname))
+	return Project(
+		snippets = scanner.snippets,
+		cachedir = cachedir,
+		styles = sorted(set(scanner.styles)) or ['default']
+	)
+
+def snippet_request(snippet, language = 'mmt'):
+	"""Return the highlight request mmtpygmentize-client will send for snippet when called by minted."""
+	args = ['-l', language] + MINTED_ARGS
+	for (key, value) in sorted(snippet.options.items()):
+		if key in MINTED_PYGMENTIZE_OPTIONS:
+			(flag, name) = MINTED_PYGMENTIZE_OPTIONS[key]
+			args += [flag, name + '=' + value]
+	(_, options, filters, _) = parse_pygmentize_args(args)
+	return {'code': snippet.code, 'lexer': language, 'formatter': 'latex', 'options': options, 'filters': filters}
+
+# Per process state, see _init_worker
+_service = None
+
+def _init_worker():
+	global _service
+	_service = HighlightService(warm = False)
+
+def _render(job):
+	(request, path) = job
+	result = _service.handle(request)
+	if 'error' in result:
+		return result['error']
+	temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+	with io.open(temporary_path, mode = 'wb') as out_file:
+		out_file.write(result['output'].encode('utf-8'))
+	os.replace(temporary_path, path)
+	return None
+
+def write_style_defs(style, cachedir):
+	"""Write the style definitions minted expects as `STYLE.pygstyle` into cachedir."""
+	style_class = STYLES[style] if style in STYLES else get_style_by_name(style)
+	# like `pygmentize -S STYLE -f latex -P commandprefix=PYGSTYLE`
+	defs = LatexFormatter(style = style_class, commandprefix = 'PYG' + style).get_style_defs() + '\n'
+	with io.open(os.path.join(cachedir, style + '.pygstyle'), mode = 'wb') as style_file:
+		style_file.write(defs.encode('utf-8'))
+
+def prerender(snippets, cachedir, language = 'mmt', jobs = None, log = print):
+	"""Highlight snippets on a process pool into cachedir, skipping those pre-rendered before.
+
+	Args:
+		jobs: Number of processes, by default os.cpu_count(). With 1, everything runs in the current process.
+		log:  Function to call with error messages.
+
+	Return:
+		A PrerenderStatistics object.
+	"""
+	start_time = time.perf_counter()
+	os.makedirs(cachedir, exist_ok = True)
+
+	# Identical snippets are highlighted once
+	jobs_by_path = {}
+	for snippet in snippets:
+		request = snippet_request(snippet, language)
+		path = os.path.join(cachedir, prerendered_filename(request))
+		jobs_by_path.setdefault(path, (request, path, snippet))
+	pending = [(request, path) for (request, path, _) in jobs_by_path.values() if not os.path.exists(path)]
+
+	jobs = min(jobs or os.cpu_count() or 1, max(len(pending), 1))
+	if jobs == 1:
+		_init_worker()
+		errors = list(map(_render, pending))
+	else:
+		with ProcessPoolExecutor(jobs, initializer = _init_worker) as pool:
+			errors = list(pool.map(_render, pending, chunksize = 8))
+
+	num_failed = 0
+	for ((_, path), error) in zip(pending, errors):
+		if error is not None:
+			num_failed += 1
+			snippet = jobs_by_path[path][2]
+			log('Error in {}:{}: {}'.format(snippet.filename, snippet.line, error))
+
+	return PrerenderStatistics(
+		num_snippets = len(snippets),
+		num_rendered = len(pending) - num_failed,
+		num_up_to_date = len(jobs_by_path) - len(pending),
+		num_failed = num_failed,
+		seconds = time.perf_counter() - start_time
+	)
+
+def main(args = None):
+	parser = argparse.ArgumentParser(
+		prog = 'mmtpygments-minted',
+		description = 'Highlight all MMT snippets of LaTeX documents at once into the minted cache. '
+			'Let minted use the results by \\renewcommand{\\MintedPygmentize}{mmtpygmentize-client}.'
+	)
+	parser.add_argument('documents', nargs = '+', metavar = 'DOCUMENT',
+		help = 'main LaTeX file, the files it includes via \\input and \\include are scanned, too')
+	parser.add_argument('-j', '--jobs', type = int, default = None,
+		help = 'number of processes (default: number of CPUs)')
+	parser.add_argument('--language', default = 'mmt',
+		help = 'minted language of the snippets to highlight (default: mmt)')
+	parser.add_argument('--cachedir', default = None,
+		help = 'minted cache directory (default: as given to \\usepackage{minted} or _minted-JOBNAME)')
+	parser.add_argument('--style', action = 'append', default = None,
+		help = 'write the definitions of this style, too (default: mmtdefault and the document\'s styles)')
+	options = parser.parse_args(args)
+
+	exit_code = 0
+	for document in options.documents:
+		project = scan_project(document, options.language)
+		cachedir = options.cachedir or project.cachedir
+		if cachedir is None:
+			print(document + ': minted is used with cache=false, nothing to pre-render', file = sys.stderr)
+			continue
+
+		statistics = prerender(project.snippets, cachedir, options.language, options.jobs,
+			log = lambda message: print(message, file = sys.stderr))
+		for style in sorted(set(project.styles + (options.style or ['mmtdefault']))):
+			write_style_defs(style, cachedir)
+
+		print('{}: {} snippets, {} highlighted, {} up to date, {} failed in {:.2f} s into {}'.format(
+			document, statistics.num_snippets, statistics.num_rendered, statistics.num_up_to_date,
+			statistics.num_failed, statistics.seconds, cachedir
+		))
+		if statistics.num_failed:
+			exit_code = 1
+	return exit_code
+
+if __name__ == "__main__":
+	sys.exit(main())
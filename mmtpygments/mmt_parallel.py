@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+	Parallel Lexing of Large MMT Files
+	==================================
+
+	Splits a single MMT file at top-level module delimiters and lexes the chunks
+	on a process pool.
+
+	:author: ComFreek <comfreek@outlook.com>
+	:copyright: Copyright 2020 ComFreek
+	:license: ISC, see LICENSE for details.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+import re
+
+from pygments.filter import apply_filters
+from pygments.token import string_to_tokentype
+
+from .mmt_incremental import get_tokens_with_checkpoints
+from .mmt_lexer import MMTLexer
+
+__all__ = ['lex_parallel']
+
+# Candidates for top-level split points: right after a module delimiter ❚ that is the last
+# thing on its line and followed by a line starting at column 0 (i.e. probably a new
+# top-level module or directive). Candidates are only a guess, every split point is
+# verified while stitching the chunks together.
+SPLIT_CANDIDATE = re.compile(r'❚(?=[ \t]*\n(?:[ \t]*\n)*\S)')
+
+ROOT_STACK = ('root',)
+
+def preprocess_text(lexer, text):
+	"""Preprocess text like lexer.get_tokens does before lexing."""
+	preprocess = getattr(lexer, '_preprocess_lexer_input', None)
+	if preprocess is not None:
+		return preprocess(text)
+
+	# Older Pygments versions do not expose the preprocessing on its own
+	if not isinstance(text, str):
+		text = text.decode(lexer.encoding if lexer.encoding not in ('guess', 'chardet') else 'utf-8')
+	if text.startswith('\ufeff'):
+		text = text[len('\ufeff'):]
+	text = text.replace('\r\n', '\n').replace('\r', '\n')
+	if lexer.stripall:
+		text = text.strip()
+	elif lexer.stripnl:
+		text = text.strip('\n')
+	if lexer.tabsize > 0:
+		text = text.expandtabs(lexer.tabsize)
+	if lexer.ensurenl and not text.endswith('\n'):
+		text += '\n'
+	return text
+
+def find_split_points(text, num_chunks):
+	"""Return up to num_chunks - 1 candidate split points dividing text into chunks of similar size."""
+	split_points = []
+	chunk_size = len(text) // max(num_chunks, 1)
+	if chunk_size == 0:
+		return split_points
+
+	next_boundary = chunk_size
+	for match in SPLIT_CANDIDATE.finditer(text):
+		if match.end() >= next_boundary:
+			split_points.append(match.end())
+			if len(split_points) == num_chunks - 1:
+				break
+			next_boundary = match.end() + chunk_size
+	return split_points
+
+def lex_until(lexer, text, pos, stack, split_points):
+	"""Lex from pos with stack until reaching one of split_points in state ROOT_STACK.
+
+	Args:
+		split_points: A collection of positions, or an integer end for stopping at the first
+		              checkpoint at or after it in whatever state.
+
+	Return:
+		A triple (tokens, end, stack) of the (tokentype, value) pairs lexed and the checkpoint
+		(position, stack) lexing stopped at. end is None if lexing reached the end of text.
+	"""
+	tokens = []
+	for (index, tokentype, value) in get_tokens_with_checkpoints(lexer, text, pos, stack):
+		if tokentype is not None:
+			tokens.append((tokentype, value))
+		elif isinstance(split_points, int):
+			if index >= split_points:
+				return (tokens, index, value)
+		elif index in split_points and value == ROOT_STACK:
+			return (tokens, index, value)
+	return (tokens, None, None)
+
+# Per worker process state, see _init_worker
+_worker_text = None
+_worker_lexer = None
+
+def _init_worker(text, options):
+	global _worker_text, _worker_lexer
+
+	_worker_text = text
+	_worker_lexer = MMTLexer(**options)
+
+def _lex_chunk(start, end):
+	"""Lex the chunk [start, end) of the worker's text, assuming ROOT_STACK at start.
+
+	Token types are returned by name since unpickled token types would not be the
+	singletons of pygments.token anymore.
+	"""
+	(tokens, stop, stack) = lex_until(_worker_lexer, _worker_text, start, ROOT_STACK, end)
+
+	tokentype_ids = {}
+	tokens = [(tokentype_ids.setdefault(tokentype, len(tokentype_ids)), value) for (tokentype, value) in tokens]
+	tokentype_names = [str(tokentype) for tokentype in tokentype_ids]
+
+	return (tokentype_names, tokens, stop, stack)
+
+def _stitch(lexer, text, split_points, chunk_results):
+	"""Concatenate the chunks' tokens, re-lexing serially wherever a split point turned out wrong.
+
+	Chunk i is only valid if lexing the preceding text serially reaches its start
+	in state ROOT_STACK exactly.
+	"""
+	split_point_set = set(split_points)
+	(pos, stack) = (0, ROOT_STACK)
+
+	for (start, chunk_result) in zip([0] + split_points, chunk_results):
+		if pos is not None and (start > pos or (start == pos and stack != ROOT_STACK)):
+			# The previous chunk did not stop at this split point in root state:
+			# lex serially until the next split point that is reached in root state
+			(tokens, pos, stack) = lex_until(lexer, text, pos, stack, split_point_set)
+			yield from tokens
+
+		if pos is None:
+			break
+		elif start == pos:
+			(tokentype_names, tokens, pos, stack) = chunk_result.result()
+			tokentypes = [string_to_tokentype(name) for name in tokentype_names]
+			yield from ((tokentypes[tokentype_id], value) for (tokentype_id, value) in tokens)
+		else:
+			# Already covered by serial lexing
+			chunk_result.cancel()
+
+	if pos is not None:
+		yield from lex_until(lexer, text, pos, stack, set())[0]
+
+def lex_parallel(text, workers = None, chunks_per_worker = 4, **options):
+	"""Lex text with MMTLexer on a process pool, yielding the very same tokens as MMTLexer().get_tokens(text).
+
+	The text is split at top-level module delimiters (❚) into chunks that are lexed
+	independently, each starting in the root state. Chunks whose start turns out not to
+	be reached in root state by serial lexing are transparently re-lexed serially.
+
+	Args:
+		text:              The MMT source, either as str or bytes (decoded as by get_tokens).
+		workers:           Number of worker processes, by default os.cpu_count().
+		chunks_per_worker: Number of chunks per worker to even out differently fast chunks.
+		options:           Lexer options, see pygments.lexer.Lexer.
+
+	Return:
+		An iterable of (tokentype, value) pairs.
+	"""
+	lexer = MMTLexer(**options)
+	text = preprocess_text(lexer, text)
+
+	workers = workers or os.cpu_count() or 1
+	split_points = find_split_points(text, workers * chunks_per_worker) if workers > 1 else []
+
+	def streamer():
+		if not split_points:
+			yield from lex_until(lexer, text, 0, ROOT_STACK, set())[0]
+			return
+
+		with ProcessPoolExecutor(workers, initializer = _init_worker, initargs = (text, options)) as pool:
+			chunk_results = [
+				pool.submit(_lex_chunk, start, end)
+				for (start, end) in zip([0] + split_points, split_points + [len(text)])
+			]
+			yield from _stitch(lexer, text, split_points, chunk_results)
+
+	return apply_filters(streamer(), lexer.filters, lexer)
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+	Profiling of MMT Lexer Rules
+	============================
+
+	Per-(state, rule) statistics on match attempts, hits and time spent, and
+	collapsed state stacks for flame graphs, see the `profile` option of MMTLexer.
+
+	:author: ComFreek <comfreek@outlook.com>
+	:copyright: Copyright 2020 ComFreek
+	:license: ISC, see LICENSE for details.
+"""
+
+import atexit
+from collections import defaultdict
+import io
+import sys
+from time import perf_counter
+
+from .mmt_engine import lex_states, rule_tokens
+
+__all__ = ['LexerProfile', 'get_tokens_profiled', 'global_profile']
+
+class LexerProfile:
+	"""
+	Statistics collected while lexing with profiling enabled
+
+	A profile may be shared by several lexers (of the same class) and accumulates
+	over all inputs lexed.
+
+	Attributes:
+		rules: Maps (state, rule index) to a list [attempts, hits, seconds], where
+		       seconds covers matching the rule's regex and, on hits, running its action.
+		stacks: Maps (state stack, rule index) to the seconds spent attempting that
+		        rule with that state stack in effect.
+	"""
+
+	def __init__(self):
+		self.rules = defaultdict(lambda: [0, 0, 0.0])
+		self.stacks = defaultdict(float)
+		self.regexes = {}
+
+	def _register(self, lexer):
+		# Remember the rules' regexes for reports, indexed like the processed rules that are profiled
+		for (state, rules) in lexer._tokens.items():
+			for (index, (rexmatch, _, _)) in enumerate(rules):
+				rexmatch = getattr(rexmatch, '__wrapped__', rexmatch)
+				self.regexes.setdefault((state, index), rexmatch.__self__.pattern)
+
+	def clear(self):
+		self.rules.clear()
+		self.stacks.clear()
+
+	def report(self, file = sys.stderr, limit = None):
+		"""Write a table of all rules sorted by time spent descendingly to file."""
+		rows = sorted(self.rules.items(), key = lambda item: item[1][2], reverse = True)
+		total_seconds = sum(seconds for (_, (_, _, seconds)) in rows) or 1.0
+
+		file.write("%-28s %5s %10s %10s %6s %10s %6s  %s\n" % (
+			"state", "rule", "attempts", "hits", "hit%", "ms", "time%", "regex"
+		))
+		for ((state, index), (attempts, hits, seconds)) in rows[:limit]:
+			regex = self.regexes.get((state, index), "")
+			file.write("%-28s %5d %10d %10d %6.1f %10.2f %6.1f  %s\n" % (
+				state, index, attempts, hits, 100.0 * hits / attempts if attempts else 0.0,
+				seconds * 1000, 100.0 * seconds / total_seconds,
+				regex if len(regex) <= 60 else regex[:57] + "..."
+			))
+
+	def write_collapsed(self, file):
+		"""Write the state stack samples in the collapsed format of flamegraph.pl and compatible tools.
+
+		Every line has the form `root;moduleBody;constantDeclaration;rule 3 1234`: the state stack,
+		the rule attempted as leaf frame and the time spent in microseconds.
+		"""
+		for ((stack, index), seconds) in sorted(self.stacks.items()):
+			microseconds = int(round(seconds * 1e6))
+			if microseconds > 0:
+				file.write("%s;rule %d %d\n" % (";".join(stack), index, microseconds))
+
+def get_tokens_profiled(lexer, text, stack = ('root',), profile = None):
+	"""Lex text like RegexLexer.get_tokens_unprocessed and record statistics into profile.
+
+	Args:
+		lexer:   A RegexLexer instance whose rules to use, e.g. MMTLexer().
+		profile: The LexerProfile to record into, by default lexer.profile.
+	"""
+	profile = profile if profile is not None else lexer.profile
+	profile._register(lexer)
+	rule_statistics = profile.rules
+	stack_seconds = profile.stacks
+
+	tokendefs = lexer._tokens
+
+	def select(statestack, text, pos):
+		state = statestack[-1]
+		stack_key = tuple(statestack)
+		for (index, (rexmatch, action, new_state)) in enumerate(tokendefs[state]):
+			start_time = perf_counter()
+			m = rexmatch(text, pos)
+			if m:
+				tokens = list(rule_tokens(lexer, m, action))
+				seconds = perf_counter() - start_time
+
+				statistics = rule_statistics[(state, index)]
+				statistics[0] += 1
+				statistics[1] += 1
+				statistics[2] += seconds
+				stack_seconds[(stack_key, index)] += seconds
+				return (tokens, m.end(), new_state)
+			else:
+				seconds = perf_counter() - start_time
+				statistics = rule_statistics[(state, index)]
+				statistics[0] += 1
+				statistics[2] += seconds
+				stack_seconds[(stack_key, index)] += seconds
+		return None
+
+	return lex_states(select, text, 0, stack)
+
+_global_profile = None
+
+def global_profile(output_path):
+	"""Return the process-wide profile used for the environment variable MMTPYGMENTS_PROFILE.
+
+	Upon exit of the process, a report is written to stderr and the collapsed state stacks
+	to output_path.
+	"""
+	global _global_profile
+
+	if _global_profile is None:
+		_global_profile = LexerProfile()
+
+		def write_profile():
+			_global_profile.report()
+			with io.open(output_path, "w", encoding = "utf-8") as output_file:
+				_global_profile.write_collapsed(output_file)
+
+		atexit.register(write_profile)
+
+	return _global_profile
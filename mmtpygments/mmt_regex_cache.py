@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+	Precompiled Regexes for a Fast Lexer Startup
+	============================================
+
+	Persists the compiled form of the MMT lexers' regexes across processes, such that
+	instantiating a lexer in a fresh process (e.g. a pygmentize run per minted snippet)
+	does not parse and compile all rules again.
+
+	The table is opt-in since it relies on private internals of CPython's regex engine
+	(_sre): lexers only use it if the environment variable MMTPYGMENTS_REGEX_CACHE names
+	its path, or if it has been built at its default location next to the bytecode of
+	this package (in __pycache__). Setting the variable to 0 disables it. The table is
+	only ever written by `python -m mmtpygments.mmt_regex_cache`, building it at the
+	path given by the variable or else at the default location.
+
+	:author: ComFreek <comfreek@outlook.com>
+	:copyright: Copyright 2020 ComFreek
+	:license: ISC, see LICENSE for details.
+"""
+
+import marshal
+import os
+import sys
+
+import _sre
+
+try:
+	from re import _compiler as sre_compile, _parser as sre_parse # Python 3.11+
+except ImportError:
+	import sre_compile, sre_parse
+
+__all__ = ['compile_regex', 'get_cache_path', 'save']
+
+# Increase upon any change of the table format
+CACHE_FORMAT_VERSION = 1
+
+# The compiled form is specific to the regex engine, hence also key the table on it
+_CACHE_KEY = (CACHE_FORMAT_VERSION, sys.version, _sre.MAGIC, _sre.CODESIZE)
+
+_table = None
+# Whether compile_regex adds missing regexes to the table, only while building it
+_building = False
+
+def get_cache_path():
+	"""Return the path of the regex table file, None if disabled."""
+	path = os.environ.get('MMTPYGMENTS_REGEX_CACHE')
+	if path is not None:
+		return path if path not in ('', '0') else None
+	return os.path.join(
+		os.path.dirname(os.path.abspath(__file__)), '__pycache__',
+		'mmt_regex_cache.{}.marshal'.format(sys.implementation.cache_tag)
+	)
+
+def _load():
+	global _table
+
+	_table = {}
+	path = get_cache_path()
+	if path is None or _building:
+		return
+	try:
+		with open(path, 'rb') as table_file:
+			# marshal.load would read the file in many small pieces
+			(key, table) = marshal.loads(table_file.read())
+		if key == _CACHE_KEY:
+			_table = table
+	except (OSError, EOFError, ValueError, TypeError):
+		# Missing or corrupt tables are simply rebuilt
+		pass
+
+def _compile_code(regex, flags):
+	"""Compile regex like re.compile, but return the arguments to _sre.compile."""
+	parsed = sre_parse.parse(regex, flags)
+	state = getattr(parsed, 'state', None) or parsed.pattern # Python 3.6, 3.7: pattern
+	code = sre_compile._code(parsed, flags)
+
+	indexgroup = [None] * state.groups
+	for (name, index) in state.groupdict.items():
+		indexgroup[index] = name
+
+	return (
+		int(flags | state.flags),
+		[int(opcode) for opcode in code],
+		state.groups - 1,
+		dict(state.groupdict),
+		tuple(indexgroup)
+	)
+
+def compile_regex(regex, flags):
+	"""Return a compiled pattern equal to re.compile(regex, flags), taken from the table if possible.
+
+	Return:
+		The compiled pattern, or None if the regex table is disabled or has not been built,
+		i.e. the regex is to be compiled as usual.
+	"""
+	if _table is None:
+		_load()
+
+	key = (regex, int(flags))
+	entry = _table.get(key)
+	if entry is not None:
+		try:
+			return _sre.compile(regex, *entry)
+		except Exception:
+			pass
+	if not _building:
+		return None
+
+	try:
+		entry = _compile_code(regex, flags)
+		pattern = _sre.compile(regex, *entry)
+	except Exception:
+		# Unsupported Python implementation or version
+		return None
+
+	_table[key] = entry
+	return pattern
+
+def save():
+	"""Write the table to get_cache_path().
+
+	Raise:
+		OSError if it cannot be written.
+	"""
+	import tempfile # only needed when writing
+
+	path = get_cache_path()
+	directory = os.path.dirname(path)
+	os.makedirs(directory or '.', exist_ok = True)
+	(handle, temp_path) = tempfile.mkstemp(dir = directory or '.', suffix = '.tmp')
+	try:
+		with os.fdopen(handle, 'wb') as temp_file:
+			marshal.dump((_CACHE_KEY, _table), temp_file)
+		# mkstemp only grants access to the current user, but e.g. a table built during installation is shared
+		os.chmod(temp_path, 0o644)
+		os.replace(temp_path, path)
+	except BaseException:
+		os.remove(temp_path)
+		raise
+
+if __name__ == "__main__":
+	# The lexers use the table of the imported module, not of this __main__ module
+	from mmtpygments import mmt_regex_cache
+
+	if mmt_regex_cache.get_cache_path() is None:
+		sys.exit('The regex table is disabled, see MMTPYGMENTS_REGEX_CACHE')
+	mmt_regex_cache._building = True
+	mmt_regex_cache._table = {}
+
+	from mmtpygments.mmt_fast_lexer import MMTFastLexer
+	from mmtpygments.mmt_lexer import MMTLexer
+
+	for lexer_class in (MMTLexer, MMTFastLexer):
+		lexer_class()
+	MMTLexer(combined = True)
+	try:
+		mmt_regex_cache.save()
+	except OSError as error:
+		sys.exit('Cannot write the regex table: {}'.format(error))
+	print('Regex table written to {}'.format(mmt_regex_cache.get_cache_path()))
@@ -14,6 +14,7 @@ import re
 
 from pygments.lexer import RegexLexer, bygroups
 from pygments.token import Keyword, String, Whitespace
+from pygments.util import get_int_opt
 
 __all__ = ['MMTRelationalLexer']
 
@@ -22,6 +23,18 @@ class MMTRelationalLexer(RegexLexer):
 	Pygments Lexer for MMT relational info (.rel)
 
 	The MMT project can be found at https://uniformal.github.io/.
+
+	Relational dumps easily have millions of lines, hence lines of the usual form
+	`[indentation]subject whitespace rest` are lexed by a single split instead of by the
+	rules below, and whitespace is emitted in merged runs instead of one token per character.
+	All other lines are left to the rules. Per character, the token types are the same as
+	of the rules alone.
+
+	Additional options accepted:
+
+	`blocksize`
+		Number of characters read at once when lexing a file object (default: ``65536``),
+		see get_tokens.
 	"""
 
 	name = 'MMTRelational'
@@ -31,9 +44,151 @@ class MMTRelationalLexer(RegexLexer):
 
 	flags = re.DOTALL | re.UNICODE | re.IGNORECASE | re.MULTILINE
 
+	def __init__(self, **options):
+		super().__init__(**options)
+		self.blocksize = get_int_opt(options, 'blocksize', 64 * 1024)
+
+	def get_tokens(self, text, unfiltered = False):
+		"""Return an iterable of (tokentype, value) pairs of text.
+
+		Besides str and bytes, text may also be a file object (text or binary) or an mmap object,
+		which is then read block by block (see the option `blocksize`) yielding tokens as they are
+		lexed. Binary files are decoded with the option `encoding` or as UTF-8 if it is to be guessed.
+		"""
+		if not hasattr(text, 'read'):
+			return super().get_tokens(text, unfiltered)
+
+		from pygments.filter import apply_filters
+
+		stream = self._stream_tokens(text)
+		if not unfiltered:
+			stream = apply_filters(stream, self.filters, self)
+		return stream
+
+	def _stream_tokens(self, source):
+		from .mmt_streaming import preprocessed_chunks
+
+		# Lexing pieces of the text yields the same tokens as lexing the whole text if every piece
+		# ends with a line of the usual form: no rule matches across its end (see _lex_lines).
+		# A whitespace token ending a piece is held back to be merged with the next piece's.
+		window = ''
+		held_back = ''
+		pieces = preprocessed_chunks(self, source, self.blocksize)
+		while True:
+			chunk = next(pieces, None)
+			if chunk is not None:
+				window += chunk
+				# chunks consist of whole lines, and those of the window before have been checked already
+				cut = _last_regular_line_end(window, len(window) - len(chunk))
+				if cut is None:
+					continue
+				(piece, window) = (window[:cut], window[cut:])
+			else:
+				(piece, window) = (window, '')
+
+			tokens = [(tokentype, value) for (_, tokentype, value) in self._lex_lines(piece)]
+			if tokens and held_back:
+				if tokens[0][0] is Whitespace:
+					tokens[0] = (Whitespace, held_back + tokens[0][1])
+				else:
+					tokens.insert(0, (Whitespace, held_back))
+				held_back = ''
+			if chunk is None:
+				if held_back:
+					tokens.append((Whitespace, held_back))
+				yield from tokens
+				return
+			if tokens and tokens[-1][0] is Whitespace:
+				held_back = tokens.pop()[1]
+			yield from tokens
+
+	def get_tokens_unprocessed(self, text):
+		return self._lex_lines(text)
+
+	def _lex_lines(self, text):
+		"""Yield (index, tokentype, value) of the tokens of text, whitespace merged into runs."""
+		rule_lexing = super().get_tokens_unprocessed
+
+		# Start of the whitespace run not yet emitted, if any
+		whitespace_start = None
+		pos = 0
+		lines = text.split('\n')
+		last_line = len(lines) - 1
+		line_index = 0
+		while line_index <= last_line:
+			line = lines[line_index]
+			stripped = line.lstrip()
+			if not stripped:
+				# whitespace only
+				if whitespace_start is None:
+					whitespace_start = pos
+				pos += len(line) + (line_index < last_line)
+				line_index += 1
+				continue
+
+			parts = stripped.split(None, 1)
+			if len(parts) == 2 and '\r' not in line:
+				# [indentation]subject whitespace rest, the rest matched by [^\r\n]+ up to the line end
+				(subject, rest) = parts
+				subject_start = pos + len(line) - len(stripped)
+				rest_start = pos + len(line) - len(rest)
+				if whitespace_start is None:
+					if subject_start > pos:
+						yield (pos, Whitespace, line[:subject_start - pos])
+				else:
+					yield (whitespace_start, Whitespace, text[whitespace_start:subject_start])
+				subject_end = subject_start + len(subject)
+				yield (subject_start, Keyword.Declaration, subject)
+				yield (subject_end, Whitespace, text[subject_end:rest_start])
+				yield (rest_start, String, rest)
+				pos += len(line)
+				if line_index < last_line:
+					whitespace_start = pos
+					pos += 1
+				else:
+					whitespace_start = None
+				line_index += 1
+				continue
+
+			# Any other line, e.g. a subject without rest: the rules may match across lines, but
+			# not across the end of the next line of the usual form.
+			end_index = line_index + 1
+			while end_index <= last_line and not _is_regular_line(lines[end_index]):
+				end_index += 1
+			end = pos + sum(len(lines[index]) + 1 for index in range(line_index, min(end_index + 1, last_line + 1)))
+			end = min(end, len(text))
+			for (index, tokentype, value) in rule_lexing(text[pos:end]):
+				if tokentype is Whitespace:
+					if whitespace_start is None:
+						whitespace_start = pos + index
+					continue
+				if whitespace_start is not None:
+					yield (whitespace_start, Whitespace, text[whitespace_start:pos + index])
+					whitespace_start = None
+				yield (pos + index, tokentype, value)
+			pos = end
+			line_index = end_index + 1
+
+		if whitespace_start is not None and whitespace_start < len(text):
+			yield (whitespace_start, Whitespace, text[whitespace_start:])
+
 	tokens = {
 		'root': [
 			(r'\s', Whitespace),
 			(r'(\S+)(\s+)([^\r\n]+)', bygroups(Keyword.Declaration, Whitespace, String))
 		]
 	}
+
+def _is_regular_line(line):
+	"""Return whether line is of the form [indentation]subject whitespace rest and free of \\r."""
+	return len(line.split(None, 1)) == 2 and '\r' not in line
+
+def _last_regular_line_end(text, start = 0):
+	"""Return the index after the newline ending the last line of the usual form in text[start:], if any."""
+	end = text.rfind('\n')
+	while end >= start:
+		start = text.rfind('\n', 0, end) + 1
+		if _is_regular_line(text[start:end]):
+			return end + 1
+		end = start - 1
+	return None
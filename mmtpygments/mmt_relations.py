@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+"""
+	Indexed Store of MMT Relational Information
+	===========================================
+
+	Loads MMT relational exports (.rel files) into a compact columnar store to answer
+	questions like "which theories include X" without scanning the text every time.
+	Installed as the console script `mmtpygments-relations`.
+
+	Every line of a .rel file consists of a predicate followed by one or two terms
+	(URIs), the very (keyword, rest) structure that MMTRelationalLexer highlights as
+	Keyword.Declaration and String:
+
+	    include http://example.org/?A http://example.org/?B
+	    theory http://example.org/?A
+
+	Terms are interned to integer ids, relations are three parallel arrays of ids
+	(predicate, subject, object) and every column has an index from term ids to the
+	rows containing them. Stores are saved to and loaded from a binary file.
+
+	:author: ComFreek <comfreek@outlook.com>
+	:copyright: Copyright 2020 ComFreek
+	:license: ISC, see LICENSE for details.
+"""
+
+import argparse
+from array import array
+from collections import Counter, namedtuple
+from itertools import accumulate
+import json
+import os
+import sys
+import tempfile
+import time
+
+__all__ = ['Relation', 'RelationStore', 'parse_relation', 'main']
+
+# Increase upon any change of the on-disk format
+STORE_FORMAT_VERSION = 1
+
+_MAGIC = b'MMTRELATIONS'
+
+COLUMNS = ('predicate', 'subject', 'object')
+
+# A single relation
+#
+#  - predicate: e.g. 'include'
+#  - subject:   the first term
+#  - object:    the second term, None for unary relations like `theory URI`
+Relation = namedtuple('Relation', COLUMNS)
+
+def parse_relation(line):
+	"""Split a line of a .rel file into (predicate, subject, object).
+
+	Like MMTRelationalLexer, the predicate is the first word and the rest of the line
+	holds the terms. The object is everything after the subject (stripped), or '' if the
+	relation is unary.
+
+	Return:
+		The triple or None if the line does not contain a relation (blank lines or a
+		predicate only).
+	"""
+	parts = line.split(None, 2)
+	if len(parts) < 2:
+		return None
+	if len(parts) == 2:
+		return (parts[0], parts[1], '')
+	return (parts[0], parts[1], parts[2].rstrip())
+
+def _build_index(column, num_terms):
+	"""Return (offsets, rows) such that rows[offsets[t]:offsets[t + 1]] are the rows with term id t in column."""
+	counts = [0] * (num_terms + 1)
+	for (term_id, count) in Counter(column).items():
+		counts[term_id + 1] = count
+	offsets = array('I', accumulate(counts))
+
+	# counting sort, rows stay in ascending order per term
+	positions = offsets.tolist()
+	rows = array('I', [0]) * len(column)
+	for (row, term_id) in enumerate(column):
+		rows[positions[term_id]] = row
+		positions[term_id] += 1
+	return (offsets, rows)
+
+class RelationStore:
+	"""
+	Columnar store of relations with interned terms
+
+	Usage:
+		store = RelationStore.build(['theories.rel'])
+		store.save('theories.relstore')
+		store = RelationStore.load('theories.relstore')
+		store.subjects('include', 'http://example.org/?B') # which theories include ?B
+
+	Args:
+		terms:               The interned terms by id, terms[0] must be '' (the object of unary relations).
+		predicates, subjects, objects:
+		                     Arrays of term ids, one entry per relation.
+		indexes:             Already built indexes by column name, see _build_index.
+		num_skipped_lines:   Number of non-blank lines without a relation in the sources.
+	"""
+
+	def __init__(self, terms, predicates, subjects, objects, indexes = None, num_skipped_lines = 0):
+		self.terms = terms
+		self.columns = {'predicate': predicates, 'subject': subjects, 'object': objects}
+		self.indexes = dict(indexes or {})
+		self.num_skipped_lines = num_skipped_lines
+		self._term_ids = None
+
+	@classmethod
+	def build(cls, sources):
+		"""Parse .rel files into a new store.
+
+		Args:
+			sources: An iterable of file names and text file objects.
+		"""
+		term_ids = {'': 0}
+		intern = term_ids.setdefault
+		predicates = array('I')
+		subjects = array('I')
+		objects = array('I')
+		num_skipped_lines = 0
+
+		for source in sources:
+			if isinstance(source, (str, bytes, os.PathLike)):
+				relation_file = open(source, 'r', encoding = 'utf-8', errors = 'replace')
+			else:
+				relation_file = source
+			try:
+				for line in relation_file:
+					relation = parse_relation(line)
+					if relation is None:
+						num_skipped_lines += bool(line.strip())
+						continue
+					(predicate, subject, obj) = relation
+					predicates.append(intern(predicate, len(term_ids)))
+					subjects.append(intern(subject, len(term_ids)))
+					objects.append(intern(obj, len(term_ids)))
+			finally:
+				if relation_file is not source:
+					relation_file.close()
+
+		store = cls(list(term_ids), predicates, subjects, objects, num_skipped_lines = num_skipped_lines)
+		store._term_ids = term_ids
+		return store
+
+	def __len__(self):
+		return len(self.columns['predicate'])
+
+	def term_id(self, term):
+		"""Return the id of term or None if no relation contains it."""
+		if self._term_ids is None:
+			self._term_ids = {term: term_id for (term_id, term) in enumerate(self.terms)}
+		return self._term_ids.get(term)
+
+	def index(self, column):
+		"""Return the index (offsets, rows) of column, building it on first use."""
+		if column not in self.indexes:
+			self.indexes[column] = _build_index(self.columns[column], len(self.terms))
+		return self.indexes[column]
+
+	def _rows(self, column, term_id):
+		(offsets, rows) = self.index(column)
+		return rows[offsets[term_id]:offsets[term_id + 1]]
+
+	def relation(self, row):
+		"""Return the relation in a row."""
+		terms = self.terms
+		return Relation(
+			terms[self.columns['predicate'][row]],
+			terms[self.columns['subject'][row]],
+			terms[self.columns['object'][row]] or None
+		)
+
+	def query(self, predicate = None, subject = None, object = None):
+		"""Yield the relations matching all given terms (in file order), None matches anything.
+
+		The most selective index among the given terms is used, the other terms are checked per row.
+		"""
+		constraints = []
+		for (column, term) in zip(COLUMNS, (predicate, subject, object)):
+			if term is not None:
+				term_id = self.term_id(term)
+				if term_id is None:
+					return
+				constraints.append((column, term_id))
+
+		if not constraints:
+			yield from map(self.relation, range(len(self)))
+			return
+
+		candidates = sorted(
+			((self._rows(column, term_id), column, term_id) for (column, term_id) in constraints),
+			key = lambda candidate: len(candidate[0])
+		)
+		(rows, _, _) = candidates[0]
+		checks = [(self.columns[column], term_id) for (_, column, term_id) in candidates[1:]]
+		for row in rows:
+			if all(values[row] == term_id for (values, term_id) in checks):
+				yield self.relation(row)
+
+	def count(self, predicate = None, subject = None, object = None):
+		"""Return the number of relations matching all given terms."""
+		if predicate is not None and subject is None and object is None:
+			term_id = self.term_id(predicate)
+			return 0 if term_id is None else len(self._rows('predicate', term_id))
+		return sum(1 for _ in self.query(predicate, subject, object))
+
+	def subjects(self, predicate, object):
+		"""Return the distinct subjects s of all relations `predicate s object`, e.g. the theories including object."""
+		return list(dict.fromkeys(relation.subject for relation in self.query(predicate, object = object)))
+
+	def objects(self, predicate, subject):
+		"""Return the distinct objects o of all relations `predicate subject o`, e.g. the theories included by subject."""
+		return list(dict.fromkeys(
+			relation.object for relation in self.query(predicate, subject = subject) if relation.object is not None
+		))
+
+	def predicates(self):
+		"""Return a dictionary of all predicates and their number of relations."""
+		(offsets, _) = self.index('predicate')
+		return {
+			self.terms[term_id]: offsets[term_id + 1] - offsets[term_id]
+			for term_id in sorted(set(self.columns['predicate']))
+		}
+
+	def save(self, path):
+		"""Write the store including all indexes to path (atomically)."""
+		terms = '\n'.join(self.terms).encode('utf-8')
+		arrays = [self.columns[column] for column in COLUMNS]
+		for column in COLUMNS:
+			arrays.extend(self.index(column))
+
+		header = json.dumps({
+			'version': STORE_FORMAT_VERSION,
+			'num_terms': len(self.terms),
+			'num_relations': len(self),
+			'terms_size': len(terms),
+			'num_skipped_lines': self.num_skipped_lines,
+			'itemsize': arrays[0].itemsize,
+			'byteorder': sys.byteorder
+		}).encode('utf-8')
+
+		(handle, temp_path) = tempfile.mkstemp(dir = os.path.dirname(os.path.abspath(path)), suffix = '.tmp')
+		try:
+			with os.fdopen(handle, 'wb') as store_file:
+				store_file.write(_MAGIC + len(header).to_bytes(4, 'little') + header + terms)
+				for values in arrays:
+					values.tofile(store_file)
+			os.replace(temp_path, path)
+		except BaseException:
+			try:
+				os.remove(temp_path)
+			except OSError:
+				pass
+			raise
+
+	@classmethod
+	def load(cls, path):
+		"""Load a store written by save.
+
+		Raises ValueError on files not written by save on a compatible machine.
+		"""
+		with open(path, 'rb') as store_file:
+			data = memoryview(store_file.read())
+		if bytes(data[:len(_MAGIC)]) != _MAGIC:
+			raise ValueError('Not a relation store: ' + str(path))
+
+		offset = len(_MAGIC)
+		header_length = int.from_bytes(data[offset:offset + 4], 'little')
+		offset += 4
+		header = json.loads(bytes(data[offset:offset + header_length]).decode('utf-8'))
+		offset += header_length
+		if header['version'] != STORE_FORMAT_VERSION:
+			raise ValueError('Relation store of unsupported version {}: {}'.format(header['version'], path))
+		if header['itemsize'] != array('I').itemsize or header['byteorder'] != sys.byteorder:
+			raise ValueError('Relation store stems from an incompatible machine: ' + str(path))
+
+		terms = bytes(data[offset:offset + header['terms_size']]).decode('utf-8').split('\n')
+		offset += header['terms_size']
+
+		def read_array(length):
+			nonlocal offset
+			values = array('I')
+			size = length * values.itemsize
+			values.frombytes(data[offset:offset + size])
+			offset += size
+			return values
+
+		(num_terms, num_relations) = (header['num_terms'], header['num_relations'])
+		(predicates, subjects, objects) = (read_array(num_relations) for _ in COLUMNS)
+		indexes = {column: (read_array(num_terms + 1), read_array(num_relations)) for column in COLUMNS}
+		if len(terms) != num_terms or offset != len(data):
+			raise ValueError('Corrupt relation store: ' + str(path))
+
+		return cls(terms, predicates, subjects, objects, indexes, header['num_skipped_lines'])
+
+def main(args = None):
+	parser = argparse.ArgumentParser(
+		prog = 'mmtpygments-relations',
+		description = 'Build and query indexed stores of MMT relational exports (.rel files).'
+	)
+	commands = parser.add_subparsers(dest = 'command')
+	commands.required = True
+
+	build_parser = commands.add_parser('build', help = 'parse .rel files into a store')
+	build_parser.add_argument('store', metavar = 'STORE', help = 'store file to write')
+	build_parser.add_argument('paths', nargs = '+', metavar = 'PATH',
+		help = '.rel file or directory to search recursively for .rel files')
+
+	query_parser = commands.add_parser('query', help = 'print matching relations tab-separated')
+	query_parser.add_argument('store', metavar = 'STORE', help = 'store file written by build')
+	query_parser.add_argument('-p', '--predicate', default = None, help = 'predicate to match, e.g. include')
+	query_parser.add_argument('-s', '--subject', default = None, help = 'subject (first term) to match')
+	query_parser.add_argument('-o', '--object', default = None, help = 'object (second term) to match')
+	query_parser.add_argument('--count', action = 'store_true', help = 'only print the number of matches')
+
+	stats_parser = commands.add_parser('stats', help = 'print the number of relations per predicate')
+	stats_parser.add_argument('store', metavar = 'STORE', help = 'store file written by build')
+
+	options = parser.parse_args(args)
+
+	if options.command == 'build':
+		from .mmt_batch import find_files
+
+		start = time.perf_counter()
+		store = RelationStore.build(find_files(options.paths, ('*.rel',), ()))
+		store.save(options.store)
+		print('{} relations, {} terms, {} skipped lines in {:.2f} s into {}'.format(
+			len(store), len(store.terms), store.num_skipped_lines, time.perf_counter() - start, options.store
+		), file = sys.stderr)
+		return 0
+
+	try:
+		store = RelationStore.load(options.store)
+	except (OSError, ValueError) as error:
+		print('Error: {}'.format(error), file = sys.stderr)
+		return 1
+
+	if options.command == 'stats':
+		for (predicate, count) in store.predicates().items():
+			print('{}\t{}'.format(predicate, count))
+		print('{} relations, {} terms'.format(len(store), len(store.terms)), file = sys.stderr)
+		return 0
+
+	if options.count:
+		print(store.count(options.predicate, options.subject, options.object))
+		return 0
+	for relation in store.query(options.predicate, options.subject, options.object):
+		print('\t'.join(term for term in relation if term is not None))
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+	Scan Reach of Lexer Rules
+	=========================
+
+	Computes how far a rule's regex looks ahead of its match position, including the
+	characters it only examines to fail or to backtrack, e.g. `(import)(\\s+)(\\S+)...(❚)`
+	failing at `import a❚ x y❚` has looked at everything up to the `y`. Incremental
+	lexing needs this to know which tokens an edit may affect.
+
+	For a regex R, the examined prefixes are derived from its parse tree: the strings s
+	such that matching R at pos may examine text[pos + len(s)] after having read s. They
+	are over-approximated by dropping anchors and turning lookaheads into optional
+	prefixes, and matched by a regex themselves.
+
+	:author: ComFreek <comfreek@outlook.com>
+	:copyright: Copyright 2020 ComFreek
+	:license: ISC, see LICENSE for details.
+"""
+
+import math
+
+try:
+	from re import _compiler as sre_compile, _parser as sre_parse # Python 3.11+
+except ImportError:
+	import sre_compile, sre_parse
+
+__all__ = ['examined_prefixes', 'scan_reach']
+
+# Opcodes consuming exactly one character
+_SINGLE_CHAR_OPS = (sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.IN, sre_parse.ANY)
+_REPEAT_OPS = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT)
+
+class _Unsupported(Exception):
+	pass
+
+def _any_char():
+	return (sre_parse.IN, [(sre_parse.CATEGORY, sre_parse.CATEGORY_SPACE), (sre_parse.CATEGORY, sre_parse.CATEGORY_NOT_SPACE)])
+
+def _group(state, items):
+	"""Return a non-capturing group of items."""
+	return (sre_parse.SUBPATTERN, (None, 0, 0, sre_parse.SubPattern(state, items)))
+
+def _alternatives(state, alternatives):
+	return (sre_parse.BRANCH, (None, [sre_parse.SubPattern(state, items) for items in alternatives]))
+
+def _repeat(state, minimum, maximum, items):
+	return (sre_parse.MAX_REPEAT, (minimum, maximum, sre_parse.SubPattern(state, items)))
+
+def _subpattern_items(av):
+	(_, add_flags, del_flags, subpattern) = av
+	if add_flags or del_flags:
+		# Scoped flags, e.g. (?i:...), would have to be applied to the items
+		raise _Unsupported()
+	return subpattern.data
+
+def _single_char(items):
+	"""Return the single-character item that items consist of (unwrapping plain groups), else None."""
+	while len(items) == 1 and items[0][0] is sre_parse.SUBPATTERN:
+		(_, add_flags, del_flags, subpattern) = items[0][1]
+		if add_flags or del_flags:
+			return None
+		items = subpattern.data
+	if len(items) == 1 and items[0][0] in _SINGLE_CHAR_OPS:
+		return items[0]
+	return None
+
+def _relaxed(state, items):
+	"""Return items matching every string items can consume, ignoring anchors and lookarounds."""
+	relaxed = []
+	for (op, av) in items:
+		if op in _SINGLE_CHAR_OPS:
+			relaxed.append((op, av))
+		elif op in (sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+			continue
+		elif op is sre_parse.SUBPATTERN:
+			relaxed.append(_group(state, _relaxed(state, _subpattern_items(av))))
+		elif op is sre_parse.BRANCH:
+			relaxed.append(_alternatives(state, [_relaxed(state, alternative.data) for alternative in av[1]]))
+		elif op in _REPEAT_OPS:
+			(minimum, maximum, subpattern) = av
+			relaxed.append(_repeat(state, minimum, maximum, _relaxed(state, subpattern.data)))
+		elif op is sre_parse.GROUPREF:
+			relaxed.append(_repeat(state, 0, sre_parse.MAXREPEAT, [_any_char()]))
+		else:
+			# e.g. possessive repeats, atomic groups or conditionals
+			raise _Unsupported()
+	return relaxed
+
+def _examined(state, items, final):
+	"""Return items matching the examined prefixes of items.
+
+	Args:
+		final: Whether nothing follows items in the whole regex, i.e. a match of items ends
+		       the match of the regex.
+	"""
+	if not items:
+		return []
+	((op, av), rest) = (items[0], items[1:])
+
+	if op is sre_parse.MIN_REPEAT and final and av[1] == sre_parse.MAXREPEAT:
+		# A lazy C*? followed by a final single character D, e.g. `.*?❚`, stops at the first D
+		character = _single_char(av[2].data)
+		delimiter = _single_char(rest)
+		if character is not None and delimiter is not None:
+			return [
+				_repeat(state, 0, av[0], [character]),
+				_repeat(state, 0, sre_parse.MAXREPEAT, [
+					(sre_parse.ASSERT_NOT, (1, sre_parse.SubPattern(state, [delimiter]))),
+					character
+				])
+			]
+
+	if op in _SINGLE_CHAR_OPS or op is sre_parse.AT:
+		head = []
+	elif op is sre_parse.ASSERT or op is sre_parse.ASSERT_NOT:
+		(direction, subpattern) = av
+		if direction < 0:
+			# Lookbehinds examine the text before the match position
+			raise _Unsupported()
+		head = _examined(state, subpattern.data, False)
+	elif op is sre_parse.SUBPATTERN:
+		head = _examined(state, _subpattern_items(av), final and not rest)
+	elif op is sre_parse.BRANCH:
+		head = [_alternatives(state, [_examined(state, alternative.data, final and not rest) for alternative in av[1]])]
+	elif op in _REPEAT_OPS:
+		(_, maximum, subpattern) = av
+		if maximum == 0:
+			head = []
+		else:
+			# Up to maximum - 1 repetitions, then the examined prefixes of one more
+			head = [
+				_repeat(state, 0, sre_parse.MAXREPEAT if maximum == sre_parse.MAXREPEAT else maximum - 1, _relaxed(state, subpattern.data)),
+				_group(state, _examined(state, subpattern.data, False))
+			]
+	elif op is sre_parse.GROUPREF:
+		head = [_repeat(state, 0, sre_parse.MAXREPEAT, [_any_char()])]
+	else:
+		raise _Unsupported()
+
+	if not rest:
+		return head
+	return [_alternatives(state, [
+		head,
+		_relaxed(state, [(op, av)]) + [_group(state, _examined(state, rest, final))]
+	])]
+
+# compiled regex -> (compiled regex of its examined prefixes, their maximum length) or None
+_examined_prefixes = {}
+
+def _examined_prefixes_of(pattern):
+	if pattern not in _examined_prefixes:
+		try:
+			parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+			state = getattr(parsed, 'state', None) or parsed.pattern # Python 3.6, 3.7: pattern
+			examined = sre_parse.SubPattern(state, _examined(state, parsed.data, True))
+			maximum = examined.getwidth()[1]
+			_examined_prefixes[pattern] = (
+				sre_compile.compile(examined, pattern.flags & ~sre_parse.SRE_FLAG_VERBOSE),
+				math.inf if maximum >= sre_parse.MAXREPEAT else maximum
+			)
+		except Exception:
+			# Unsupported regexes or Python implementations
+			_examined_prefixes[pattern] = None
+	return _examined_prefixes[pattern]
+
+def examined_prefixes(pattern):
+	"""Return a compiled regex fully matching the examined prefixes of a compiled regex, None if unknown.
+
+	The examined prefixes are closed under taking prefixes, the empty string is always one.
+	"""
+	examined = _examined_prefixes_of(pattern)
+	return examined[0] if examined is not None else None
+
+def _unbounded(text, pos, scanned):
+	return math.inf
+
+def scan_reach(rexmatch):
+	"""Return a triple (bound, first, reach) of a function reach(text, pos, scanned) for a rule's rexmatch.
+
+	reach returns the maximum of scanned and the position after the last character of text
+	that rexmatch(text, pos) may examine (len(text) + 1 if it may hit the end of text). For
+	rules whose lookahead is unknown, e.g. those guarded by the lexer option `linear`, it
+	returns math.inf.
+
+	Since these positions are at most pos + bound + 1, and at most pos + 1 if first[text[pos]]
+	is False (a dict filled by reach), reach need not be called if scanned is beyond.
+	"""
+	pattern = getattr(rexmatch, '__self__', None)
+	if pattern is None or not hasattr(pattern, 'pattern') or rexmatch != pattern.match:
+		return (math.inf, {}, _unbounded)
+	examined = _examined_prefixes_of(pattern)
+	if examined is None:
+		return (math.inf, {}, _unbounded)
+	(fullmatch, bound) = (examined[0].fullmatch, examined[1])
+	first = {}
+
+	def reach(text, pos, scanned):
+		c = text[pos:pos + 1]
+		if c not in first:
+			first[c] = bool(c and fullmatch(c))
+		if not first[c]:
+			return max(scanned, pos + 1)
+
+		# text[pos:pos + length] is an examined prefix, look for the longest one
+		length = max(scanned - pos, 1)
+		if length > len(text) - pos or not fullmatch(text, pos, pos + length):
+			return scanned
+		step = 1
+		while pos + length + step <= len(text) and fullmatch(text, pos, pos + length + step):
+			length += step
+			step *= 2
+		# the longest examined prefix is shorter than length + step
+		(low, high) = (length, min(length + step, len(text) - pos + 1))
+		while high - low > 1:
+			middle = (low + high) // 2
+			if fullmatch(text, pos, pos + middle):
+				low = middle
+			else:
+				high = middle
+		return max(scanned, pos + low + 1)
+
+	return (bound, first, reach)
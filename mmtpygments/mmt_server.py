@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+"""
+	MMT Highlight Server
+	====================
+
+	A long-running local process answering highlight requests with warm lexers and
+	formatters, such that highlighting a snippet neither pays for starting Python,
+	scanning Pygments' plugins nor compiling the lexers' regexes. Installed as the
+	console script `mmtpygments-server`, see mmt_client.py for the client side.
+
+	The server speaks JSON over HTTP on a Unix socket (by default) or on a TCP port:
+
+		POST /highlight  {"requests": [request, ...]}  ->  {"results": [result, ...]}
+		GET  /status     -> statistics
+
+	A request is either {"code": ..., "lexer": ..., "formatter": ..., "options": {...},
+	"filters": [[name, {...}], ...]} to highlight code like `pygmentize -l LEXER -f FORMATTER
+	-O OPTIONS -F FILTERS`, or {"style_defs": STYLE, "formatter": ..., "options": {...}, "arg": ...}
+	like `pygmentize -S STYLE -f FORMATTER -a ARG`. Highlight requests may specify the output
+	"encoding" (as pygmentize would choose it), the output is returned as a string nevertheless.
+	A result is {"output": ...} or {"error": ...}. Only the options in
+	mmt_client.SERVER_OPTIONS are accepted, and TCP servers only listen on loopback
+	addresses, since the server does not authenticate its clients.
+
+	:author: ComFreek <comfreek@outlook.com>
+	:copyright: Copyright 2020 ComFreek
+	:license: ISC, see LICENSE for details.
+"""
+
+import argparse
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import ipaddress
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+import pygments
+from pygments.formatters import get_formatter_by_name
+from pygments.formatters.latex import LatexEmbeddedLexer, LatexFormatter
+from pygments.lexers import get_lexer_by_name
+
+from .mmt_client import SERVER_OPTIONS, default_address, parse_address
+from .mmt_compact_filter import CompactFilter
+from .mmt_fast_lexer import MMTFastLexer
+from .mmt_html_formatter import MMTHtmlFormatter
+from .mmt_lexer import MMTLexer
+from .mmt_relational_lexer import MMTRelationalLexer
+from .mmt_style import MMTDefaultStyle
+
+__all__ = ['HighlightService', 'ServerBusy', 'create_server', 'main']
+
+# Resolved directly, i.e. also without the package's plugin entry points being installed
+LEXERS = {
+	'mmt': MMTLexer,
+	'mmtfast': MMTFastLexer,
+	'mmtrel': MMTRelationalLexer
+}
+STYLES = {
+	'mmtdefault': MMTDefaultStyle
+}
+FILTERS = {
+	'mmtcompact': CompactFilter
+}
+FORMATTERS = {
+	'mmthtml': MMTHtmlFormatter
+}
+
+# Upper bound of request bodies
+MAX_REQUEST_BYTES = 64 * 1024 * 1024
+
+class ServerBusy(Exception):
+	"""No highlighting slot became free within the queue timeout."""
+
+class HighlightService:
+	"""
+	Highlighting with pools of warm lexers and formatters, independent of any transport
+
+	Lexers and formatters are kept per (name, options, filters) and reused by subsequent
+	requests with the same ones. Every instance is used by at most one thread at a time.
+
+	Args:
+		max_concurrency: Maximum number of batches highlighted at the same time, further ones
+		                 wait up to queue_timeout seconds for a free slot (default: number of CPUs).
+		max_batch:       Maximum number of requests per batch.
+		warm:            Whether to instantiate the MMT lexers and the HTML and LaTeX formatters
+		                 with the MMT style right away instead of upon the first request.
+		max_idle_keys:   Maximum number of distinct (name, options, filters) to keep idle instances
+		                 for, the least recently used ones are dropped beyond.
+	"""
+
+	def __init__(self, max_concurrency = None, max_batch = 256, queue_timeout = 30.0, warm = True, max_idle_keys = 64):
+		self.max_concurrency = max_concurrency or os.cpu_count() or 1
+		self.max_batch = max_batch
+		self.queue_timeout = queue_timeout
+		self.max_idle_keys = max_idle_keys
+
+		self._slots = threading.BoundedSemaphore(self.max_concurrency)
+		self._lock = threading.Lock()
+		# key -> idle instances, in the order of their last use
+		self._idle = OrderedDict()
+		self._start_time = time.time()
+		self.statistics = {'batches': 0, 'requests': 0, 'errors': 0, 'rejected': 0, 'seconds': 0.0}
+
+		if warm:
+			self.warm_up()
+
+	def warm_up(self):
+		for name in ('mmt', 'mmtrel'):
+			key = self._lexer_key(name, {}, [])
+			self._checkin(key, self._checkout(key))
+		for name in ('html', 'latex'):
+			key = self._formatter_key(name, {'style': 'mmtdefault'})
+			self._checkin(key, self._checkout(key))
+
+	@staticmethod
+	def _lexer_key(name, options, filters):
+		return ('lexer', name, json.dumps(options, sort_keys = True), json.dumps(filters, sort_keys = True))
+
+	@staticmethod
+	def _formatter_key(name, options):
+		return ('formatter', name, json.dumps(options, sort_keys = True), None)
+
+	@staticmethod
+	def _create(key):
+		(kind, name, options, filters) = key
+		options = json.loads(options)
+		if kind == 'lexer':
+			lexer = LEXERS[name](**options) if name in LEXERS else get_lexer_by_name(name, **options)
+			for (filter_name, filter_options) in json.loads(filters):
+				if filter_name in FILTERS:
+					lexer.add_filter(FILTERS[filter_name](**filter_options))
+				else:
+					lexer.add_filter(filter_name, **filter_options)
+			return lexer
+		else:
+			if options.get('style') in STYLES:
+				options['style'] = STYLES[options['style']]
+			return FORMATTERS[name](**options) if name in FORMATTERS else get_formatter_by_name(name, **options)
+
+	def _checkout(self, key):
+		with self._lock:
+			idle = self._idle.get(key)
+			if idle:
+				return idle.pop()
+		return self._create(key)
+
+	def _checkin(self, key, instance):
+		with self._lock:
+			self._idle.setdefault(key, []).append(instance)
+			self._idle.move_to_end(key)
+			while len(self._idle) > self.max_idle_keys:
+				self._idle.popitem(last = False)
+
+	@staticmethod
+	def _check_options(options):
+		if not isinstance(options, dict):
+			raise TypeError('options must be an object')
+		unsupported = sorted(set(options) - SERVER_OPTIONS)
+		if unsupported:
+			raise ValueError('unsupported options: ' + ', '.join(unsupported))
+
+	def handle(self, request):
+		"""Process a single request (see the module docstring) and return its result."""
+		try:
+			options = request.get('options', {})
+			self._check_options(options)
+			if 'style_defs' in request:
+				formatter_key = self._formatter_key(request['formatter'], dict(options, style = request['style_defs']))
+				formatter = self._checkout(formatter_key)
+				try:
+					output = formatter.get_style_defs(request.get('arg', ''))
+				finally:
+					self._checkin(formatter_key, formatter)
+				return {'output': output}
+
+			lexer_key = self._lexer_key(request['lexer'], options, request.get('filters', []))
+			formatter_key = self._formatter_key(
+				request['formatter'], dict(options, outencoding = request['encoding']) if request.get('encoding') else options
+			)
+			lexer = self._checkout(lexer_key)
+			try:
+				formatter = self._checkout(formatter_key)
+				try:
+					# like pygmentize
+					escapeinside = options.get('escapeinside', '')
+					highlight_lexer = lexer
+					if len(escapeinside) == 2 and isinstance(formatter, LatexFormatter):
+						highlight_lexer = LatexEmbeddedLexer(escapeinside[0], escapeinside[1], lexer)
+					output = pygments.highlight(request['code'], highlight_lexer, formatter)
+					if isinstance(output, bytes):
+						# The output encoding only affects the contents, e.g. the charset of HTML documents
+						output = output.decode(formatter.encoding)
+				finally:
+					self._checkin(formatter_key, formatter)
+			finally:
+				self._checkin(lexer_key, lexer)
+			return {'output': output}
+		except Exception as error: # e.g. unknown lexers, invalid options
+			with self._lock:
+				self.statistics['errors'] += 1
+			return {'error': '{}: {}'.format(type(error).__name__, error)}
+
+	def handle_batch(self, requests):
+		"""Process a list of requests in one highlighting slot and return the list of results.
+
+		Raise:
+			ValueError if there are too many requests, ServerBusy if no slot became free in time.
+		"""
+		if len(requests) > self.max_batch:
+			raise ValueError('batch of {} requests exceeds the maximum of {}'.format(len(requests), self.max_batch))
+		if not self._slots.acquire(timeout = self.queue_timeout):
+			with self._lock:
+				self.statistics['rejected'] += 1
+			raise ServerBusy('all {} highlighting slots are busy'.format(self.max_concurrency))
+
+		try:
+			start_time = time.perf_counter()
+			results = [self.handle(request) for request in requests]
+			seconds = time.perf_counter() - start_time
+		finally:
+			self._slots.release()
+
+		with self._lock:
+			self.statistics['batches'] += 1
+			self.statistics['requests'] += len(requests)
+			self.statistics['seconds'] += seconds
+		return results
+
+	def status(self):
+		with self._lock:
+			return dict(
+				self.statistics,
+				uptime = time.time() - self._start_time,
+				max_concurrency = self.max_concurrency,
+				max_batch = self.max_batch,
+				idle_instances = sum(len(idle) for idle in self._idle.values())
+			)
+
+class _RequestHandler(BaseHTTPRequestHandler):
+	server_version = 'mmtpygments-server'
+
+	def _send(self, status, payload):
+		body = json.dumps(payload).encode('utf-8')
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def do_GET(self):
+		if self.path == '/status':
+			self._send(200, self.server.service.status())
+		else:
+			self._send(404, {'error': 'unknown path ' + self.path})
+
+	def do_POST(self):
+		if self.path != '/highlight':
+			self._send(404, {'error': 'unknown path ' + self.path})
+			return
+
+		length = int(self.headers.get('Content-Length', 0))
+		if length > MAX_REQUEST_BYTES:
+			self._send(413, {'error': 'request exceeds {} bytes'.format(MAX_REQUEST_BYTES)})
+			return
+		try:
+			requests = json.loads(self.rfile.read(length).decode('utf-8'))['requests']
+			results = self.server.service.handle_batch(requests)
+		except ServerBusy as error:
+			self._send(503, {'error': str(error)})
+		except (ValueError, KeyError, TypeError) as error:
+			self._send(400, {'error': str(error)})
+		else:
+			self._send(200, {'results': results})
+
+	def address_string(self):
+		# Unix socket clients have no address
+		return str(self.client_address[0]) if self.client_address else 'unix'
+
+	def log_message(self, format, *args):
+		if self.server.verbose:
+			super().log_message(format, *args)
+
+class _TCPServer(socketserver.ThreadingMixIn, HTTPServer):
+	daemon_threads = True
+
+if hasattr(socket, 'AF_UNIX'):
+	class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+		daemon_threads = True
+
+def _remove_stale_socket(path):
+	"""Remove the Unix socket at path if no server listens on it anymore."""
+	if not os.path.exists(path):
+		return
+	probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		probe.connect(path)
+	except ConnectionRefusedError:
+		os.remove(path)
+	else:
+		raise OSError('a server is already listening on ' + path)
+	finally:
+		probe.close()
+
+def _is_loopback(host):
+	"""Return whether host only resolves to loopback addresses."""
+	try:
+		addresses = socket.getaddrinfo(host, None)
+	except socket.gaierror:
+		return False
+	return all(ipaddress.ip_address(sockaddr[0].split('%')[0]).is_loopback for (_, _, _, _, sockaddr) in addresses)
+
+def create_server(service, address = None, verbose = False):
+	"""Create a threading HTTP server for service listening at address (see mmt_client.parse_address).
+
+	Unix sockets are only accessible by the current user, TCP servers are only created on
+	loopback addresses.
+
+	Raise:
+		ValueError if address is a TCP address on another host than the loopback one.
+	"""
+	(kind, target) = parse_address(address or default_address())
+	if kind == 'tcp' and not _is_loopback(target[0]):
+		raise ValueError('refusing to listen on {}, the server does not authenticate clients: use a loopback '
+		                 'address such as localhost'.format(target[0]))
+	if kind == 'unix':
+		_remove_stale_socket(target)
+		previous_umask = os.umask(0o177)
+		try:
+			server = _UnixServer(target, _RequestHandler)
+		finally:
+			os.umask(previous_umask)
+	else:
+		server = _TCPServer(target, _RequestHandler)
+	server.service = service
+	server.verbose = verbose
+	return server
+
+def main(args = None):
+	parser = argparse.ArgumentParser(
+		prog = 'mmtpygments-server',
+		description = 'Serve highlight requests of mmtpygmentize-client with warm lexers and formatters.'
+	)
+	parser.add_argument('--address', default = None,
+		help = 'Unix socket path or HOST:PORT with a loopback HOST to listen on (default: $MMTPYGMENTS_SERVER or {})'.format(default_address()))
+	parser.add_argument('--max-concurrency', type = int, default = None,
+		help = 'maximum number of batches highlighted at the same time (default: number of CPUs)')
+	parser.add_argument('--max-batch', type = int, default = 256,
+		help = 'maximum number of requests per batch (default: 256)')
+	parser.add_argument('--queue-timeout', type = float, default = 30.0,
+		help = 'seconds a batch waits for a free slot before it is rejected (default: 30)')
+	parser.add_argument('-v', '--verbose', action = 'store_true',
+		help = 'log every request to stderr')
+	options = parser.parse_args(args)
+
+	service = HighlightService(options.max_concurrency, options.max_batch, options.queue_timeout)
+	address = options.address or default_address()
+	(kind, target) = parse_address(address)
+	try:
+		server = create_server(service, address, options.verbose)
+	except ValueError as error:
+		parser.error(str(error))
+
+	# Terminate gracefully (removing the socket) upon SIGTERM, too
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+	print('Listening on ' + address, file = sys.stderr)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		if kind == 'unix' and os.path.exists(target):
+			os.remove(target)
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
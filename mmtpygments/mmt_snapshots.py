@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+"""
+	Golden Token Snapshots
+	======================
+
+	Stores the token streams of a corpus of MMT files as golden snapshots and checks
+	lexers against them, such that any change in how tokens are classified shows up,
+	not only new error tokens. Installed as the console script `mmtpygments-snapshots`.
+
+	A snapshot directory contains `index.json`, mapping every file (by its path relative
+	to the snapshot directory) to the SHA-256 digests of its contents and of its token
+	stream, and one compressed `DIGEST.tokens` file per distinct token stream. Checking
+	a file only takes lexing and hashing it; the golden tokens are only decoded to print
+	where the token streams of a mismatching file diverge.
+
+	:author: ComFreek <comfreek@outlook.com>
+	:copyright: Copyright 2020 ComFreek
+	:license: ISC, see LICENSE for details.
+"""
+
+import argparse
+from array import array
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+from itertools import accumulate
+import json
+import os
+import sys
+import tempfile
+import time
+import zlib
+
+from pygments.token import string_to_tokentype
+
+from .mmt_token_array import TokenArray
+
+__all__ = ['SnapshotResult', 'SnapshotStore', 'encode_snapshot', 'decode_snapshot', 'main']
+
+# Increase upon any change of the index's or the snapshot files' format
+SNAPSHOT_FORMAT_VERSION = 2
+
+INDEX_FILENAME = 'index.json'
+SNAPSHOT_FILE_SUFFIX = '.tokens'
+_MAGIC = b'MMTSNAPSHOT'
+
+# Result of checking a single file against its snapshot
+#
+#  - filename: the checked file, relative to the current directory
+#  - status:   one of
+#                'ok':       the tokens equal the snapshot
+#                'mismatch': the tokens differ from the snapshot, see message
+#                'changed':  the file's contents changed since the snapshot was taken
+#                'new':      there is no snapshot of the file
+#                'missing':  there is a snapshot, but the file does not exist anymore
+#                'error':    the file could not be lexed or the snapshot not be read, see message
+#  - message:  a human-readable description for all statuses but 'ok', otherwise None
+SnapshotResult = namedtuple('SnapshotResult', ['filename', 'status', 'message'])
+
+def _payload(tokens):
+	"""Return the canonical bytes of a TokenArray, independent of the machine and of how the array was built.
+
+	Token types are numbered in order of their first occurrence, as TokenArray does anyway.
+	"""
+	type_ids = array('I', tokens.type_ids)
+	lengths = array('I', tokens.lengths)
+	if sys.byteorder != 'little':
+		type_ids.byteswap()
+		lengths.byteswap()
+
+	# Tokens of lexers usually cover their text contiguously, others' values (e.g. altered by filters) are concatenated
+	if not len(tokens):
+		text = ''
+	elif tokens._values is None and tokens.starts == array('I', accumulate([0] + list(tokens.lengths[:-1]))):
+		text = tokens.text[:tokens.starts[-1] + tokens.lengths[-1]]
+	else:
+		text = ''.join(value for (_, value) in tokens)
+
+	header = json.dumps({'types': [str(tokentype) for tokentype in tokens.tokentypes], 'count': len(tokens)}).encode('utf-8')
+	return len(header).to_bytes(4, 'little') + header + type_ids.tobytes() + lengths.tobytes() + text.encode('utf-8')
+
+def encode_snapshot(tokens):
+	"""Return (digest, encoded bytes) of a TokenArray, the digest identifying the token stream."""
+	payload = _payload(tokens)
+	return (hashlib.sha256(payload).hexdigest(), _MAGIC + zlib.compress(payload))
+
+def decode_snapshot(data):
+	"""Decode bytes produced by encode_snapshot into a TokenArray.
+
+	Raises ValueError on data not produced by encode_snapshot.
+	"""
+	if not data.startswith(_MAGIC):
+		raise ValueError('Not a token snapshot')
+	try:
+		data = zlib.decompress(data[len(_MAGIC):])
+	except zlib.error as error:
+		raise ValueError('Corrupt token snapshot') from error
+
+	header_length = int.from_bytes(data[:4], 'little')
+	header = json.loads(data[4:4 + header_length].decode('utf-8'))
+
+	offset = 4 + header_length
+	array_size = 4 * header['count']
+	(type_ids, lengths) = (array('I'), array('I'))
+	if type_ids.itemsize != 4:
+		raise ValueError('Token snapshots are not supported on this machine')
+	type_ids.frombytes(data[offset:offset + array_size])
+	lengths.frombytes(data[offset + array_size:offset + 2 * array_size])
+	if sys.byteorder != 'little':
+		type_ids.byteswap()
+		lengths.byteswap()
+	text = data[offset + 2 * array_size:].decode('utf-8')
+
+	starts = array('I', accumulate([0] + list(lengths[:-1]))) if lengths else array('I')
+	return TokenArray(text, [string_to_tokentype(name) for name in header['types']], type_ids, starts, lengths)
+
+def _file_key(filename, directory):
+	"""Return the key of filename in the index of the snapshot directory, its path relative to the latter."""
+	return os.path.relpath(filename, directory).replace(os.sep, '/')
+
+def _key_filename(key, directory):
+	"""Return the path of the file of an index key of the snapshot directory."""
+	return os.path.normpath(os.path.join(directory, key.replace('/', os.sep)))
+
+def _display_name(filename):
+	return os.path.relpath(filename).replace(os.sep, '/')
+
+def _source_digest(source):
+	return hashlib.sha256(source).hexdigest()
+
+def _shorten(value, length = 60):
+	value = repr(value)
+	return value if len(value) <= length else value[:length - 4] + '...' + value[-1]
+
+def describe_difference(filename, expected, actual):
+	"""Return a message locating the first differing token of two TokenArrays, None if they are equal.
+
+	Both token streams agree on everything before that token, hence also on its line and column.
+	"""
+	index = next(
+		(index for (index, (expected_token, actual_token)) in enumerate(zip(expected, actual)) if expected_token != actual_token),
+		min(len(expected), len(actual))
+	)
+	if index == len(expected) == len(actual):
+		return None
+
+	def describe(tokens, index, length = 60):
+		if index >= len(tokens):
+			return 'end of tokens'
+		(tokentype, value) = tokens[index]
+		return '{} {}'.format(tokentype, _shorten(value, length))
+
+	offset = sum(expected.lengths[:index])
+	line = expected.text.count('\n', 0, offset) + 1
+	column = offset - (expected.text.rfind('\n', 0, offset) + 1) + 1
+
+	return '{}:{}:{}: token #{} differs{}\n\texpected: {}\n\tactual:   {}'.format(
+		filename, line, column, index,
+		' (after {})'.format(describe(expected, index - 1, 30)) if index > 0 else '',
+		describe(expected, index),
+		describe(actual, index)
+	)
+
+# Per process state, see _init_worker
+_lexer = None
+
+def _init_worker(lexer_name, lexer_options):
+	global _lexer
+	from .mmt_batch import LEXERS
+
+	# Without stripping leading newlines, offsets into the lexed text correspond to lines of the file
+	_lexer = LEXERS[lexer_name](**dict({'encoding': 'utf-8', 'stripnl': False}, **lexer_options))
+
+def _read(filename):
+	with open(filename, 'rb') as source_file:
+		return source_file.read()
+
+def _take_snapshot(filename):
+	"""Return (filename, source digest, token digest, encoded tokens, number of tokens) or (filename, exception message)."""
+	try:
+		source = _read(filename)
+		tokens = _lexer.get_token_array(source)
+		(digest, data) = encode_snapshot(tokens)
+		return (filename, _source_digest(source), digest, data, len(tokens))
+	except Exception as exception:
+		return (filename, '{}: {}'.format(type(exception).__name__, exception))
+
+def _check_file(task):
+	(filename, entry, directory) = task
+	key = _display_name(filename)
+	try:
+		if entry is None:
+			return SnapshotResult(key, 'new', '{}: no snapshot of this file'.format(key))
+		if not os.path.exists(filename):
+			return SnapshotResult(key, 'missing', '{}: file of the snapshot does not exist anymore'.format(key))
+		source = _read(filename)
+		if _source_digest(source) != entry['source']:
+			return SnapshotResult(key, 'changed', '{}: file changed since the snapshot was taken'.format(key))
+		tokens = _lexer.get_token_array(source)
+		if hashlib.sha256(_payload(tokens)).hexdigest() == entry['tokens']:
+			return SnapshotResult(key, 'ok', None)
+
+		with open(os.path.join(directory, entry['tokens'] + SNAPSHOT_FILE_SUFFIX), 'rb') as snapshot_file:
+			expected = decode_snapshot(snapshot_file.read())
+		return SnapshotResult(key, 'mismatch', describe_difference(key, expected, tokens)
+			or '{}: tokens differ from the snapshot only in their encoding'.format(key))
+	except Exception as exception:
+		return SnapshotResult(key, 'error', '{}: {}: {}'.format(key, type(exception).__name__, exception))
+
+def _map(function, tasks, jobs, lexer, lexer_options):
+	"""Map function over tasks on a process pool with a lexer in every process (see highlight_files of mmt_batch.py)."""
+	jobs = jobs or os.cpu_count() or 1
+	initargs = (lexer, lexer_options)
+
+	if jobs == 1:
+		_init_worker(*initargs)
+		yield from map(function, tasks)
+	else:
+		with ProcessPoolExecutor(jobs, initializer = _init_worker, initargs = initargs) as pool:
+			yield from pool.map(function, tasks, chunksize = 4)
+
+class SnapshotStore:
+	"""
+	Directory of golden token snapshots
+
+	Attributes:
+		directory: The snapshot directory.
+		entries:   A dictionary mapping files (relative to directory, with / as separator, see
+		           key) to dictionaries {source: ..., tokens: ..., count: ...} of the SHA-256
+		           digests of the file's contents and of its tokens and the number of tokens.
+		lexer, lexer_options: The lexer (a key of mmt_batch.LEXERS) and its options the snapshots
+		           were taken with.
+	"""
+
+	def __init__(self, directory, entries = None, lexer = 'mmt', lexer_options = None):
+		self.directory = directory
+		self.entries = entries if entries is not None else {}
+		self.lexer = lexer
+		self.lexer_options = lexer_options if lexer_options is not None else {}
+
+	@classmethod
+	def load(cls, directory):
+		"""Load the snapshots in directory.
+
+		Raises OSError if there are none and ValueError on an unsupported format.
+		"""
+		with open(os.path.join(directory, INDEX_FILENAME), 'r', encoding = 'utf-8') as index_file:
+			index = json.load(index_file)
+		if index.get('format') != SNAPSHOT_FORMAT_VERSION:
+			raise ValueError('Snapshots of unsupported format {!r}: {}'.format(index.get('format'), directory))
+		return cls(directory, index['files'], index['lexer'], index['lexer_options'])
+
+	def key(self, filename):
+		"""Return the key of filename in entries.
+
+		Keys are relative to the snapshot directory (not to the current directory), such that
+		the snapshots can be checked from any working directory.
+		"""
+		return _file_key(filename, self.directory)
+
+	def save(self):
+		"""Write the index atomically and remove all snapshot files no longer referenced."""
+		os.makedirs(self.directory, exist_ok = True)
+		(handle, temp_path) = tempfile.mkstemp(dir = self.directory, suffix = '.tmp')
+		try:
+			with os.fdopen(handle, 'w', encoding = 'utf-8', newline = '\n') as index_file:
+				json.dump({
+					'format': SNAPSHOT_FORMAT_VERSION,
+					'lexer': self.lexer,
+					'lexer_options': self.lexer_options,
+					'files': self.entries
+				}, index_file, indent = '\t', sort_keys = True)
+				index_file.write('\n')
+			os.replace(temp_path, os.path.join(self.directory, INDEX_FILENAME))
+		except BaseException:
+			try:
+				os.remove(temp_path)
+			except OSError:
+				pass
+			raise
+
+		referenced = {entry['tokens'] + SNAPSHOT_FILE_SUFFIX for entry in self.entries.values()}
+		for filename in os.listdir(self.directory):
+			if filename.endswith(SNAPSHOT_FILE_SUFFIX) and filename not in referenced:
+				os.remove(os.path.join(self.directory, filename))
+
+	def update(self, filenames, jobs = None):
+		"""Take snapshots of filenames, replacing all previous ones, and save them.
+
+		Return:
+			A list of (filename, message) of the files that could not be lexed (and have no snapshot).
+		"""
+		entries = {}
+		failures = []
+		os.makedirs(self.directory, exist_ok = True)
+		for result in _map(_take_snapshot, filenames, jobs, self.lexer, self.lexer_options):
+			if len(result) == 2:
+				failures.append(result)
+				continue
+
+			(filename, source_digest, digest, data, count) = result
+			snapshot_filename = os.path.join(self.directory, digest + SNAPSHOT_FILE_SUFFIX)
+			if not os.path.exists(snapshot_filename):
+				with open(snapshot_filename, 'wb') as snapshot_file:
+					snapshot_file.write(data)
+			entries[self.key(filename)] = {'source': source_digest, 'tokens': digest, 'count': count}
+
+		self.entries = entries
+		self.save()
+		return failures
+
+	def verify(self, filenames = None, jobs = None, lexer = None, lexer_options = None):
+		"""Check the tokens of filenames against their snapshots on a process pool.
+
+		Args:
+			filenames:     The files to check, by default all files with snapshots. Files with snapshots
+			               that are not among filenames are not reported.
+			jobs:          Number of processes, by default os.cpu_count(). With 1, everything runs
+			               in the current process.
+			lexer, lexer_options: The lexer and its options to check, by default the ones the snapshots
+			               were taken with, e.g. to check that an option does not change any token.
+
+		Return:
+			An iterator of SnapshotResult objects in the order of filenames.
+		"""
+		if filenames is None:
+			filenames = [_key_filename(key, self.directory) for key in sorted(self.entries)]
+		tasks = [(filename, self.entries.get(self.key(filename)), self.directory) for filename in filenames]
+		return _map(
+			_check_file, tasks, jobs,
+			lexer or self.lexer,
+			lexer_options if lexer_options is not None else self.lexer_options
+		)
+
+def _parse_lexer_options(option_strings):
+	"""Parse options given like `-O name=value,name=value` to pygmentize."""
+	lexer_options = {}
+	for option_string in option_strings:
+		for option in option_string.split(','):
+			(name, _, value) = option.partition('=')
+			if name.strip():
+				lexer_options[name.strip()] = value.strip() if value else True
+	return lexer_options
+
+def main(args = None):
+	from .mmt_batch import LEXERS, find_files
+
+	parser = argparse.ArgumentParser(
+		prog = 'mmtpygments-snapshots',
+		description = 'Take golden token snapshots of MMT files and check lexers against them.'
+	)
+	commands = parser.add_subparsers(dest = 'command')
+	commands.required = True
+
+	for (command, description) in (
+		('update', 'take snapshots of all files below PATHs, replacing all previous snapshots'),
+		('verify', 'check the tokens of all files below PATHs (default: all snapshotted files) against their snapshots')
+	):
+		command_parser = commands.add_parser(command, help = description)
+		command_parser.add_argument('paths', nargs = '+' if command == 'update' else '*', metavar = 'PATH',
+			help = 'MMT file or directory to search recursively for MMT files')
+		command_parser.add_argument('-s', '--snapshots', metavar = 'DIR', default = 'snapshots',
+			help = 'snapshot directory (default: snapshots)')
+		command_parser.add_argument('-j', '--jobs', type = int, default = None,
+			help = 'number of processes (default: number of CPUs)')
+		command_parser.add_argument('-l', '--lexer', choices = sorted(LEXERS), default = None,
+			help = 'lexer to use (default: mmt for update, the snapshots\' lexer for verify)')
+		command_parser.add_argument('-O', dest = 'lexer_options', action = 'append', default = [], metavar = 'OPTIONS',
+			help = 'lexer options like name=value,name=value (default: none for update, the snapshots\' options for verify)')
+		command_parser.add_argument('--pattern', action = 'append', default = None,
+			help = 'file name pattern to search for in directories (default: *.mmt), can be given multiple times')
+		command_parser.add_argument('--exclude', action = 'append', default = [],
+			help = 'path pattern to exclude, can be given multiple times')
+
+	options = parser.parse_args(args)
+	start = time.perf_counter()
+	filenames = find_files(options.paths, options.pattern or ('*.mmt',), options.exclude) if options.paths else None
+
+	if options.command == 'update':
+		store = SnapshotStore(options.snapshots, lexer = options.lexer or 'mmt',
+			lexer_options = _parse_lexer_options(options.lexer_options))
+		failures = store.update(filenames, options.jobs)
+		for (filename, message) in failures:
+			print('{}: {}'.format(_display_name(filename), message), file = sys.stderr)
+		print('Took snapshots of {} files in {:.2f} s into {}'.format(
+			len(store.entries), time.perf_counter() - start, options.snapshots
+		), file = sys.stderr)
+		return 0 if not failures else 1
+
+	try:
+		store = SnapshotStore.load(options.snapshots)
+	except (OSError, ValueError) as error:
+		print('Error: {}'.format(error), file = sys.stderr)
+		return 1
+
+	num_files = 0
+	failures = []
+	for result in store.verify(filenames, options.jobs, options.lexer,
+		_parse_lexer_options(options.lexer_options) if options.lexer_options else None):
+		num_files += 1
+		if result.status != 'ok':
+			failures.append(result)
+			print(result.message)
+
+	print('Checked {} files in {:.2f} s: {} differ from their snapshots'.format(
+		num_files, time.perf_counter() - start, len(failures)
+	), file = sys.stderr)
+	return 0 if not failures else 1
+
+if __name__ == "__main__":
+	sys.exit(main())
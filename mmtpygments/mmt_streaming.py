@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+	Streaming Lexing of MMT Files
+	=============================
+
+	Lexes file objects and memory-mapped files in bounded windows cut at top-level
+	module delimiters, see MMTLexer.get_tokens.
+
+	:author: ComFreek <comfreek@outlook.com>
+	:copyright: Copyright 2020 ComFreek
+	:license: ISC, see LICENSE for details.
+"""
+
+import codecs
+
+from .mmt_incremental import get_tokens_with_checkpoints
+
+__all__ = ['stream_tokens', 'preprocessed_chunks']
+
+ROOT_STACK = ('root',)
+
+# Size of blocks read from the file
+BLOCK_SIZE = 64 * 1024
+
+def preprocessed_chunks(lexer, source, block_size = BLOCK_SIZE):
+	"""Read source block by block and preprocess it like lexer.get_tokens does with a whole text.
+
+	Args:
+		lexer:  The lexer whose options (encoding, stripnl etc.) to apply.
+		source: A file object (text or binary) or an mmap object. Binary contents are decoded with
+		        lexer.encoding, or UTF-8 if the encoding is to be guessed.
+
+	Yield:
+		Strings that concatenated equal the preprocessed whole text.
+	"""
+	decoder = codecs.getincrementaldecoder(
+		lexer.encoding if lexer.encoding not in ('guess', 'chardet') else 'utf-8'
+	)()
+
+	if lexer.stripall:
+		strip_chars = None # whitespace
+	elif lexer.stripnl:
+		strip_chars = '\n'
+	else:
+		strip_chars = ''
+
+	# State across blocks: unprocessed remainder of the last block, whether a (non-empty)
+	# block has been read yet, whether any non-stripped text has been emitted yet,
+	# trailing text held back in case it gets stripped at the end, the column modulo
+	# tabsize and the last character emitted.
+	carry = ''
+	first_block = True
+	at_start = True
+	held_back = ''
+	column = 0
+	last_char = None
+
+	def process(chunk, final):
+		nonlocal at_start, held_back, column, last_char
+
+		chunk = chunk.replace('\r\n', '\n').replace('\r', '\n')
+		if strip_chars != '':
+			if at_start:
+				chunk = chunk.lstrip(strip_chars)
+				if not chunk:
+					return
+				at_start = False
+
+			chunk = held_back + chunk
+			stripped = chunk.rstrip(strip_chars)
+			held_back = chunk[len(stripped):]
+			chunk = stripped
+			if final:
+				held_back = ''
+
+		if lexer.tabsize > 0 and chunk:
+			# Tab stops depend on the column the chunk starts at
+			prefix = ' ' * column
+			chunk = (prefix + chunk).expandtabs(lexer.tabsize)[len(prefix):]
+			line_start = chunk.rfind('\n') + 1
+			column = (column + len(chunk) if line_start == 0 else len(chunk) - line_start) % lexer.tabsize
+
+		if chunk:
+			last_char = chunk[-1]
+			yield chunk
+
+	while True:
+		block = source.read(block_size)
+		if not block:
+			break
+		if isinstance(block, (bytes, bytearray)):
+			block = decoder.decode(block)
+		if first_block and block:
+			first_block = False
+			if block.startswith('\ufeff'):
+				block = block[len('\ufeff'):]
+
+		# Only pass on complete lines, such that neither \r\n is split nor tabs are expanded mid-line
+		# (a trailing \r is kept back since a \n may follow in the next block)
+		text = carry + block
+		cut = max(text.rfind('\n'), text.rfind('\r', 0, len(text) - 1)) + 1
+		(chunk, carry) = (text[:cut], text[cut:])
+		if chunk:
+			yield from process(chunk, False)
+
+	yield from process(carry + decoder.decode(b'', True), True)
+	if lexer.ensurenl and last_char != '\n':
+		yield '\n'
+
+def stream_tokens(lexer, source, window_size = 64 * 1024, lookahead = 64 * 1024, block_size = BLOCK_SIZE):
+	"""Lex source in windows, yielding the same (tokentype, value) pairs as lexing its whole contents would.
+
+	Text is read until the window holds window_size + lookahead characters. The window is then
+	lexed up to lookahead characters before its end. The tokens up to the last checkpoint there
+	(after a ❚ or ❙, see get_tokens_with_checkpoints) are yielded and the next pass resumes
+	lexing at that checkpoint with the following text. The window is cut at the last module
+	delimiter (❚) after which the lexer is in the root state; if it lacks such a cut, it grows
+	until it has one or the source ends. Hence, memory stays bounded by a few windows for files
+	consisting of many top-level modules, but a window grows to the size of the largest module.
+
+	The tokens are exact only if no rule matching or failing before a checkpoint scans more
+	than lookahead characters past it, since the text beyond may not have been read yet.
+
+	Args:
+		lexer:     A RegexLexer instance whose rules to use, e.g. MMTLexer().
+		source:    A file object (text or binary) or an mmap object, see preprocessed_chunks.
+		lookahead: Number of characters after a checkpoint that are available to the rules tried
+		           before it.
+	"""
+	chunks = preprocessed_chunks(lexer, source, block_size)
+	window = ''
+	exhausted = False
+	target_size = window_size + lookahead
+	# Position in window and state stack to resume lexing at
+	(resume, resume_stack) = (0, ROOT_STACK)
+
+	while True:
+		pieces = [window]
+		size = len(window)
+		while not exhausted and size < target_size:
+			chunk = next(chunks, None)
+			if chunk is None:
+				exhausted = True
+			else:
+				pieces.append(chunk)
+				size += len(chunk)
+		window = ''.join(pieces)
+
+		if exhausted:
+			yield from (
+				(tokentype, value) for (_, tokentype, value) in get_tokens_with_checkpoints(lexer, window, resume, resume_stack)
+				if tokentype is not None
+			)
+			return
+
+		limit = len(window) - lookahead
+		tokens = []
+		(checkpoint, checkpoint_stack, checkpoint_tokens) = (None, None, 0)
+		cut = None
+		for (index, tokentype, value) in get_tokens_with_checkpoints(lexer, window, resume, resume_stack):
+			if index > limit:
+				break
+			if tokentype is None:
+				(checkpoint, checkpoint_stack, checkpoint_tokens) = (index, value, len(tokens))
+				if value == ROOT_STACK:
+					cut = index
+			else:
+				tokens.append((tokentype, value))
+
+		if checkpoint is not None:
+			del tokens[checkpoint_tokens:]
+			yield from tokens
+			(resume, resume_stack) = (checkpoint, checkpoint_stack)
+
+		if cut is None:
+			# No cut yet, read more
+			target_size = len(window) + window_size
+			continue
+
+		window = window[cut:]
+		resume -= cut
+		target_size = window_size + lookahead
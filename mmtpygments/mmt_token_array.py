@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+	Compact Token Streams
+	=====================
+
+	Token streams as parallel arrays of offsets, lengths and token type ids pointing
+	into the lexed text, see MMTLexer.get_token_array.
+
+	:author: ComFreek <comfreek@outlook.com>
+	:copyright: Copyright 2020 ComFreek
+	:license: ISC, see LICENSE for details.
+"""
+
+from array import array
+from itertools import accumulate
+
+from pygments.token import string_to_tokentype
+
+__all__ = ['TokenArray']
+
+def _narrow(values):
+	"""Return the array of unsigned integers values with the smallest item size sufficient."""
+	maximum = max(values) if values else 0
+	for typecode in ('B', 'H', 'I'):
+		if maximum < 1 << (8 * array(typecode).itemsize):
+			return values if values.typecode == typecode else array(typecode, values)
+	return values
+
+class TokenArray:
+	"""
+	Compact, immutable sequence of (tokentype, value) pairs
+
+	Instead of one tuple and one substring per token, only the text is stored once,
+	along with the start offset, length and token type id (an index into the list
+	`tokentypes`) of every token in three arrays, i.e. 6 to 12 bytes per token. Pairs are
+	only created upon access, e.g. by iteration, which makes a TokenArray a drop-in
+	token source for formatters:
+
+		tokens = MMTLexer().get_token_array(text)
+		pygments.format(tokens, HtmlFormatter())
+
+	Token arrays pickle compactly, e.g. for passing them between processes.
+
+	Attributes:
+		text:       The text all tokens point into.
+		tokentypes: All distinct token types, indexed by the type ids.
+		type_ids, starts, lengths: The per-token arrays.
+	"""
+
+	__slots__ = ('text', 'tokentypes', 'type_ids', 'starts', 'lengths', '_values')
+
+	def __init__(self, text, tokentypes, type_ids, starts, lengths, values = None):
+		"""
+		Args:
+			values: A dictionary mapping indices of tokens whose value is not text[start:start + length]
+			        to their value, e.g. of tokens altered by filters. None if there are none.
+		"""
+		self.text = text
+		self.tokentypes = tokentypes
+		self.type_ids = type_ids
+		self.starts = starts
+		self.lengths = lengths
+		self._values = values
+
+	@classmethod
+	def lex(cls, lexer, text):
+		"""Lex text with lexer into a TokenArray, which equals list(lexer.get_tokens(text)).
+
+		Tokens point into text after the preprocessing of get_tokens (newline normalization etc.).
+		"""
+		from .mmt_parallel import preprocess_text
+
+		if lexer.filters or getattr(lexer, 'cachedir', None):
+			# Filters and cached token streams do not point into the text
+			return cls.from_tokens(lexer.get_tokens(text))
+
+		text = preprocess_text(lexer, text)
+		tokentype_ids = {}
+		type_ids = array('H')
+		starts = array('I')
+		lengths = array('I')
+		values = None
+
+		for (index, tokentype, value) in lexer.get_tokens_unprocessed(text):
+			type_ids.append(tokentype_ids.setdefault(tokentype, len(tokentype_ids)))
+			starts.append(index)
+			lengths.append(len(value))
+			if not text.startswith(value, index):
+				values = values or {}
+				values[len(starts) - 1] = value
+
+		return cls(text, list(tokentype_ids), _narrow(type_ids), starts, _narrow(lengths), values)
+
+	@classmethod
+	def from_tokens(cls, tokens):
+		"""Create a TokenArray of arbitrary (tokentype, value) pairs, whose values are concatenated as text."""
+		tokentype_ids = {}
+		type_ids = array('H')
+		lengths = array('I')
+		values = []
+
+		for (tokentype, value) in tokens:
+			type_ids.append(tokentype_ids.setdefault(tokentype, len(tokentype_ids)))
+			lengths.append(len(value))
+			values.append(value)
+
+		starts = array('I', accumulate([0] + list(lengths[:-1]))) if lengths else array('I')
+		return cls(''.join(values), list(tokentype_ids), _narrow(type_ids), starts, _narrow(lengths))
+
+	def __len__(self):
+		return len(self.starts)
+
+	def value(self, i):
+		if self._values is not None and i in self._values:
+			return self._values[i]
+		start = self.starts[i]
+		return self.text[start:start + self.lengths[i]]
+
+	def tokentype(self, i):
+		return self.tokentypes[self.type_ids[i]]
+
+	def __getitem__(self, i):
+		if i < 0:
+			i += len(self)
+		if not 0 <= i < len(self):
+			raise IndexError('TokenArray index out of range')
+		return (self.tokentype(i), self.value(i))
+
+	def __iter__(self):
+		(text, tokentypes, values) = (self.text, self.tokentypes, self._values)
+		for (i, (type_id, start, length)) in enumerate(zip(self.type_ids, self.starts, self.lengths)):
+			if values is not None and i in values:
+				yield (tokentypes[type_id], values[i])
+			else:
+				yield (tokentypes[type_id], text[start:start + length])
+
+	def __eq__(self, other):
+		"""Compare to another TokenArray or a list of (tokentype, value) pairs."""
+		if not isinstance(other, (TokenArray, list, tuple)):
+			return NotImplemented
+		if len(self) != len(other):
+			return False
+		if isinstance(other, TokenArray) and self.tokentypes == other.tokentypes \
+			and self.type_ids == other.type_ids and self.lengths == other.lengths \
+			and self.starts == other.starts and self.text == other.text and self._values == other._values:
+			return True
+		return all(token == other_token for (token, other_token) in zip(self, other))
+
+	__hash__ = None
+
+	def __repr__(self):
+		return '<TokenArray of {} tokens>'.format(len(self))
+
+	def __reduce__(self):
+		# Unpickled token types would not be the singletons of pygments.token, hence pickle their names
+		return (_restore, (
+			self.text, [str(tokentype) for tokentype in self.tokentypes],
+			self.type_ids, self.starts, self.lengths, self._values
+		))
+
+def _restore(text, tokentype_names, type_ids, starts, lengths, values):
+	return TokenArray(text, [string_to_tokentype(name) for name in tokentype_names], type_ids, starts, lengths, values)
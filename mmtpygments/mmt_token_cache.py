@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+	On-disk Token Cache for MMT Lexers
+	==================================
+
+	Content-addressed cache of token streams keyed on the input and a fingerprint
+	of the lexer's rules, see the `cachedir` option of MMTLexer.
+
+	:author: ComFreek <comfreek@outlook.com>
+	:copyright: Copyright 2020 ComFreek
+	:license: ISC, see LICENSE for details.
+"""
+
+from array import array
+import hashlib
+from itertools import accumulate
+import json
+import os
+import sys
+import tempfile
+import zlib
+
+import pygments
+from pygments.token import _TokenType, string_to_tokentype
+
+from .mmt_token_array import TokenArray
+
+__all__ = ['TokenCache', 'lexer_fingerprint', 'encode_tokens', 'decode_tokens']
+
+# Increase upon any change of the on-disk format or the key derivation
+CACHE_FORMAT_VERSION = 1
+
+CACHE_FILE_SUFFIX = '.tokens'
+_MAGIC = b'MMTTOKENS'
+
+# Lexer options affecting how get_tokens preprocesses its input
+_PREPROCESSING_OPTIONS = ('stripnl', 'stripall', 'ensurenl', 'tabsize', 'encoding')
+
+_fingerprints = {}
+
+def lexer_fingerprint(lexer_class):
+	"""Return a hex digest identifying the token table (and thus the behavior) of a RegexLexer class.
+
+	It covers every rule's regex, token types and state transition, the regex flags,
+	the lexer class itself and the Pygments version (whose RegexLexer drives the rules).
+	"""
+	if lexer_class in _fingerprints:
+		return _fingerprints[lexer_class]
+
+	def describe_action(action):
+		if action is None or type(action) is _TokenType:
+			return str(action)
+		group_token_types = getattr(action, 'group_token_types', None)
+		if group_token_types is not None:
+			return [describe_action(token_type) for token_type in group_token_types]
+		# Other callbacks by name, their str() contains memory addresses varying between processes
+		return '{}.{}'.format(
+			getattr(action, '__module__', None), getattr(action, '__qualname__', type(action).__qualname__)
+		)
+
+	description = {
+		'format': CACHE_FORMAT_VERSION,
+		'pygments': pygments.__version__,
+		'lexer': lexer_class.__module__ + '.' + lexer_class.__qualname__,
+		'flags': lexer_class.flags,
+		'tokens': {
+			state: [
+				[rule[0], describe_action(rule[1])] + [repr(new_state) for new_state in rule[2:]]
+				for rule in rules
+			]
+			for (state, rules) in lexer_class.tokens.items()
+		}
+	}
+
+	fingerprint = hashlib.sha256(json.dumps(description, sort_keys = True).encode('utf-8')).hexdigest()
+	_fingerprints[lexer_class] = fingerprint
+	return fingerprint
+
+def encode_tokens(tokens):
+	"""Serialize (tokentype, value) pairs into compact, compressed bytes."""
+	tokentype_ids = {}
+	ids = array('I')
+	lengths = array('I')
+	values = []
+
+	for (tokentype, value) in tokens:
+		ids.append(tokentype_ids.setdefault(tokentype, len(tokentype_ids)))
+		lengths.append(len(value))
+		values.append(value)
+
+	header = json.dumps({
+		'types': [str(tokentype) for tokentype in tokentype_ids],
+		'count': len(ids),
+		'itemsize': ids.itemsize,
+		'byteorder': sys.byteorder
+	}).encode('utf-8')
+
+	return _MAGIC + zlib.compress(
+		len(header).to_bytes(4, 'little') + header + ids.tobytes() + lengths.tobytes()
+		+ ''.join(values).encode('utf-8', 'surrogatepass')
+	)
+
+def decode_tokens(data):
+	"""Deserialize bytes produced by encode_tokens into a TokenArray of (tokentype, value) pairs.
+
+	Raises ValueError on data not produced by encode_tokens on a compatible machine.
+	"""
+	if not data.startswith(_MAGIC):
+		raise ValueError('Not a serialized token stream')
+	try:
+		data = zlib.decompress(data[len(_MAGIC):])
+	except zlib.error as error:
+		raise ValueError('Corrupt serialized token stream') from error
+
+	header_length = int.from_bytes(data[:4], 'little')
+	header = json.loads(data[4:4 + header_length].decode('utf-8'))
+
+	ids = array('I')
+	lengths = array('I')
+	if header['itemsize'] != ids.itemsize or header['byteorder'] != sys.byteorder:
+		raise ValueError('Serialized token stream stems from an incompatible machine')
+
+	offset = 4 + header_length
+	array_size = header['count'] * ids.itemsize
+	ids.frombytes(data[offset:offset + array_size])
+	lengths.frombytes(data[offset + array_size:offset + 2 * array_size])
+	text = data[offset + 2 * array_size:].decode('utf-8', 'surrogatepass')
+
+	tokentypes = [string_to_tokentype(name) for name in header['types']]
+	starts = array('I', accumulate([0] + list(lengths[:-1]))) if lengths else array('I')
+	return TokenArray(text, tokentypes, ids, starts, lengths)
+
+class TokenCache:
+	"""
+	Size-bounded on-disk cache of token streams
+
+	Every token stream is stored in its own file named after the cache key in the
+	cache directory. Files are written atomically (temporary file + rename), hence
+	several processes may share one cache directory. When the directory grows beyond
+	max_size bytes, the least recently used entries (by modification time, which is
+	refreshed on every hit) are evicted.
+
+	The directory is only scanned upon the first store and whenever the entries stored
+	since then make it exceed max_size, entries stored by other processes meanwhile are
+	only noticed then.
+	"""
+
+	def __init__(self, directory, max_size = 100 * 1024 * 1024):
+		self.directory = directory
+		self.max_size = max_size
+		# Size of the directory as of the last scan plus the entries stored since, None before the first scan
+		self._size = None
+		os.makedirs(directory, exist_ok = True)
+
+	def key(self, lexer, text):
+		"""Return the cache key for lexing text (str or bytes) with lexer."""
+		digest = hashlib.sha256()
+		digest.update(lexer_fingerprint(type(lexer)).encode('ascii'))
+		digest.update(repr([getattr(lexer, option, None) for option in _PREPROCESSING_OPTIONS]).encode('utf-8'))
+		digest.update(b'\0str\0' if isinstance(text, str) else b'\0bytes\0')
+		digest.update(text.encode('utf-8', 'surrogatepass') if isinstance(text, str) else text)
+		return digest.hexdigest()
+
+	def _path(self, key):
+		return os.path.join(self.directory, key + CACHE_FILE_SUFFIX)
+
+	def load(self, key):
+		"""Return the cached tokens for key or None on a cache miss."""
+		path = self._path(key)
+		try:
+			with open(path, 'rb') as cache_file:
+				tokens = decode_tokens(cache_file.read())
+			os.utime(path)
+			return tokens
+		except (OSError, ValueError):
+			# Missing, concurrently evicted or unreadable entries are simply misses
+			return None
+
+	def store(self, key, tokens):
+		"""Store tokens under key and evict old entries if the cache grew too large."""
+		data = encode_tokens(tokens)
+		try:
+			(handle, temp_path) = tempfile.mkstemp(dir = self.directory, suffix = '.tmp')
+		except OSError:
+			return
+		try:
+			with os.fdopen(handle, 'wb') as temp_file:
+				temp_file.write(data)
+			os.replace(temp_path, self._path(key))
+		except BaseException as error:
+			try:
+				os.remove(temp_path)
+			except OSError:
+				pass
+			if isinstance(error, OSError):
+				# e.g. a full disk, the tokens are simply not cached
+				return
+			raise
+
+		if self._size is not None:
+			self._size += len(data)
+		if self._size is None or self._size > self.max_size:
+			self.evict()
+
+	def evict(self):
+		"""Delete least recently used entries until the cache fits into max_size again."""
+		entries = []
+		total_size = 0
+		with os.scandir(self.directory) as directory_entries:
+			for entry in directory_entries:
+				if entry.name.endswith(CACHE_FILE_SUFFIX):
+					try:
+						stat = entry.stat()
+					except OSError:
+						continue
+					entries.append((stat.st_mtime, stat.st_size, entry.path))
+					total_size += stat.st_size
+
+		self._size = total_size
+		if total_size <= self.max_size:
+			return
+
+		# Evict a bit more than necessary to not scan the directory again on every store
+		target_size = self.max_size * 0.9
+		for (_, size, path) in sorted(entries):
+			if total_size <= target_size:
+				break
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+			total_size -= size
+		self._size = total_size
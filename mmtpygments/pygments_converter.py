@@ -10,9 +10,20 @@
 
 from pygments.lexer import RegexLexer
 
+try:
+	from .pygments_regex_analyzer import analyze_lexer, check_risk
+except ImportError: # e.g. when running mmt_lexer.py as a script
+	from pygments_regex_analyzer import analyze_lexer, check_risk
+
 class PygmentsConverter:
-	def __init__(self):
-		pass
+	def __init__(self, max_regex_risk = 'medium'):
+		"""
+		Args:
+			max_regex_risk: The highest risk of the lexer's regexes (see pygments_regex_analyzer.py)
+			                that is still exported, transform raises a RegexRiskError otherwise.
+		"""
+		self.max_regex_risk = max_regex_risk
+		self.regex_findings = []
 	
 	PYGMENTS_START_STATE_NAME = 'root'
 	target_start_state_name = 'root'
@@ -67,6 +78,11 @@ class PygmentsConverter:
 		pass
 
 	def transform(self, regex_lexer):
+		# The regexes are copied verbatim to engines we do not control (e.g. on GitLab servers
+		# and in browsers), refuse to export those prone to catastrophic backtracking
+		self.regex_findings = analyze_lexer(regex_lexer)
+		check_risk(self.regex_findings, self.max_regex_risk)
+
 		target = ""
 		
 		target += self.transform_lexer_header(regex_lexer)
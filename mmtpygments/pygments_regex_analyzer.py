@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+"""
+	Static Backtracking Analysis of Pygments Regex Lexers
+	=====================================================
+
+	Parses every regex of a Pygments RegexLexer and flags constructs whose matching
+	time can explode on unlucky input and rules that do not advance the input. The
+	converters (see pygments_converter.py) run it before copying the regexes verbatim
+	into regex engines running on servers and in browsers (Rouge, CodeMirror).
+
+	Findings by risk:
+
+	  - high:   nested unbounded quantifiers whose iterations can split the same text
+	            in several ways, e.g. `(\\d+[Td]*)*`, unbounded quantifiers over alternatives
+	            starting alike, e.g. `(a|aa)+` or `(a|ab)*` (exponential backtracking), and
+	            rules that can match the empty string without changing the state
+	            (the lexer loops forever)
+	  - medium: unbounded quantifiers (greedy or lazy) following each other over
+	            overlapping characters, e.g. `\\s*.*?` or `.*?❙.*?❚`, such that a failing
+	            match tries all ways of splitting the text between them (polynomial)
+	  - low:    rules that can match the empty string and only change the state, e.g.
+	            `(?=[❘❙❚])` with '#pop' (fine as long as such rules never form a cycle)
+
+	Sets of characters are compared on a representative alphabet: Latin-1, all characters
+	occurring in the analyzed regexes (and their neighbors) and samples of other scripts.
+
+	:author: ComFreek <comfreek@outlook.com>
+	:copyright: Copyright 2020 ComFreek
+	:license: ISC, see LICENSE for details.
+"""
+
+from collections import namedtuple
+
+from pygments.lexer import default, include, inherit
+
+try:
+	from re import _compiler as sre_compile, _parser as sre_parse # Python 3.11+
+except ImportError:
+	import sre_compile, sre_parse
+
+__all__ = ['RISK_LEVELS', 'Finding', 'RegexRiskError', 'analyze_regex', 'analyze_lexer', 'format_report', 'check_risk']
+
+RISK_LEVELS = ('none', 'low', 'medium', 'high')
+
+# A problem found in a rule
+#
+#  - state, index: the rule's state and its position therein
+#  - regex:        the rule's regex
+#  - risk:         one of RISK_LEVELS except 'none'
+#  - kind:         'nested-quantifier', 'overlapping-alternatives', 'overlapping-quantifiers', 'empty-match',
+#                  'zero-width-transition' or 'unparsable'
+#  - message:      a human-readable explanation
+Finding = namedtuple('Finding', ['state', 'index', 'regex', 'risk', 'kind', 'message'])
+
+class RegexRiskError(Exception):
+	"""The rules of a lexer exceed the acceptable risk, the message is the report of the offending findings."""
+
+_SINGLE_CHAR_OPS = (sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.IN, sre_parse.ANY)
+_ASSERT_OPS = (sre_parse.ASSERT, sre_parse.ASSERT_NOT)
+_BACKTRACKING_REPEAT_OPS = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT)
+_NON_BACKTRACKING_OPS = tuple(
+	getattr(sre_parse, name) for name in ('POSSESSIVE_REPEAT', 'ATOMIC_GROUP') if hasattr(sre_parse, name)
+)
+
+# Characters of other scripts and categories (spaces, digits, letters) beyond Latin-1
+_SAMPLE_CHARACTERS = '  　٣०ΑαЖжℕ⟶中\U0001d400\U0001f600'
+
+def _children(op, av):
+	"""Return the item lists nested in an item."""
+	if op is sre_parse.SUBPATTERN:
+		return [av[-1].data]
+	elif op in _ASSERT_OPS:
+		return [av[1].data]
+	elif op is sre_parse.BRANCH:
+		return [alternative.data for alternative in av[1]]
+	elif op is getattr(sre_parse, 'ATOMIC_GROUP', None):
+		return [av.data]
+	elif op in _BACKTRACKING_REPEAT_OPS or op in _NON_BACKTRACKING_OPS:
+		return [av[2].data]
+	elif op is sre_parse.GROUPREF_EXISTS:
+		return [branch.data for branch in av[1:] if branch is not None]
+	return []
+
+def _is_unbounded(op, av):
+	return op in _BACKTRACKING_REPEAT_OPS and av[1] == sre_parse.MAXREPEAT
+
+class _Context:
+	"""Character sets of the items of the regexes of one lexer."""
+
+	def __init__(self, alphabet):
+		self.alphabet = alphabet
+		self._cache = {}
+
+	def item_chars(self, op, av, state, flags):
+		key = (op, repr(av), flags)
+		chars = self._cache.get(key)
+		if chars is None:
+			match = sre_compile.compile(sre_parse.SubPattern(state, [(op, av)]), flags).match
+			chars = frozenset(c for c in self.alphabet if match(c))
+			self._cache[key] = chars
+		return chars
+
+	def chars(self, items, state, flags):
+		"""Return the characters (of the alphabet) a match of items can consume."""
+		chars = set()
+		for (op, av) in items:
+			if op in _SINGLE_CHAR_OPS:
+				chars |= self.item_chars(op, av, state, flags)
+			elif op not in _ASSERT_OPS:
+				for child in _children(op, av):
+					chars |= self.chars(child, state, flags)
+		return chars
+
+	def first_chars(self, items, state, flags):
+		"""Return the characters (of the alphabet) a match of items can start with."""
+		chars = set()
+		for (op, av) in items:
+			if op in _SINGLE_CHAR_OPS:
+				return chars | self.item_chars(op, av, state, flags)
+			elif op not in _ASSERT_OPS:
+				for child in _children(op, av):
+					chars |= self.first_chars(child, state, flags)
+				if not _nullable([(op, av)]):
+					return chars
+		return chars
+
+def _nullable(items):
+	"""Return whether items can match the empty string."""
+	for (op, av) in items:
+		if op in _SINGLE_CHAR_OPS:
+			return False
+		elif op is sre_parse.SUBPATTERN:
+			if not _nullable(av[-1].data):
+				return False
+		elif op is getattr(sre_parse, 'ATOMIC_GROUP', None):
+			if not _nullable(av.data):
+				return False
+		elif op is sre_parse.BRANCH:
+			if not any(_nullable(alternative.data) for alternative in av[1]):
+				return False
+		elif op in _BACKTRACKING_REPEAT_OPS or op is getattr(sre_parse, 'POSSESSIVE_REPEAT', None):
+			if av[0] > 0 and not _nullable(av[2].data):
+				return False
+		# zero-width assertions, backreferences (possibly empty), conditionals
+	return True
+
+def _collect_characters(items, characters):
+	"""Add the characters literally occurring in items and their neighbors to characters."""
+	for (op, av) in items:
+		if op in (sre_parse.LITERAL, sre_parse.NOT_LITERAL):
+			characters.update((av - 1, av, av + 1))
+		elif op is sre_parse.IN:
+			for (member_op, member_av) in av:
+				if member_op is sre_parse.LITERAL:
+					characters.update((member_av - 1, member_av, member_av + 1))
+				elif member_op is sre_parse.RANGE:
+					characters.update((member_av[0] - 1, member_av[0], member_av[1], member_av[1] + 1))
+		for child in _children(op, av):
+			_collect_characters(child, characters)
+
+def _inner_unbounded_repeats(items):
+	"""Yield the bodies of all unbounded backtracking repeats in items."""
+	for (op, av) in items:
+		if _is_unbounded(op, av):
+			yield av[2].data
+		if op not in _NON_BACKTRACKING_OPS:
+			for child in _children(op, av):
+				yield from _inner_unbounded_repeats(child)
+
+def _flatten(items):
+	"""Return the sequence of items with all groups (without scoped flags) inlined."""
+	sequence = []
+	for (op, av) in items:
+		if op is sre_parse.SUBPATTERN and not av[1] and not av[2]:
+			sequence.extend(_flatten(av[-1].data))
+		else:
+			sequence.append((op, av))
+	return sequence
+
+def _contains(items, target):
+	return any(
+		child is target or _contains(child, target)
+		for (op, av) in items for child in _children(op, av)
+	)
+
+def _overlapping_alternatives(alternatives, context, state, flags):
+	"""Return whether some alternatives can start with the same character.
+
+	sre_parse factors out prefixes shared by all alternatives, e.g. `a|ab` is parsed as `a(?:|b)`,
+	hence an alternative matching the empty string also stands for alternatives sharing a prefix.
+	"""
+	first_chars = []
+	for alternative in alternatives:
+		if _nullable(alternative):
+			return True
+		chars = context.first_chars(alternative, state, flags)
+		if any(chars & other_chars for other_chars in first_chars):
+			return True
+		first_chars.append(chars)
+	return False
+
+def _find_problems(items, context, state, flags, problems):
+	"""Append (risk, kind, message) triples for the backtracking problems in items to problems."""
+	# Unbounded quantifiers following each other
+	previous = None
+	separated = False
+	for (op, av) in _flatten(items):
+		if _is_unbounded(op, av):
+			# ambiguous if this quantifier can start with a character the previous one can consume
+			if previous is not None and not separated and previous & context.first_chars(av[2].data, state, flags):
+				problems.append(('medium', 'overlapping-quantifiers',
+					'unbounded quantifiers over overlapping characters follow each other'))
+			(previous, separated) = (context.chars(av[2].data, state, flags), False)
+		elif previous is not None and not _nullable([(op, av)]):
+			# a mandatory item the previous quantifier cannot consume ends its scan
+			separated = separated or not (context.chars([(op, av)], state, flags) & previous)
+
+	for (op, av) in items:
+		if op in _NON_BACKTRACKING_OPS:
+			continue
+		if _is_unbounded(op, av):
+			body = _flatten(av[2].data)
+			if any(
+				body_op is sre_parse.BRANCH and _overlapping_alternatives(
+					[alternative.data for alternative in body_av[1]], context, state, flags
+				)
+				for (body_op, body_av) in body
+			):
+				problems.append(('high', 'overlapping-alternatives',
+					'an unbounded quantifier over alternatives starting alike can split the same text in exponentially many ways'))
+			for inner in _inner_unbounded_repeats(body):
+				inner_chars = context.chars(inner, state, flags)
+				# the iterations are separated if the body always consumes some character the inner quantifier cannot
+				separated = any(
+					not _nullable([(body_op, body_av)]) and not _contains([(body_op, body_av)], inner)
+					and not (context.chars([(body_op, body_av)], state, flags) & inner_chars)
+					for (body_op, body_av) in body
+				)
+				if inner_chars and not separated:
+					problems.append(('high', 'nested-quantifier',
+						'nested unbounded quantifiers can split the same text in exponentially many ways'))
+					break
+		for child in _children(op, av):
+			_find_problems(child, context, state, flags, problems)
+
+def _parse(regex, flags):
+	parsed = sre_parse.parse(regex, flags)
+	return (parsed, getattr(parsed, 'state', None) or parsed.pattern) # Python 3.6, 3.7: pattern
+
+def _rules(regex_lexer):
+	"""Yield (state, index, regex, new state) of the rules of a RegexLexer class."""
+	for (state, rules) in regex_lexer.tokens.items():
+		for (index, rule) in enumerate(rules):
+			if isinstance(rule, include) or rule is inherit:
+				continue
+			elif isinstance(rule, default):
+				yield (state, index, '', rule.state)
+			else:
+				yield (state, index, rule[0], rule[2] if len(rule) == 3 else None)
+
+def analyze_regex(regex, flags = 0, new_state = None, alphabet = None):
+	"""Return the findings for a single rule as (risk, kind, message) triples.
+
+	Args:
+		new_state: The rule's state transition as in RegexLexer.tokens.
+		alphabet:  The characters to compare character sets on, by default those of
+		           this regex and the samples.
+	"""
+	try:
+		(parsed, state) = _parse(regex, flags)
+	except Exception as error:
+		return [('high', 'unparsable', 'cannot be parsed: {}'.format(error))]
+
+	if alphabet is None:
+		characters = set(range(256))
+		_collect_characters(parsed.data, characters)
+		alphabet = ''.join(chr(c) for c in sorted(characters) if 0 <= c <= 0x10ffff) + _SAMPLE_CHARACTERS
+
+	problems = []
+	_find_problems(parsed.data, _Context(alphabet), state, flags, problems)
+	if _nullable(parsed.data):
+		if new_state is None or new_state == '#push':
+			problems.append(('high', 'empty-match',
+				'can match the empty string without changing the state, the lexer would loop forever'))
+		else:
+			problems.append(('low', 'zero-width-transition',
+				'can match the empty string, only the state transition makes progress'))
+
+	# One finding per kind of problem
+	unique_problems = []
+	for problem in problems:
+		if problem not in unique_problems:
+			unique_problems.append(problem)
+	return [
+		(risk, kind, message if problems.count((risk, kind, message)) == 1
+			else '{} ({} times)'.format(message, problems.count((risk, kind, message))))
+		for (risk, kind, message) in unique_problems
+	]
+
+def analyze_lexer(regex_lexer):
+	"""Analyze all rules of a RegexLexer class and return the list of Finding objects."""
+	flags = regex_lexer.flags
+	rules = list(_rules(regex_lexer))
+
+	# One alphabet for all rules, such that all sets are comparable and cached once
+	characters = set(range(256))
+	for (_, _, regex, _) in rules:
+		try:
+			_collect_characters(_parse(regex, flags)[0].data, characters)
+		except Exception:
+			pass
+	alphabet = ''.join(chr(c) for c in sorted(characters) if 0 <= c <= 0x10ffff) + _SAMPLE_CHARACTERS
+
+	findings = []
+	for (state, index, regex, new_state) in rules:
+		for (risk, kind, message) in analyze_regex(regex, flags, new_state, alphabet):
+			findings.append(Finding(state, index, regex, risk, kind, message))
+	findings.sort(key = lambda finding: -RISK_LEVELS.index(finding.risk))
+	return findings
+
+def format_report(findings):
+	"""Return a human-readable report of findings, most risky first."""
+	lines = []
+	for finding in findings:
+		lines.append('{:<6}  {}[{}]  {}: {}'.format(finding.risk, finding.state, finding.index, finding.kind, finding.message))
+		lines.append('        {}'.format(finding.regex))
+	counts = ', '.join(
+		'{} {}'.format(sum(1 for finding in findings if finding.risk == risk), risk)
+		for risk in reversed(RISK_LEVELS[1:])
+	)
+	lines.append('{} findings: {}'.format(len(findings), counts))
+	return '\n'.join(lines)
+
+def check_risk(findings, max_risk = 'medium'):
+	"""Raise a RegexRiskError if some finding exceeds max_risk, one of RISK_LEVELS."""
+	if max_risk not in RISK_LEVELS:
+		raise ValueError('unknown risk level {!r}, expected one of {}'.format(max_risk, ', '.join(RISK_LEVELS)))
+	exceeding = [
+		finding for finding in findings
+		if RISK_LEVELS.index(finding.risk) > RISK_LEVELS.index(max_risk)
+	]
+	if exceeding:
+		raise RegexRiskError('rules exceed the acceptable risk {!r}:\n{}'.format(max_risk, format_report(exceeding)))
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+	Pygments to Standalone Python Lexer Converter
+	=============================================
+
+	Generates a self-contained Python module implementing the state machine of a
+	Pygments RegexLexer: integer token type ids, the rules of every state merged into
+	master regexes (like the lexer option `combined`, see mmt_combined.py) and a flat
+	matching loop with the token emission and state transitions inlined, but neither
+	Pygments nor this package need to be installed (nor imported) to use it. Meant for
+	services that only need token spans, e.g. search indexing or semantic tokens of
+	language servers.
+
+	The generated module provides:
+
+	  - TOKEN_TYPES: the names of the token types (e.g. 'Token.Keyword') by id
+	  - get_spans(text, stack = ('root',)): (start, end, token type id) triples
+	  - get_tokens_unprocessed(text, stack = ('root',)): (position, token type id, value)
+	    triples like RegexLexer.get_tokens_unprocessed
+	  - get_tokens(text): (token type id, value) pairs like RegexLexer.get_tokens with
+	    the default options (newline normalization, stripnl, ensurenl)
+
+	:author: ComFreek <comfreek@outlook.com>
+	:copyright: Copyright 2020 ComFreek
+	:license: ISC, see LICENSE for details.
+"""
+
+import inspect
+import re
+
+from pygments.token import _TokenType
+
+try:
+	from .mmt_combined import _UNCOMBINABLE
+	from .mmt_engine import ERROR_TOKEN, NEWLINE_TOKEN
+	from .pygments_converter import PygmentsConverter
+except ImportError: # e.g. when running mmt_lexer.py as a script
+	from mmt_combined import _UNCOMBINABLE
+	from mmt_engine import ERROR_TOKEN, NEWLINE_TOKEN
+	from pygments_converter import PygmentsConverter
+
+__all__ = ['PygmentsToPythonConverter']
+
+_FLAG_NAMES = ('ASCII', 'IGNORECASE', 'LOCALE', 'MULTILINE', 'DOTALL', 'UNICODE', 'VERBOSE')
+
+# The matching loop of the generated module, mirroring RegexLexer.get_tokens_unprocessed on
+# the segments of every state (see mmt_combined.get_tokens_combined). It is generated twice,
+# for spans and for tokens, with the placeholders in capitals replaced.
+LOOP = '''
+def FUNCTION(text, stack = ('root',)):
+	"""DOCSTRING"""
+	pos = 0
+	statestack = list(stack)
+	segments = SEGMENTS[statestack[-1]]
+	while 1:
+		for (match, rules) in segments:
+			m = match(text, pos)
+			if m:
+				(token, groups, new_state) = rules[m.lastindex]
+				if groups is None:
+					if token is not None:
+						yield YIELD_TOKEN
+				else:
+					# like bygroups, empty and unmatched groups are skipped
+					for (group, group_token) in groups:
+						(start, end) = m.span(group)
+						if start < end:
+							yield YIELD_GROUP
+				pos = m.end()
+				if new_state is not None:
+					if type(new_state) is int:
+						# pop, but keep at least one state on the stack
+						if -new_state >= len(statestack):
+							del statestack[1:]
+						else:
+							del statestack[new_state:]
+					else:
+						for state in new_state:
+							if state == '#pop':
+								if len(statestack) > 1:
+									statestack.pop()
+							elif state == '#push':
+								statestack.append(statestack[-1])
+							else:
+								statestack.append(state)
+					segments = SEGMENTS[statestack[-1]]
+				break
+		else:
+			# No rule matched: at the end of a line, reset the state, otherwise emit an error token
+			if pos >= len(text):
+				break
+			if text[pos] == '\\n':
+				statestack = ['root']
+				segments = SEGMENTS['root']
+				yield YIELD_NEWLINE
+			else:
+				yield YIELD_ERROR
+			pos += 1
+'''
+
+RUNTIME = LOOP.replace(
+	'FUNCTION', 'get_spans'
+).replace(
+	'DOCSTRING', 'Yield (start, end, token type id) of the tokens of text, starting in the states of stack.'
+).replace(
+	'YIELD_GROUP', '(start, end, group_token)'
+).replace(
+	'YIELD_NEWLINE', '(pos, pos + 1, NEWLINE_TOKEN)'
+).replace(
+	'YIELD_ERROR', '(pos, pos + 1, ERROR_TOKEN)'
+).replace(
+	'YIELD_TOKEN', '(pos, m.end(), token)'
+) + LOOP.replace(
+	'FUNCTION', 'get_tokens_unprocessed'
+).replace(
+	'DOCSTRING', 'Yield (position, token type id, value) of the tokens of text, starting in the states of stack.'
+).replace(
+	'YIELD_GROUP', '(start, group_token, text[start:end])'
+).replace(
+	'YIELD_NEWLINE', "(pos, NEWLINE_TOKEN, '\\n')"
+).replace(
+	'YIELD_ERROR', '(pos, ERROR_TOKEN, text[pos])'
+).replace(
+	'YIELD_TOKEN', '(pos, token, m.group())'
+) + '''
+def get_tokens(text):
+	"""Yield (token type id, value) of the tokens of text, preprocessed like Pygments does by default."""
+	if text.startswith('\\ufeff'):
+		text = text[len('\\ufeff'):]
+	text = text.replace('\\r\\n', '\\n').replace('\\r', '\\n').strip('\\n')
+	if not text.endswith('\\n'):
+		text += '\\n'
+	for (_, token, value) in get_tokens_unprocessed(text):
+		yield (token, value)
+'''
+
+def _string_literal(regex):
+	"""Return a Python literal of regex, a raw string like in the lexer's source if possible."""
+	if regex.isprintable() and "'" not in regex and not regex.endswith('\\'):
+		return "r'" + regex + "'"
+	return repr(regex)
+
+class PygmentsToPythonConverter(PygmentsConverter):
+	def transform_lexer_header(self, python_lexer_class):
+		# Token type ids in order of their first occurrence, those of the error recovery first
+		self.token_ids = {}
+		self.flags = python_lexer_class.flags
+		self.token_id(NEWLINE_TOKEN)
+		self.token_id(ERROR_TOKEN)
+
+		flags = ' | '.join(
+			're.' + name for name in _FLAG_NAMES
+			if getattr(re, name, 0) and python_lexer_class.flags & getattr(re, name)
+		) or '0'
+
+		return '''# -*- coding: utf-8 -*-
+"""
+	Standalone {name} Lexer
+
+	DO NOT EDIT - AUTOGENERATED
+
+	This module has been autogenerated from the Pygments lexer {class_name} [1] by the script [2].
+	It does not depend on Pygments, see [2] for its interface.
+
+	[1]: {python_lexer_source}
+	[2]: https://github.com/ComFreek/mmtpygments/blob/master/mmtpygments/pygments_to_python.py
+"""
+
+import re
+
+__all__ = ['TOKEN_TYPES', 'get_spans', 'get_tokens_unprocessed', 'get_tokens']
+
+FLAGS = {flags}
+
+def _match(regex):
+	return re.compile(regex, FLAGS).match
+
+# state -> segments (match, rules), where match is the master regex of a run of rules whose
+# alternative `(...)` is given by m.lastindex, and rules[m.lastindex] is the rule of that
+# alternative: (token type id, ((group, group token type id), ...) or None, new state)
+SEGMENTS = {{
+'''.format(
+			name = python_lexer_class.name,
+			class_name = python_lexer_class.__name__,
+			python_lexer_source = getattr(python_lexer_class, 'rouge_original_source', python_lexer_class.__module__),
+			flags = flags
+		)
+
+	def transform_lexer_footer(self, regex_lexer):
+		token_types = sorted(self.token_ids, key = self.token_ids.get)
+		return '}}\n\nTOKEN_TYPES = (\n{}\n)\n\nNEWLINE_TOKEN = {}\nERROR_TOKEN = {}\n{}'.format(
+			''.join('\t{!r},\n'.format(str(token_type)) for token_type in token_types).rstrip('\n'),
+			self.token_ids[NEWLINE_TOKEN],
+			self.token_ids[ERROR_TOKEN],
+			RUNTIME
+		)
+
+	def transform_state_header(self, state):
+		self.rules = []
+		return '\t{!r}: [\n'.format(state)
+
+	def transform_state_footer(self, state):
+		return ''.join(map(self.transform_segment, self.segments(self.rules))) + '\t],\n'
+
+	def segments(self, rules):
+		"""Split rules into runs that can be merged into one master regex, see mmt_combined.combine_rules."""
+		run = []
+		for rule in rules:
+			if _UNCOMBINABLE.search(rule[0]):
+				if run:
+					yield run
+					run = []
+				yield rule
+			else:
+				run.append(rule)
+		if run:
+			yield run
+
+	def transform_segment(self, segment):
+		if isinstance(segment, tuple):
+			# an uncombinable rule as its own regex, with its rule for every possible m.lastindex
+			(regex, token, groups, new_state) = segment
+			rule = (token, groups and tuple((index + 1, group) for (index, group) in enumerate(groups) if group is not None), new_state)
+			return '\t\t(_match({}), {{{}}}),\n'.format(
+				_string_literal(regex),
+				', '.join('{!r}: {!r}'.format(index, rule) for index in [None] + list(range(1, re.compile(regex, self.flags).groups + 1)))
+			)
+
+		alternatives = []
+		rules = ['None']
+		for (regex, token, groups, new_state) in segment:
+			index = len(rules)
+			alternatives.append('(' + regex + ')')
+			rules.append(repr((token, groups and tuple((index + 1 + offset, group) for (offset, group) in enumerate(groups) if group is not None), new_state)))
+			rules.extend(['None'] * re.compile(regex, self.flags).groups)
+		return '\t\t(_match({}), (\n\t\t\t{}\n\t\t)),\n'.format(
+			_string_literal('|'.join(alternatives)),
+			',\n\t\t\t'.join(rules)
+		)
+
+	def token_id(self, token_type):
+		"""Return the integer id of a Pygments token type."""
+		return self.token_ids.setdefault(token_type, len(self.token_ids))
+
+	def transform_single_token_type(self, token_type):
+		if token_type is None:
+			return None
+		if type(token_type) is not _TokenType:
+			raise NotImplementedError('cannot convert callback {!r}'.format(token_type))
+		return self.token_id(token_type)
+
+	def transform_token_types(self, token_types):
+		"""Return (token type id, group token type ids), exactly one of which is None."""
+		if isinstance(token_types, list):
+			# a single token type, or a bygroups callback outside of conversion mode (see mmt_lexer.py)
+			groups = getattr(token_types[0], 'group_token_types', None)
+			if groups is None:
+				return (self.transform_single_token_type(token_types[0]), None)
+			token_types = groups
+		return (None, tuple(map(self.transform_single_token_type, token_types)))
+
+	def transform_transition(self, next_state_type, next_state_info, indentation):
+		if next_state_type == 'push':
+			return tuple(next_state_info)
+		elif next_state_type == 'pop':
+			# next_state_info is number of states to be popped
+			return -next_state_info
+		else:
+			return None
+
+	def transform_rule(self, regex, token_types, next_state_type, next_state_info, indentation = "", regex_python_flags = []):
+		(token, groups) = self.transform_token_types(token_types)
+		self.rules.append((regex, token, groups, self.transform_transition(next_state_type, next_state_info, indentation)))
+		return ''
@@ -0,0 +1,520 @@
+# -*- coding: utf-8 -*-
+"""
+	Benchmark Suite for the MMT Pygments lexers
+	~~~~~~~~~~~~~~~~~~~~
+
+	Measures throughput, per-file latency and peak memory of the lexers and the HTML
+	formatting on the test corpus and on synthetic inputs, and compares the results
+	against a stored baseline. With --adversarial, measures how lexing time grows on
+	malformed inputs instead, with --cold-start the time to the first token in fresh
+	processes, and with --per-state the rule dispatch time per lexer state with and
+	without combined master regexes and first-character dispatch.
+
+	:author: ComFreek <comfreek@outlook.com>
+	:copyright: Copyright 2020 ComFreek
+	:license: ISC, see LICENSE for details.
+"""
+
+import argparse
+import glob
+import io
+import json
+import math
+import multiprocessing
+import os
+from os import path
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+import pygments
+from pygments.formatters.html import HtmlFormatter
+from pygments.lexers.python import PythonLexer
+
+# Add the repository root such that we can import from the mmtpygments package
+sys.path.append(path.dirname(path.dirname(path.dirname(path.abspath(__file__)))))
+from mmtpygments.mmt_combined import match_segments
+from mmtpygments.mmt_engine import lex_states, match_rules
+from mmtpygments.mmt_fast_lexer import MMTFastLexer
+from mmtpygments.mmt_html_formatter import MMTHtmlFormatter
+from mmtpygments.mmt_lexer import MMTLexer
+from mmtpygments.mmt_relational_lexer import MMTRelationalLexer
+from mmtpygments.mmt_style import MMTDefaultStyle
+from mmtpygments.pygments_to_python import PygmentsToPythonConverter
+
+try:
+	import resource
+except ImportError: # e.g. on Windows
+	resource = None
+
+TEST_FILES_DIR = path.join(path.dirname(path.abspath(__file__)), 'data')
+
+# Results of a reference run, compared against by default
+DEFAULT_BASELINE = path.join(path.dirname(path.abspath(__file__)), 'benchmark-baseline.json')
+
+# Benchmark of Pygments' own Python lexer on the sources of this package, independent of our code.
+# Throughputs are compared to baselines relative to it, such that they carry over to other machines.
+REFERENCE_BENCHMARK = 'reference-lex'
+
+def synthetic_mmt(num_theories, seed = 0):
+	"""Generate MMT source with num_theories theories exercising most lexer rules."""
+	rng = random.Random(seed)
+	parts = ["namespace http://example.org/synthetic❚\n\nimport ex http://example.org/other❚\n\n"]
+
+	for i in range(num_theories):
+		parts.append("theory T%d : ?LF =\n" % i)
+		parts.append("\t// Some comment on theory T%d ❙\n" % i)
+		parts.append("\tinclude ?T%d ❙\n" % max(i - 1, 0))
+		for j in range(rng.randint(5, 15)):
+			parts.append("\tc%d : %s ⟶ %s ❘ = [x] f x (g x) ❘ # %d %%I1 … prec %d ❘ role Simplify ❙\n" % (
+				j, rng.choice(["type", "ℕ", "bool"]), rng.choice(["type", "ℕ", "bool"]), j, rng.randint(-5, 5)
+			))
+		parts.append("\tstructure s : ?T%d = \n\t\td : type ❙\n\t❚\n" % i)
+		parts.append("❚\n\nview V%d : ?T%d -> ?T%d =\n\tc0 = c0 ❙\n❚\n\n" % (i, i, i))
+
+	return "".join(parts)
+
+def synthetic_rel(num_lines, seed = 0):
+	"""Generate MMT relational data (.rel) with num_lines lines."""
+	rng = random.Random(seed)
+	predicates = ["theory", "include", "declares", "constant", "HasType", "HasMeta", "view"]
+	return "".join(
+		"%s http://example.org/synthetic?T%d?c%d\n" % (rng.choice(predicates), rng.randint(0, 999), i)
+		for i in range(num_lines)
+	)
+
+def synthetic_long_expressions(num_constants, expression_size, seed = 0):
+	"""Generate an MMT theory of num_constants constants with types and definientia of expression_size characters."""
+	rng = random.Random(seed)
+	parts = ["theory LongExpressions : ?LF =\n"]
+	for i in range(num_constants):
+		expression = " ⟶ ".join(
+			"{x%d : %s} (f x%d ≐ g (h x%d))" % (j, rng.choice(["ℕ", "type", "bool"]), j, j)
+			for j in range(expression_size // 30)
+		)
+		parts.append("\tc%d : %s ❘ = [x] %s ❘ # c%d 1 ❙\n" % (i, expression, expression, i))
+	parts.append("❚\n")
+	return "".join(parts)
+
+def get_corpus():
+	"""Return a list of (name, source) pairs of all corpus files and synthetic MMT inputs."""
+	corpus = []
+	for filename in sorted(glob.iglob(path.join(TEST_FILES_DIR, "**", "*.mmt"), recursive = True)):
+		with io.open(filename, mode = "r", encoding = "utf-8") as source_file:
+			corpus.append((path.relpath(filename, TEST_FILES_DIR), source_file.read()))
+
+	for num_theories in (10, 100, 1000):
+		corpus.append(("synthetic-%d.mmt" % num_theories, synthetic_mmt(num_theories, seed = num_theories)))
+
+	return corpus
+
+def get_relational_corpus():
+	"""Return a list of (name, source) pairs of all .rel corpus files and synthetic relational inputs."""
+	corpus = []
+	for filename in sorted(glob.iglob(path.join(TEST_FILES_DIR, "**", "*.rel"), recursive = True)):
+		with io.open(filename, mode = "r", encoding = "utf-8") as source_file:
+			corpus.append((path.relpath(filename, TEST_FILES_DIR), source_file.read()))
+
+	for num_lines in (1000, 100000):
+		corpus.append(("synthetic-%d.rel" % num_lines, synthetic_rel(num_lines, seed = num_lines)))
+
+	return corpus
+
+def get_python_corpus():
+	"""Return a list of (name, source) pairs of the Python modules of the mmtpygments package."""
+	corpus = []
+	for filename in sorted(glob.iglob(path.join(path.dirname(TEST_FILES_DIR), "..", "*.py"))):
+		with io.open(filename, mode = "r", encoding = "utf-8") as source_file:
+			corpus.append((path.basename(filename), source_file.read()))
+	return corpus
+
+def get_long_expression_corpus():
+	"""Return a list of (name, source) pairs of synthetic MMT inputs with long object expressions."""
+	return [
+		("long-expressions-%d.mmt" % expression_size, synthetic_long_expressions(50, expression_size, seed = expression_size))
+		for expression_size in (1000, 10000)
+	]
+
+def lex_benchmark(lexer_class, get_inputs, **lexer_options):
+	lexer = lexer_class(**lexer_options)
+	for (name, source) in get_inputs():
+		yield (name, source, lambda source = source: sum(1 for _ in lexer.get_tokens(source)))
+
+def standalone_benchmark(lexer_class, get_inputs):
+	"""Like lex_benchmark, but with the standalone module generated by pygments_to_python.py from lexer_class."""
+	standalone = types.ModuleType('standalone')
+	exec(compile(PygmentsToPythonConverter().transform(lexer_class), 'standalone', 'exec'), standalone.__dict__)
+	for (name, source) in get_inputs():
+		yield (name, source, lambda source = source: sum(1 for _ in standalone.get_tokens(source)))
+
+def html_benchmark(formatter_class = HtmlFormatter):
+	lexer = MMTLexer()
+	formatter = formatter_class(full = True, style = MMTDefaultStyle)
+	for (name, source) in get_corpus():
+		tokens = list(lexer.get_tokens(source))
+		yield (name, source, lambda tokens = tokens: pygments.format(tokens, formatter, io.StringIO()) or len(tokens))
+
+# Every benchmark yields (name, source, run) triples, where run() processes source
+# and returns the number of tokens processed
+BENCHMARKS = {
+	'mmt-lex': lambda: lex_benchmark(MMTLexer, get_corpus),
+	'mmtcombined-lex': lambda: lex_benchmark(MMTLexer, get_corpus, combined = True),
+	'mmtdispatch-lex': lambda: lex_benchmark(MMTLexer, get_corpus, dispatch = True),
+	'mmtdelimited-lex': lambda: lex_benchmark(MMTLexer, get_corpus, delimited = True),
+	'mmt-longexpr-lex': lambda: lex_benchmark(MMTLexer, get_long_expression_corpus),
+	'mmtdelimited-longexpr-lex': lambda: lex_benchmark(MMTLexer, get_long_expression_corpus, delimited = True),
+	'mmtfast-lex': lambda: lex_benchmark(MMTFastLexer, get_corpus),
+	'mmtrel-lex': lambda: lex_benchmark(MMTRelationalLexer, get_relational_corpus),
+	'mmtstandalone-lex': lambda: standalone_benchmark(MMTLexer, get_corpus),
+	'html-format': html_benchmark,
+	'mmthtml-format': lambda: html_benchmark(MMTHtmlFormatter),
+	REFERENCE_BENCHMARK: lambda: lex_benchmark(PythonLexer, get_python_corpus)
+}
+
+# Malformed inputs of (roughly) a given size on which lexing time may grow superlinearly
+ADVERSARIAL_INPUTS = {
+	'missing-module-delimiter': lambda size: "foo bar " * (size // 8),
+	'unterminated-comments': lambda size: "// comment without end " * (size // 23),
+	'long-line': lambda size: "x" * size,
+	'unterminated-view-header': lambda size: "view " + "x" * size,
+	'view-header-without-colon-after-name': lambda size: "view " + "x" * size + " z : a -> b\n",
+	'missing-declaration-delimiter': lambda size: "theory T =\n" + ": " * (size // 2),
+	'missing-module-delimiter-after-equals': lambda size: "theory T =\n" + "c ❘ x = y ❙\n" * (size // 12),
+	'unterminated-includes': lambda size: "theory T =\n" + "include ?X\n" * (size // 11)
+}
+
+def run_adversarial(sizes, repeat, lexer_options):
+	"""Lex every adversarial input in two sizes and return its empirical growth exponent.
+
+	Return:
+		A dictionary mapping input names to pairs of the lexing time at the larger size
+		in seconds and the exponent k in time ~ size^k (1 for linear time).
+	"""
+	lexer = MMTLexer(**lexer_options)
+	results = {}
+	for (name, generate) in ADVERSARIAL_INPUTS.items():
+		# warm up caches (e.g. of the regex module) to not distort the smaller size
+		sum(1 for _ in lexer.get_tokens(generate(sizes[0] // 4)))
+
+		times = []
+		for size in sizes:
+			source = generate(size)
+			best = None
+			for _ in range(repeat):
+				start_time = time.perf_counter()
+				sum(1 for _ in lexer.get_tokens(source))
+				seconds = time.perf_counter() - start_time
+				best = seconds if best is None else min(best, seconds)
+			times.append(max(best, 1e-6))
+		results[name] = (times[1], math.log(times[1] / times[0]) / math.log(sizes[1] / sizes[0]))
+	return results
+
+# Run in fresh interpreters, prints the milliseconds spent on import, instantiation and the first token
+COLD_START_SCRIPT = """
+import sys, time
+start_time = time.perf_counter()
+sys.path.append({root!r})
+from mmtpygments.mmt_lexer import MMTLexer
+import_time = time.perf_counter()
+lexer = MMTLexer()
+instantiation_time = time.perf_counter()
+next(iter(lexer.get_tokens("theory T = c : type ❙ ❚")))
+first_token_time = time.perf_counter()
+print(1000 * (import_time - start_time), 1000 * (instantiation_time - import_time), 1000 * (first_token_time - instantiation_time))
+"""
+
+def run_cold_start(runs, regex_cache):
+	"""Lex a snippet in runs fresh processes and return the median milliseconds of import, instantiation and first token.
+
+	Args:
+		regex_cache: The value of the environment variable MMTPYGMENTS_REGEX_CACHE in the processes,
+		             i.e. the path of the precompiled regex table to build and use, or "0" to disable it.
+	"""
+	script = COLD_START_SCRIPT.format(root = path.dirname(path.dirname(path.dirname(path.abspath(__file__)))))
+	environment = dict(os.environ, MMTPYGMENTS_REGEX_CACHE = regex_cache, PYTHONIOENCODING = "utf-8")
+	if regex_cache != "0":
+		subprocess.run(
+			[sys.executable, "-m", "mmtpygments.mmt_regex_cache"], env = environment, check = True,
+			stdout = subprocess.DEVNULL, cwd = path.dirname(path.dirname(path.dirname(path.abspath(__file__))))
+		)
+	# warm up the file system cache
+	subprocess.run([sys.executable, "-c", script], env = environment, check = True, stdout = subprocess.DEVNULL)
+
+	samples = []
+	for _ in range(runs):
+		output = subprocess.run(
+			[sys.executable, "-c", script], env = environment, check = True, stdout = subprocess.PIPE
+		).stdout
+		samples.append([float(milliseconds) for milliseconds in output.split()])
+	return tuple(statistics.median(column) for column in zip(*samples))
+
+def run_per_state(repeat):
+	"""Measure per lexer state how long finding the matching rule takes with the options combined and dispatch.
+
+	The positions at which MMTLexer dispatches in every state are recorded while lexing the corpus,
+	then the rules of that state are tried at exactly these positions: one by one, by the combined
+	master regexes, only those of the first-character bucket, and by the combined buckets.
+
+	Return:
+		A dictionary mapping states to pairs (number of positions, list of pairs (variant, seconds)),
+		taking the best of repeat runs each. Variants are "by rules" (the baseline), "combined",
+		"dispatch" and "dispatch+combined".
+	"""
+	lexer = MMTLexer()
+	positions = {state: [] for state in lexer._tokens}
+	select_rule = match_rules(lexer)
+
+	def recording(statestack, text, pos):
+		positions[statestack[-1]].append((text, pos))
+		return select_rule(statestack, text, pos)
+
+	# Shadow get_tokens_unprocessed on this instance only, like the lexer options do
+	lexer.get_tokens_unprocessed = lambda text, stack = ('root',): lex_states(recording, text, 0, stack)
+	for (_, source) in get_corpus():
+		sum(1 for _ in lexer.get_tokens(source))
+
+	def time_best(run):
+		best = None
+		for _ in range(repeat):
+			start_time = time.perf_counter()
+			run()
+			seconds = time.perf_counter() - start_time
+			best = seconds if best is None else min(best, seconds)
+		return best
+
+	# Same calling convention as mmt_combined.match_segments, such that only the matching itself differs
+	def match_rules_in_order(rules, text, pos):
+		for (rexmatch, _, _) in rules:
+			m = rexmatch(text, pos)
+			if m:
+				return m
+		return None
+
+	def dispatch_by_rules(rules, state_positions):
+		for (text, pos) in state_positions:
+			match_rules_in_order(rules, text, pos)
+
+	def dispatch_combined(segments, state_positions):
+		for (text, pos) in state_positions:
+			match_segments(segments, text, pos)
+
+	def dispatch_first_char(index, state, state_positions):
+		buckets = index.buckets[state]
+		for (text, pos) in state_positions:
+			c = text[pos] if pos < len(text) else ''
+			match_segments(buckets.get(c) or index.bucket(state, c), text, pos)
+
+	combined = MMTLexer(combined = True)._combined
+	indices = {
+		"dispatch": MMTLexer(dispatch = True)._first_char_index,
+		"dispatch+combined": MMTLexer(dispatch = True, combined = True)._first_char_index
+	}
+	results = {}
+	for (state, state_positions) in positions.items():
+		# fill the buckets before measuring
+		for index in indices.values():
+			dispatch_first_char(index, state, state_positions)
+
+		results[state] = (len(state_positions), [
+			("by rules", time_best(lambda: dispatch_by_rules(lexer._tokens[state], state_positions))),
+			("combined", time_best(lambda: dispatch_combined(combined[state], state_positions))),
+			("dispatch", time_best(lambda: dispatch_first_char(indices["dispatch"], state, state_positions))),
+			("dispatch+combined", time_best(
+				lambda: dispatch_first_char(indices["dispatch+combined"], state, state_positions)
+			))
+		])
+	return results
+
+def percentile(sorted_values, fraction):
+	if not sorted_values:
+		return 0.0
+	return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+def peak_rss_kib():
+	"""Return the peak resident set size of the current process in KiB, None if unsupported."""
+	if resource is None:
+		return None
+	max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# bytes on macOS, KiB elsewhere
+	return max_rss // 1024 if sys.platform == 'darwin' else max_rss
+
+def run_benchmark(name, repeat):
+	"""Run the benchmark name and return its results as a dictionary.
+
+	Every input is processed repeat times, its best time counts.
+	"""
+	latencies = []
+	num_bytes = 0
+	num_tokens = 0
+
+	for (_, source, run) in BENCHMARKS[name]():
+		best = None
+		for _ in range(repeat):
+			start_time = time.perf_counter()
+			tokens = run()
+			seconds = time.perf_counter() - start_time
+			best = seconds if best is None else min(best, seconds)
+		latencies.append(best)
+		num_bytes += len(source.encode("utf-8"))
+		num_tokens += tokens
+
+	seconds = sum(latencies)
+	latencies.sort()
+	return {
+		"files": len(latencies),
+		"bytes": num_bytes,
+		"tokens": num_tokens,
+		"seconds": seconds,
+		"bytes_per_second": num_bytes / seconds if seconds else 0.0,
+		"tokens_per_second": num_tokens / seconds if seconds else 0.0,
+		"latency_ms": {
+			"p50": percentile(latencies, 0.5) * 1000,
+			"p90": percentile(latencies, 0.9) * 1000,
+			"p99": percentile(latencies, 0.99) * 1000,
+			"max": percentile(latencies, 1.0) * 1000
+		},
+		"peak_rss_kib": peak_rss_kib()
+	}
+
+def run_isolated(name, repeat):
+	"""Run the benchmark name in a fresh process, such that its peak RSS is its own."""
+	with multiprocessing.get_context("spawn").Pool(1) as pool:
+		return pool.apply(run_benchmark, (name, repeat))
+
+def compare_to_baseline(results, baseline, threshold):
+	"""Return a list of regression messages for benchmarks slower than baseline by more than threshold.
+
+	If both contain the reference benchmark, the baseline's throughputs are first scaled by
+	how much faster or slower it ran in results, i.e. by the speed of the machine.
+	"""
+	scale = 1.0
+	if REFERENCE_BENCHMARK in results["benchmarks"] and REFERENCE_BENCHMARK in baseline["benchmarks"]:
+		scale = results["benchmarks"][REFERENCE_BENCHMARK]["bytes_per_second"] / \
+			baseline["benchmarks"][REFERENCE_BENCHMARK]["bytes_per_second"]
+
+	regressions = []
+	for (name, result) in results["benchmarks"].items():
+		if name not in baseline["benchmarks"] or name == REFERENCE_BENCHMARK:
+			continue
+		baseline_throughput = baseline["benchmarks"][name]["bytes_per_second"] * scale
+		if result["bytes_per_second"] < baseline_throughput * (1 - threshold):
+			regressions.append("%s: %.1f KiB/s vs. baseline %.1f KiB/s (%.1f%% slower)" % (
+				name,
+				result["bytes_per_second"] / 1024,
+				baseline_throughput / 1024,
+				100 * (1 - result["bytes_per_second"] / baseline_throughput)
+			))
+	return regressions
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description = "Benchmark the MMT Pygments lexers and HTML formatting.")
+	parser.add_argument("benchmarks", nargs = "*", metavar = "benchmark",
+		help = "benchmarks to run out of %s (default: all)" % ", ".join(sorted(BENCHMARKS)))
+	parser.add_argument("--repeat", type = int, default = 3,
+		help = "number of runs per input, the best one counts (default: 3)")
+	parser.add_argument("--output", default = "benchmark-results.json",
+		help = "JSON file to write the results to (default: benchmark-results.json)")
+	parser.add_argument("--baseline", default = DEFAULT_BASELINE,
+		help = "JSON results of an earlier run to compare against, e.g. a copy of an earlier --output, " +
+		       "or none to skip the comparison (default: benchmark-baseline.json next to this script)")
+	parser.add_argument("--threshold", type = float, default = 0.2,
+		help = "maximum tolerated throughput regression against the baseline as a fraction (default: 0.2)")
+	parser.add_argument("--adversarial", type = int, default = None, metavar = "SIZE",
+		help = "instead, lex malformed inputs of SIZE and 4*SIZE characters with and without the lexer option " +
+		       "linear and fail if the latter grows superlinearly (e.g. 20000)")
+	parser.add_argument("--cold-start", type = int, default = None, metavar = "RUNS",
+		help = "instead, measure the time to the first token of MMTLexer in RUNS fresh processes " +
+		       "with and without the precompiled regex table (e.g. 20)")
+	parser.add_argument("--per-state", action = "store_true",
+		help = "instead, measure the rule dispatch time of every lexer state with and without the lexer options " +
+		       "combined and dispatch")
+	options = parser.parse_args()
+
+	if options.per_state:
+		results = run_per_state(options.repeat)
+
+		variants = [variant for (variant, _) in next(iter(results.values()))[1]]
+		print("%-24s %10s" % ("state", "positions") + "".join(" %18s" % variant for variant in variants))
+		for (state, (num_positions, timings)) in sorted(
+			results.items(), key = lambda item: item[1][1][0][1], reverse = True
+		):
+			by_rules_seconds = timings[0][1]
+			print("%-24s %10d" % (state, num_positions) + "".join(
+				" %8.1f ms (%4.2fx)" % (seconds * 1000, by_rules_seconds / seconds if seconds else 0.0)
+				for (_, seconds) in timings
+			))
+		sys.exit(0)
+
+	if options.cold_start:
+		with tempfile.TemporaryDirectory() as temp_dir:
+			results = [
+				("uncached", run_cold_start(options.cold_start, "0")),
+				("precompiled", run_cold_start(options.cold_start, path.join(temp_dir, "regex-table.marshal")))
+			]
+
+		print("%-12s %10s %14s %12s %10s" % ("regexes", "import", "instantiation", "first token", "total"))
+		for (name, milliseconds) in results:
+			print("%-12s %7.1f ms %11.1f ms %9.1f ms %7.1f ms" % ((name,) + milliseconds + (sum(milliseconds),)))
+		sys.exit(0)
+
+	if options.adversarial:
+		sizes = (options.adversarial, 4 * options.adversarial)
+		default_results = run_adversarial(sizes, options.repeat, {})
+		linear_results = run_adversarial(sizes, options.repeat, {'linear': True})
+
+		print("%-38s %12s %9s %12s %9s" % ("input (%d chars)" % sizes[1], "default", "growth", "linear", "growth"))
+		superlinear = []
+		for name in ADVERSARIAL_INPUTS:
+			print("%-38s %10.3f s %9.2f %10.3f s %9.2f" % ((name,) + default_results[name] + linear_results[name]))
+			# allow for some noise, quadratic growth has an exponent of about 2
+			if linear_results[name][1] > 1.5:
+				superlinear.append(name)
+
+		if superlinear:
+			sys.stdout.flush() # avoid mixing of stdout and stderr for users' sanity
+			sys.stderr.write("\nFailure! Lexing in linear mode grows superlinearly on: %s\n" % ", ".join(superlinear))
+			sys.exit(1)
+		sys.exit(0)
+
+	for name in options.benchmarks:
+		if name not in BENCHMARKS:
+			parser.error("unknown benchmark %s" % name)
+	if options.benchmarks and options.baseline != "none" and REFERENCE_BENCHMARK not in options.benchmarks:
+		# needed to scale the baseline
+		options.benchmarks.append(REFERENCE_BENCHMARK)
+
+	results = {
+		"python": platform.python_version(),
+		"pygments": pygments.__version__,
+		"platform": platform.platform(),
+		"benchmarks": {}
+	}
+
+	for name in options.benchmarks or sorted(BENCHMARKS):
+		result = run_isolated(name, options.repeat)
+		results["benchmarks"][name] = result
+		print("%-12s %6d files %10.1f KiB/s %10d tokens/s  p50 %7.2f ms  p99 %7.2f ms  peak RSS %s KiB" % (
+			name, result["files"], result["bytes_per_second"] / 1024, result["tokens_per_second"],
+			result["latency_ms"]["p50"], result["latency_ms"]["p99"], result["peak_rss_kib"]
+		))
+
+	with io.open(options.output, "w", encoding = "utf-8") as output_file:
+		json.dump(results, output_file, indent = "\t")
+	print("\nResults written to " + options.output)
+
+	if options.baseline != "none":
+		with io.open(options.baseline, "r", encoding = "utf-8") as baseline_file:
+			regressions = compare_to_baseline(results, json.load(baseline_file), options.threshold)
+
+		if regressions:
+			sys.stdout.flush() # avoid mixing of stdout and stderr for users' sanity
+			sys.stderr.write("\nFailure! Throughput regressed beyond %d%%:\n" % (options.threshold * 100))
+			sys.stderr.write("".join("  " + regression + "\n" for regression in regressions))
+			sys.exit(1)
+		else:
+			print("No throughput regressions beyond %d%% against %s." % (options.threshold * 100, options.baseline))
@@ -3,108 +3,63 @@
 	Test Suite for the MMT Pygments lexer
 	~~~~~~~~~~~~~~~~~~~~
 
+	Results are recorded in a manifest (test-manifest.json), such that subsequent runs only
+	lex and render the test files that changed since, unless the lexers or any other code of
+	the package changed. Pass --full to process all test files regardless.
+
+	Test files with a golden token snapshot in the directory `snapshots` (see mmt_snapshots.py)
+	must yield the very same tokens as recorded there, pass --update-snapshots to take new ones.
+	Likewise, MMTLexer with the options in LEXER_OPTION_SETS must yield the same tokens as without,
+	and so must incremental, parallel and streaming lexing as well as TokenArray. The dispatch
+	index of the lexer option dispatch must keep all rules matching at a character, and the lexer
+	option delimited must keep the tokens of long and interleaved inputs. The statistics
+	collected by the lexer option profile must be consistent. Relational data is checked with
+	MMTRelationalLexer and RelationStore.
+
 	:author: ComFreek <comfreek@outlook.com>
 	:copyright: Copyright 2019 ComFreek
 	:license: ISC, see LICENSE for details.
 """
 
-import pygments
-from pygments.formatters.html import HtmlFormatter
-from pygments.token import Token, Generic
-
-from datetime import datetime
+import argparse
 import glob
 import io
+import itertools
 from os import path
+import pickle
+import random
 import sys
+import tempfile
+import types
 
-# Add parent directory such that we can import from mmt_lexer
-sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
-from mmt_lexer import MMTLexer
-from mmt_style import MMTDefaultStyle
-
-def generate_index_file(out_statuses, num_succeeding_lines, num_failing_files, base_path, amalgamation_filename, index_file):
-	"""Generate index file linking to all rendered HTML files.
-
-	Args:
-		out_statuses: An iterable of dictionaries {filename: ..., error: ...}, where
-		              filename points to the rendered HTML file and error is a boolean
-		              indicating whether an error occured.
-
-		base_path:    Base path to use for links
-		index_file:   File object to write the index HTML to, opened as text with encoding UTF-8!
-	"""
-
-	def error_to_symbol(error):
-		if error:
-			return "❌"
-		else:
-			return "✓"
-
-	index_file.write("""
-<!doctype html>
-<html>
-	<head>
-		<meta charset="utf-8">
-
-		<!-- Don't cache! -->
-		<meta http-equiv="Cache-Control" content="no-cache, no-store, must-revalidate">
-		<meta http-equiv="Pragma" content="no-cache" />
-		<meta http-equiv="Expires" content="0">
-
-		<title>Index of Render Results - mmt-pygments-lexer</title>
-	""")
-	index_file.write("<base href='" + base_path + "'>")
-	index_file.write("""
-	</head>
-	<body>
-		<h1>Render Results</h1>
-		Last update:
-	""")
-	index_file.write(str(datetime.now()))
-
-	index_file.write("""
-		<hr>
-	""")
-
-	index_file.write("<h2><a href='" + amalgamation_filename + "'>Amalgamation of Render Results (click)</a></h2>")
-	index_file.write("""
-		<h2>Overview (highlighted %d lines with success, %d failing files)</h2>
-	""" % (num_succeeding_lines, num_failing_files))
-
-	out_statuses = sorted(out_statuses, key = lambda s : s["error"])
-
-	# TODO Insecure HTML Injection!
-	html_anchors = list((
-		"<a href='" + filename.replace("\\", "/") + "'>" + error_to_symbol(error) + " " + filename + "</a>"
-
-		for (filename, error) in (
-			(out_status["filename"], out_status["error"])
-			for out_status in out_statuses
-		)
-	))
-
-	if len(html_anchors) == 0:
-		index_file.write("There are none, is the Travis build working? Please submit an issue.")
-	else:
-		index_file.write("<ul>")
-		index_file.write("".join("<li>" + anchor + "</li>" for anchor in html_anchors))
-		index_file.write("</ul>")
-
-	index_file.write("""
-		</ul>
-	</body>
-</html>""")
-
-def count_lines(filename):
-	with open(filename, mode="rt", encoding="utf-8") as file:
-		for i, _ in enumerate(file):
-			pass
-		return i + 1
-
-def run_tests(test_files, index_file, index_file_base_path, amalgamation_file, amalgamation_filename):
+import pygments
+from pygments.formatters.html import HtmlFormatter
+from pygments.lexer import RegexLexer
+from pygments.token import Whitespace
+
+# Add the repository root such that we can import from the mmtpygments package
+sys.path.append(path.dirname(path.dirname(path.dirname(path.abspath(__file__)))))
+from mmtpygments import mmt_batch
+from mmtpygments.mmt_fast_lexer import MMTFastLexer
+from mmtpygments.mmt_html_formatter import MMTHtmlFormatter
+from mmtpygments.mmt_incremental import MMTIncrementalLexer
+from mmtpygments.mmt_lexer import MMTLexer
+from mmtpygments.mmt_parallel import lex_parallel
+from mmtpygments.mmt_profile import LexerProfile
+from mmtpygments.mmt_relational_lexer import MMTRelationalLexer
+from mmtpygments.mmt_relations import Relation, RelationStore, parse_relation
+from mmtpygments.mmt_snapshots import SnapshotStore
+from mmtpygments.mmt_streaming import stream_tokens
+from mmtpygments.test.benchmark import ADVERSARIAL_INPUTS, synthetic_long_expressions, synthetic_mmt, synthetic_rel
+from mmtpygments.pygments_regex_analyzer import analyze_regex
+from mmtpygments.pygments_to_python import PygmentsToPythonConverter
+
+def run_tests(test_files, index_file, index_file_base_path, amalgamation_file, amalgamation_filename, jobs = None, manifest = None):
 	"""Run all tests and produce HTML render results.
 
+	Every file is additionally lexed with MMTFastLexer, which must yield the very same tokens.
+	Files on which both lexers disagree count as failing.
+
 	Args:
 		test_files: An iterable of filenames to lex, test and render
 		index_file: A file object to write the HTML index to linking all render results
@@ -112,80 +67,622 @@ def run_tests(test_files, index_file, index_file_base_path, amalgamation_file, a
 		index_file_base_path: Base path to use for links in index
 		amalgamation_file: A file object to write all HTML render results subsequently to
 		                   It must be opened as a binary file and it will be written to with UTF-8 encoding.
+		jobs: Number of processes to use, by default the number of CPUs.
+		manifest: A manifest (see mmt_batch.load_manifest) to reuse the results of unchanged test files
+		          from and to record all results to, or None to process all test files.
 
 	Return:
-		The number of files that failed complete lexing. On success, this is 0.
+		A pair of the number of successfully lexed lines and the number of files that failed
+		complete lexing. On success, the latter is 0.
 	"""
+	statistics = mmt_batch.run(
+		test_files,
+		jobs = jobs,
+		lexer = 'mmt',
+		verify_lexer = 'mmtfast',
+		index_file = index_file,
+		index_file_base_path = index_file_base_path,
+		amalgamation_file = amalgamation_file,
+		amalgamation_filename = amalgamation_filename,
+		manifest = manifest
+	)
 
-	lexer = MMTLexer(encoding = "utf-8")
-	full_html_formatter = HtmlFormatter(full = True, encoding = "utf-8", style = MMTDefaultStyle)
-	snippet_html_formatter = HtmlFormatter(full = False, encoding = "utf-8", style = MMTDefaultStyle)
+	return (statistics.num_succeeding_lines, statistics.num_failing_files)
 
-	amalgamation_file.write(b"""
-<!doctype html>
-<html>
-	<head>
-		<meta charset="utf-8">
+def run_standalone_lexer_test(test_files, manifest = None):
+	"""Lex all test files with the standalone Python lexer generated from MMTLexer.
 
-		<!-- Don't cache! -->
-		<meta http-equiv="Cache-Control" content="no-cache, no-store, must-revalidate">
-		<meta http-equiv="Pragma" content="no-cache" />
-		<meta http-equiv="Expires" content="0">
+	The generated lexer (see pygments_to_python.py) must yield the very same tokens as MMTLexer.
+	Given the manifest of run_tests, only test files without a recorded outcome of this test
+	are lexed, and their outcome is recorded.
 
-		<title>Amalgamation of Render Results - mmt-pygments-lexer</title>
-	</head>
-	<body>
-		<h1>Amalgamation of Render Results</h1>
-""")
+	Return:
+		The list of test files on which both lexers disagree.
+	"""
+	if manifest is not None:
+		untested_files = [
+			test_file for test_file in test_files
+			if 'standalone_diverging' not in manifest.entries.get(test_file, {})
+		]
+		diverging_files = set(run_standalone_lexer_test(untested_files) if untested_files else [])
+		for test_file in untested_files:
+			if test_file in manifest.entries:
+				manifest.entries[test_file]['standalone_diverging'] = test_file in diverging_files
+		manifest.save()
+
+		return [
+			test_file for test_file in test_files
+			if test_file in diverging_files or manifest.entries.get(test_file, {}).get('standalone_diverging')
+		]
+
+	standalone_lexer = types.ModuleType('mmt_standalone_lexer')
+	exec(compile(PygmentsToPythonConverter().transform(MMTLexer), standalone_lexer.__name__, 'exec'), standalone_lexer.__dict__)
 
-	amalgamation_file.write(b"<style>")
-	amalgamation_file.write(snippet_html_formatter.get_style_defs().encode("utf-8"))
-	amalgamation_file.write(b"</style>")
+	lexer = MMTLexer()
+	diverging_files = []
+	for test_file in test_files:
+		with io.open(test_file, mode = "r", encoding = "utf-8", newline = "") as source_file:
+			source = source_file.read()
+
+		expected_tokens = [(str(tokentype), value) for (tokentype, value) in lexer.get_tokens(source)]
+		actual_tokens = [
+			(standalone_lexer.TOKEN_TYPES[tokentype], value)
+			for (tokentype, value) in standalone_lexer.get_tokens(source)
+		]
+		if actual_tokens != expected_tokens:
+			diverging_files.append(test_file)
+
+	return diverging_files
+
+# Lexers and their options that must yield the very same tokens as MMTLexer without options
+LEXER_OPTION_SETS = [
+	(MMTLexer, {'combined': True}),
+	(MMTLexer, {'dispatch': True}),
+	(MMTLexer, {'dispatch': True, 'combined': True}),
+	(MMTLexer, {'linear': True}),
+	(MMTLexer, {'delimited': True}),
+	(MMTLexer, {'linear': True, 'delimited': True}),
+	(MMTLexer, {'linear': True, 'combined': True}),
+	(MMTLexer, {'delimited': True, 'dispatch': True, 'combined': True}),
+	(MMTLexer, {'profile': True}),
+	(MMTFastLexer, {'linear': True, 'delimited': True})
+]
+
+def run_lexer_options_test(test_files):
+	"""Lex all test files with MMTLexer and every lexer of LEXER_OPTION_SETS.
 
-	num_failing_files = 0
-	num_succeeding_lines = 0
-	out_statuses = []
+	Return:
+		A list of pairs (test file, (lexer class, options)) on which the lexer yields other tokens than MMTLexer.
+	"""
+	lexer = MMTLexer()
+	option_lexers = [(option_set, option_set[0](**option_set[1])) for option_set in LEXER_OPTION_SETS]
+	diverging = []
+	for test_file in test_files:
+		with io.open(test_file, mode = "r", encoding = "utf-8", newline = "") as source_file:
+			source = source_file.read()
 
-	# Tokens that we interpret as signalling a lexer error
-	# Token.Error is Pygment's standard error token whereas Generic.Error
-	# is issued by MMTLexer for graceful degradation
-	error_tokens = [Token.Error, Generic.Error]
+		expected_tokens = list(lexer.get_tokens(source))
+		for (option_set, option_lexer) in option_lexers:
+			if list(option_lexer.get_tokens(source)) != expected_tokens:
+				diverging.append((test_file, option_set))
 
-	for test_filename in test_files:
-		print("Running test for " + test_filename)
+	return diverging
 
-		# We read both input and output file in binary mode to circumvent encoding issues
-		# Indeed, we specified above UTF-8 encoding for the lexer and formatter
-		with io.open(test_filename, mode="rb") as test_file:
-			tokens = list(lexer.get_tokens(test_file.read()))
-			erroneous = any(token in error_tokens for (token, _) in tokens)
+def run_dispatch_index_test(test_files, positions_per_character = 20, seed = 0):
+	"""Check that the first-character dispatch index (see mmt_dispatch.py) never leaves out a rule that matches.
 
-		if erroneous:
-			num_failing_files = num_failing_files + 1
-			print("  --> Lexing error, see corresponding .html file for details\n")
-		else:
-			num_succeeding_lines = num_succeeding_lines + count_lines(test_filename)
-
-		out_filename = test_filename + ".html"
-		out_statuses.append({"filename": out_filename, "error": erroneous})
-		with io.open(out_filename, mode="wb") as out_file:
-			pygments.format(tokens, full_html_formatter, out_file)
-			pygments.format(tokens, snippet_html_formatter, amalgamation_file)
-
-		print("  --> Output at " + out_filename)
-
-	generate_index_file(
-		out_statuses,
-		num_succeeding_lines,
-		num_failing_files,
-		index_file_base_path,
-		amalgamation_filename,
-		index_file
-	)
+	In every state, every rule is tried at up to positions_per_character random positions of the
+	test files per character, and at their ends. Those that match there must be among the rules
+	the index of the lexer option dispatch keeps for the character.
+
+	Return:
+		A list of triples (state, rule index, character) of the rules the index wrongly leaves out.
+	"""
+	index = MMTLexer(dispatch = True)._first_char_index
+	rng = random.Random(seed)
+	texts = []
+	positions = {}
+	for test_file in test_files:
+		with io.open(test_file, mode = "r", encoding = "utf-8", newline = "") as source_file:
+			texts.append(source_file.read())
+		for (pos, c) in enumerate(texts[-1]):
+			positions.setdefault(c, []).append((len(texts) - 1, pos))
+	samples = [('', texts_index, len(text)) for (texts_index, text) in enumerate(texts)]
+	for (c, occurrences) in positions.items():
+		samples.extend((c, texts_index, pos) for (texts_index, pos) in rng.sample(occurrences, min(len(occurrences), positions_per_character)))
+
+	missing = set()
+	for (state, rules) in index.tokendefs.items():
+		for (c, texts_index, pos) in samples:
+			kept_indices = set(index.rule_indices(state, c))
+			for (rule_index, (rexmatch, _, _)) in enumerate(rules):
+				if rule_index not in kept_indices and rexmatch(texts[texts_index], pos):
+					missing.add((state, rule_index, c))
+
+	return sorted(missing)
+
+def run_profile_test(test_files):
+	"""Lex all test files with the lexer option profile and check the consistency of the collected profile.
+
+	Rules are tried in order until one matches, hence every rule is attempted as often as the
+	previous rule of its state missed. The time per state stack must add up to the time per rule,
+	and a profile shared by two lexers must accumulate the statistics of both.
+
+	Return:
+		A list of descriptions of the checks that failed.
+	"""
+	profile = LexerProfile()
+	lexer = MMTLexer(profile = profile)
+	sources = []
+	for test_file in test_files:
+		with io.open(test_file, mode = "r", encoding = "utf-8", newline = "") as source_file:
+			sources.append(source_file.read())
+			list(lexer.get_tokens(sources[-1]))
+
+	failures = []
+	for ((state, index), (attempts, hits, seconds)) in profile.rules.items():
+		if not 0 <= hits <= attempts:
+			failures.append("The profile counts %d hits of %d attempts of rule %d of %s" % (hits, attempts, index, state))
+		if index > 0:
+			(previous_attempts, previous_hits, _) = profile.rules.get((state, index - 1), (0, 0, 0.0))
+			if attempts != previous_attempts - previous_hits:
+				failures.append("The profile counts %d attempts of rule %d of %s, but %d misses of the rule before" % (
+					attempts, index, state, previous_attempts - previous_hits
+				))
+
+	stack_seconds = {}
+	for ((stack, index), seconds) in profile.stacks.items():
+		stack_seconds[(stack[-1], index)] = stack_seconds.get((stack[-1], index), 0.0) + seconds
+	for (key, (_, _, seconds)) in profile.rules.items():
+		if abs(stack_seconds.get(key, 0.0) - seconds) > 1e-6:
+			failures.append("The time of rule %d of %s per state stack does not add up to its time" % (key[1], key[0]))
+
+	collapsed = io.StringIO()
+	profile.write_collapsed(collapsed)
+	for line in collapsed.getvalue().splitlines():
+		(frames, microseconds) = line.rsplit(" ", 1)
+		if not frames.startswith("root;") or not frames.split(";")[-1].startswith("rule ") or not microseconds.isdigit():
+			failures.append("Malformed line in the collapsed state stacks: " + line)
+
+	attempts = {key: statistics[0] for (key, statistics) in profile.rules.items()}
+	other_lexer = MMTLexer(profile = profile)
+	for source in sources:
+		list(other_lexer.get_tokens(source))
+	if any(profile.rules[key][0] != 2 * num_attempts for (key, num_attempts) in attempts.items()):
+		failures.append("A profile shared by two lexers does not accumulate their statistics")
+
+	return failures
+
+def run_linear_lexer_test(size = 500):
+	"""Lex the malformed inputs of benchmark.py at size with and without the lexer option linear.
+
+	Return:
+		A list of the names of the inputs on which the lexer option linear changes the tokens.
+	"""
+	(lexer, linear_lexer) = (MMTLexer(), MMTLexer(linear = True))
+	return [
+		name for (name, generate) in ADVERSARIAL_INPUTS.items()
+		if list(linear_lexer.get_tokens(generate(size))) != list(lexer.get_tokens(generate(size)))
+	]
+
+def run_delimited_lexer_test(test_files, size = 500):
+	"""Lex long object expressions and malformed inputs with and without the lexer option delimited.
+
+	Besides the synthetic long expressions and the malformed inputs of benchmark.py at size, every
+	test file is lexed interleaved with the long expressions by one lexer, such that the delimiter
+	index is rebuilt between any two lookups.
+
+	Return:
+		A list of the names of the inputs on which the lexer option delimited changes the tokens.
+	"""
+	(lexer, delimited_lexer) = (MMTLexer(), MMTLexer(delimited = True))
+	long_expressions = synthetic_long_expressions(10, 1000)
+	sources = [("synthetic_long_expressions", long_expressions)]
+	sources.extend((name, generate(size)) for (name, generate) in ADVERSARIAL_INPUTS.items())
+	differing = [
+		name for (name, source) in sources
+		if list(delimited_lexer.get_tokens(source)) != list(lexer.get_tokens(source))
+	]
+
+	expected_long_expression_tokens = list(lexer.get_tokens_unprocessed(long_expressions))
+	for test_file in test_files:
+		with io.open(test_file, mode = "r", encoding = "utf-8", newline = "") as source_file:
+			source = source_file.read()
+
+		(tokens, long_expression_tokens) = ([], [])
+		for (token, long_expression_token) in itertools.zip_longest(
+			delimited_lexer.get_tokens_unprocessed(source),
+			delimited_lexer.get_tokens_unprocessed(long_expressions)
+		):
+			if token is not None:
+				tokens.append(token)
+			if long_expression_token is not None:
+				long_expression_tokens.append(long_expression_token)
+
+		if tokens != list(lexer.get_tokens_unprocessed(source)) or long_expression_tokens != expected_long_expression_tokens:
+			differing.append(test_file + " interleaved with synthetic_long_expressions")
+
+	return differing
+
+# Replacements to insert by the random edits of run_incremental_lexer_test, covering
+# the delimiters at which MMTIncrementalLexer records its checkpoints
+INCREMENTAL_EDIT_REPLACEMENTS = ['', 'x', ' ', '\n', '❙', '❘', '❚', ': ', ' = ', '// ', 'theory T =', '\n❚\n']
+
+def run_incremental_lexer_test(test_files, num_edits = 20, seed = 0):
+	"""Apply num_edits random edits to every test file with MMTIncrementalLexer.
+
+	After every edit, its tokens must equal those of lexing the edited text from scratch and
+	the returned delta must turn the tokens before the edit into those after it.
+
+	Return:
+		A list of the test files on which incremental lexing diverges from lexing from scratch.
+	"""
+	lexer = MMTLexer()
+	rng = random.Random(seed)
+	diverging = []
+	for test_file in test_files:
+		with io.open(test_file, mode = "r", encoding = "utf-8", newline = "") as source_file:
+			incremental_lexer = MMTIncrementalLexer(source_file.read(), lexer)
+
+		for _ in range(num_edits):
+			old_tokens = list(incremental_lexer.tokens)
+			start = rng.randint(0, len(incremental_lexer.text))
+			end = min(len(incremental_lexer.text), start + rng.randint(0, 20))
+			delta = incremental_lexer.edit(start, end, rng.choice(INCREMENTAL_EDIT_REPLACEMENTS))
+
+			expected_tokens = [(tokentype, value) for (_, tokentype, value) in lexer.get_tokens_unprocessed(incremental_lexer.text)]
+			if incremental_lexer.tokens != expected_tokens or \
+			   old_tokens[:delta.start] + delta.tokens + old_tokens[delta.end:] != expected_tokens:
+				diverging.append(test_file)
+				break
+
+	return diverging
+
+# Edits (text, start, end, replacement) on which restarting at the last checkpoint before
+# the edit is not enough: the rule for `import` fails at `import a❚ x y❚`, but only after
+# looking beyond the checkpoint after `a❚`, and matches once ` y` is deleted
+INCREMENTAL_EDIT_CASES = [
+	('import a❚ x y❚\n', 11, 13, ''),
+	('import a❚ x❚\n', 11, 11, ' y')
+]
+
+def run_incremental_edit_cases(edit_cases = INCREMENTAL_EDIT_CASES):
+	"""Apply every edit of edit_cases with MMTIncrementalLexer.
+
+	Return:
+		A list of the edit cases after which its tokens differ from lexing from scratch.
+	"""
+	lexer = MMTLexer()
+	diverging = []
+	for (text, start, end, replacement) in edit_cases:
+		incremental_lexer = MMTIncrementalLexer(text, lexer)
+		incremental_lexer.edit(start, end, replacement)
+		expected_tokens = [(tokentype, value) for (_, tokentype, value) in lexer.get_tokens_unprocessed(incremental_lexer.text)]
+		if incremental_lexer.tokens != expected_tokens:
+			diverging.append((text, start, end, replacement))
+	return diverging
+
+# Inner modules whose ❚ is followed by a line starting at column 0, i.e. looks like the end of
+# a top-level module to lex_parallel, but is not reached in the root state
+NESTED_MODULES = "theory A =\n" + "".join(
+	"theory B{0} =\nc : type ❙\n❚\nd{0} : type ❙\n".format(i) for i in range(200)
+) + "❚\n"
+
+def run_parallel_lexer_test(test_files, workers = 2):
+	"""Lex several inputs with lex_parallel (see mmt_parallel.py) and serially.
+
+	The inputs are the concatenation of all test files, synthetic modules split into many chunks
+	and NESTED_MODULES followed by synthetic modules, whose chunks first have to be re-lexed
+	serially and then are taken from the workers again. The latter is also lexed from bytes with
+	Windows line breaks.
+
+	Return:
+		A list of descriptions of the inputs on which lex_parallel yields other tokens than MMTLexer.
+	"""
+	sources = []
+	for test_file in test_files:
+		with io.open(test_file, mode = "r", encoding = "utf-8", newline = "") as source_file:
+			sources.append(source_file.read())
+
+	lexer = MMTLexer()
+	nested_source = NESTED_MODULES + synthetic_mmt(100)
+	inputs = [
+		("the concatenation of all test files", "\n".join(sources), {}),
+		("synthetic_mmt(200) in 16 chunks", synthetic_mmt(200), {'chunks_per_worker': 8}),
+		("NESTED_MODULES followed by synthetic_mmt(100)", nested_source, {'chunks_per_worker': 8}),
+		("NESTED_MODULES followed by synthetic_mmt(100) as bytes with \\r\\n", nested_source.replace("\n", "\r\n").encode("utf-8"), {'chunks_per_worker': 8})
+	]
+	return [
+		description for (description, source, options) in inputs
+		if list(lex_parallel(source, workers = workers, **options)) != list(lexer.get_tokens(source))
+	]
+
+def run_token_array_test(test_files):
+	"""Lex all test files into a TokenArray (see mmt_token_array.py) and into a list of tokens.
+
+	Both must be equal by comparison, iteration and indexing, also after pickling the TokenArray
+	(which must restore the singletons of pygments.token) and for a lexer with a filter altering
+	the values of tokens.
+
+	Return:
+		A list of the test files whose TokenArray differs from their list of tokens.
+	"""
+	lexer = MMTLexer()
+	filtered_lexer = MMTLexer()
+	filtered_lexer.add_filter('keywordcase', case = 'upper')
+	differing = []
+	for test_file in test_files:
+		with io.open(test_file, mode = "r", encoding = "utf-8", newline = "") as source_file:
+			source = source_file.read()
+
+		for token_lexer in (lexer, filtered_lexer):
+			token_array = token_lexer.get_token_array(source)
+			expected_tokens = list(token_lexer.get_tokens(source))
+			unpickled_token_array = pickle.loads(pickle.dumps(token_array))
+			if token_array != expected_tokens or list(token_array) != expected_tokens or \
+			   [token_array[i] for i in range(-len(token_array), len(token_array))] != expected_tokens * 2 or \
+			   unpickled_token_array != token_array or \
+			   any(tokentype is not expected_tokentype for ((tokentype, _), (expected_tokentype, _)) in zip(unpickled_token_array, expected_tokens)):
+				differing.append(test_file)
+				break
+
+	return differing
+
+# A single module larger than the default windows of MMTLexer.get_tokens, such that every
+# window lacks a cut and lexing resumes within the module
+LARGE_MODULE = "theory T =\n" + "".join("c{} : type ⟶ type ❘ = x ❙\n".format(i) for i in range(6000)) + "❚\n"
+
+def run_streaming_test(test_files):
+	"""Lex all test files and LARGE_MODULE from file objects (see mmt_streaming.py) and from strings.
+
+	Besides the default windows of MMTLexer.get_tokens, the files are streamed in tiny windows
+	and blocks, such that most of them are cut into several windows.
+
+	Return:
+		A list of the test files on which streaming yields other tokens than lexing the string.
+	"""
+	lexer = MMTLexer()
+	differing = []
+	sources = []
+	for test_file in test_files:
+		with io.open(test_file, mode = "r", encoding = "utf-8", newline = "") as source_file:
+			sources.append((test_file, source_file.read()))
+	sources.append(("LARGE_MODULE", LARGE_MODULE))
+
+	for (test_file, source) in sources:
+		expected_tokens = list(lexer.get_tokens(source))
+		streams = [
+			lexer.get_tokens(io.StringIO(source, newline = "")),
+			lexer.get_tokens(io.BytesIO(source.encode("utf-8"))),
+			stream_tokens(lexer, io.StringIO(source, newline = ""), window_size = 64, lookahead = 64, block_size = 16)
+		]
+		if any(list(stream) != expected_tokens for stream in streams):
+			differing.append(test_file)
+
+	return differing
+
+# Lines of MMT relational data beyond those of synthetic_rel (see benchmark.py): unary relations,
+# blank and irregular lines, other whitespace and line breaks
+RELATIONAL_FIXTURE = (
+	"theory http://example.org/a?T\n"
+	"include http://example.org/a?T http://example.org/b?S\n"
+	"\n"
+	"declares\thttp://example.org/a?T   http://example.org/a?T?c  \r\n"
+	"HasType http://example.org/a?T?c http://example.org/a?T?ℕ\r\n"
+	"predicate-only\n"
+	"  \t\n"
+	"include http://example.org/b?S http://example.org/a?T"
+)
+
+# Pieces of the random lines of run_relational_lexer_test, with the whitespace
+# characters that the fast path of MMTRelationalLexer handles differently from its rules
+RELATIONAL_LINE_PIECES = ['', ' ', '  ', '\t', '\r', '\x0b', '\u00a0', 'a', 'include', 'http://example.org/a?T', 'ℕ']
+
+def run_relational_lexer_test(num_lines = 2000, block_sizes = (1, 7, 4096), num_random_inputs = 200, seed = 0):
+	"""Lex relational data with MMTRelationalLexer against RegexLexer with its rules, and streamed against at once.
+
+	The fast path of MMTRelationalLexer may merge adjacent whitespace tokens, hence both must
+	assign the same token type to every character instead of yielding the same tokens. Besides
+	RELATIONAL_FIXTURE and synthetic_rel, num_random_inputs inputs of random lines made up of
+	RELATIONAL_LINE_PIECES are lexed, whose tokens must also cover the input and never be
+	adjacent whitespace tokens.
+
+	Return:
+		A list of descriptions of the checks that failed.
+	"""
+	rng = random.Random(seed)
+	random_sources = [
+		"\n".join(
+			"".join(rng.choice(RELATIONAL_LINE_PIECES) for _ in range(rng.randint(0, 5)))
+			for _ in range(rng.randint(1, 30))
+		)
+		for _ in range(num_random_inputs)
+	]
+	lexer = MMTRelationalLexer()
+	failures = []
+
+	def character_types(tokens):
+		return [tokentype for (_, tokentype, value) in tokens for _ in value]
+
+	for source in [RELATIONAL_FIXTURE + "\n" + synthetic_rel(num_lines)] + random_sources:
+		tokens = list(lexer.get_tokens_unprocessed(source))
+		if character_types(tokens) != character_types(RegexLexer.get_tokens_unprocessed(lexer, source)):
+			failures.append("MMTRelationalLexer and its rules assign different token types in %r" % source[:80])
+		if "".join(value for (_, _, value) in tokens) != source or \
+		   any(tokentype is Whitespace and next_tokentype is Whitespace for ((_, tokentype, _), (_, next_tokentype, _)) in zip(tokens, tokens[1:])):
+			failures.append("MMTRelationalLexer does not cover %r by merged whitespace runs and other tokens" % source[:80])
+
+		expected_tokens = list(lexer.get_tokens(source))
+		for block_size in block_sizes:
+			streaming_lexer = MMTRelationalLexer(blocksize = block_size)
+			for source_file in (io.StringIO(source, newline = ""), io.BytesIO(source.encode("utf-8"))):
+				if list(streaming_lexer.get_tokens(source_file)) != expected_tokens:
+					failures.append("MMTRelationalLexer yields different tokens streaming %s in blocks of %d in %r" % (
+						type(source_file).__name__, block_size, source[:80]
+					))
+
+	return failures
+
+def run_relation_store_test(num_lines = 2000):
+	"""Build a RelationStore (see mmt_relations.py) from relational data, save it and load it again.
+
+	The data is split into a file given by name and a file object. Both the built and the loaded
+	store must answer all queries like a plain scan of the parsed relations, and loading truncated
+	or foreign files must fail with ValueError.
+
+	Return:
+		A list of descriptions of the checks that failed.
+	"""
+	source = RELATIONAL_FIXTURE + "\n" + synthetic_rel(num_lines)
+	relations = [
+		Relation(predicate, subject, obj or None)
+		for (predicate, subject, obj) in filter(None, map(parse_relation, io.StringIO(source, newline = "")))
+	]
+	split_point = source.index("\n", len(source) // 2) + 1
+
+	failures = []
+	with tempfile.TemporaryDirectory() as directory:
+		relations_filename = path.join(directory, "relations.rel")
+		with io.open(relations_filename, "w", encoding = "utf-8", newline = "") as relations_file:
+			relations_file.write(source[:split_point])
+		built_store = RelationStore.build([relations_filename, io.StringIO(source[split_point:], newline = "")])
+
+		store_filename = path.join(directory, "relations.store")
+		built_store.save(store_filename)
+		loaded_store = RelationStore.load(store_filename)
+
+		with io.open(store_filename, "rb") as store_file:
+			store_data = store_file.read()
+		for (description, data) in (("a truncated store", store_data[:-1]), ("a .rel file", source.encode("utf-8"))):
+			with io.open(store_filename, "wb") as store_file:
+				store_file.write(data)
+			try:
+				RelationStore.load(store_filename)
+				failures.append("Loading %s as relation store does not fail" % description)
+			except ValueError:
+				pass
+
+	# The expected answers by a plain scan
+	by_predicate = {}
+	by_subject = {}
+	by_object = {}
+	for relation in relations:
+		by_predicate.setdefault(relation.predicate, []).append(relation)
+		by_subject.setdefault((relation.predicate, relation.subject), []).append(relation)
+		if relation.object is not None:
+			by_object.setdefault((relation.predicate, relation.object), []).append(relation)
+
+	for (name, store) in (("built", built_store), ("loaded", loaded_store)):
+		def check(description, result, expected):
+			if result != expected:
+				failures.append("The %s relation store answers %s wrongly" % (name, description))
+
+		check("query()", list(store.query()), relations)
+		check("predicates()", store.predicates(), {predicate: len(rows) for (predicate, rows) in by_predicate.items()})
+		for (predicate, rows) in by_predicate.items():
+			check("count(%r)" % predicate, store.count(predicate), len(rows))
+			check("query(%r)" % predicate, list(store.query(predicate)), rows)
+		for ((predicate, subject), rows) in by_subject.items():
+			check("query(%r, %r)" % (predicate, subject), list(store.query(predicate, subject = subject)), rows)
+			check("objects(%r, %r)" % (predicate, subject), store.objects(predicate, subject), list(dict.fromkeys(
+				relation.object for relation in rows if relation.object is not None
+			)))
+		for ((predicate, obj), rows) in by_object.items():
+			check("query(%r, object = %r)" % (predicate, obj), list(store.query(predicate, object = obj)), rows)
+			check("subjects(%r, %r)" % (predicate, obj), store.subjects(predicate, obj), list(dict.fromkeys(
+				relation.subject for relation in rows
+			)))
+		for relation in relations[::97]:
+			# None as object of unary relations matches anything
+			rows = [
+				other for other in relations
+				if other[:2] == relation[:2] and relation.object in (None, other.object)
+			]
+			check("query%r" % (tuple(relation),), list(store.query(*relation)), rows)
+			check("query(subject = %r)" % relation.subject, list(store.query(subject = relation.subject)), [
+				other for other in relations if other.subject == relation.subject
+			])
+		check("query() of an unknown term", list(store.query(subject = "http://example.org/unknown")), [])
+		check("count() of an unknown predicate", store.count("unknown-predicate"), 0)
+		check("num_skipped_lines", store.num_skipped_lines, 1)
+
+	return failures
+
+# Options of MMTHtmlFormatter to check against HtmlFormatter, covering the line-wise
+# wrappers, inline styles and the options left to HtmlFormatter itself
+HTML_FORMATTER_OPTION_SETS = [
+	{},
+	{'noclasses': True},
+	{'nowrap': True},
+	{'full': True},
+	{'linenos': 'table'},
+	{'linenos': 'inline', 'hl_lines': '2 3'},
+	{'lineanchors': 'line', 'linespans': 'span'},
+	{'lineseparator': '<br>'},
+	{'debug_token_types': True}
+]
+
+def run_html_formatter_test(test_files):
+	"""Format the tokens of all test files with MMTHtmlFormatter and HtmlFormatter under HTML_FORMATTER_OPTION_SETS.
+
+	Return:
+		A list of pairs (test file, options) on which both formatters yield different HTML.
+	"""
+	lexer = MMTLexer()
+	differing = []
+	for test_file in test_files:
+		with io.open(test_file, mode = "r", encoding = "utf-8", newline = "") as source_file:
+			tokens = list(lexer.get_tokens(source_file.read()))
+
+		for options in HTML_FORMATTER_OPTION_SETS:
+			if pygments.format(tokens, MMTHtmlFormatter(**options)) != pygments.format(tokens, HtmlFormatter(**options)):
+				differing.append((test_file, options))
+
+	return differing
+
+# Regexes and the kinds of findings the regex analyzer (see pygments_regex_analyzer.py) must report on them
+REGEX_ANALYZER_FIXTURES = [
+	(r'(a|aa)+$', {'overlapping-alternatives'}),
+	(r'(a|ab)*c', {'overlapping-alternatives'}),
+	(r'(\d+[Td]*)*x', {'nested-quantifier'}),
+	(r'\s*.*?❙', {'overlapping-quantifiers'}),
+	(r'(?=[❘❙❚])', {'empty-match'}),
+	(r'(ab|ac)+', set()),
+	(r'(foo|bar)+x', set())
+]
+
+def run_regex_analyzer_test():
+	"""Analyze all REGEX_ANALYZER_FIXTURES.
+
+	Return:
+		A list of triples (regex, expected kinds, reported kinds) of the fixtures on which other kinds
+		of findings are reported than expected.
+	"""
+	differing = []
+	for (regex, expected_kinds) in REGEX_ANALYZER_FIXTURES:
+		kinds = {kind for (_, kind, _) in analyze_regex(regex)}
+		if kinds != expected_kinds:
+			differing.append((regex, expected_kinds, kinds))
+	return differing
 
-	amalgamation_file.write(b"</body></html>")
+def run_snapshot_test(test_files, snapshots_directory):
+	"""Check the tokens of all test files with a snapshot in snapshots_directory against it.
 
-	return (num_succeeding_lines, num_failing_files)
+	Return:
+		A pair of the list of SnapshotResult objects of the test files whose tokens differ from their
+		snapshot (or that could not be checked) and the list of those of the test files that changed
+		since their snapshot was taken. Both are empty if there are no snapshots.
+	"""
+	try:
+		store = SnapshotStore.load(snapshots_directory)
+	except OSError:
+		return ([], [])
+
+	results = list(store.verify([test_file for test_file in test_files if store.key(test_file) in store.entries]))
+	return (
+		[result for result in results if result.status not in ('ok', 'changed')],
+		[result for result in results if result.status == 'changed']
+	)
 
 def get_test_files():
 	"""Return an iterable of all test files in sorted order to consider for testing."""
@@ -202,29 +699,106 @@ def get_test_files():
 	return sorted(list(all_test_files - excluded_test_files))
 
 if __name__ == "__main__":
-	lexer = MMTLexer()
-
-	if len(sys.argv) != 2:
-		sys.stderr.write("Usage: " + sys.argv[0] + " Base-Path-To-Use-For-Links-In-Generated-HTML-Index-File\n")
-		sys.stderr.write("E.g. https://comfreek.github.io/mmt-pygments-lexer/test/ or ./ for local tests")
-		sys.stderr.write("Pay attention to the required trailing slash!")
-
-		sys.exit(1)
+	parser = argparse.ArgumentParser(description = "Lex and render all test files, fail on lexing errors.")
+	parser.add_argument("base_path", metavar = "Base-Path-To-Use-For-Links-In-Generated-HTML-Index-File",
+		help = "e.g. https://comfreek.github.io/mmt-pygments-lexer/test/ or ./ for local tests "
+		       "(pay attention to the required trailing slash!)")
+	parser.add_argument("--full", action = "store_true",
+		help = "process all test files, not only those changed since the last run")
+	parser.add_argument("--update-snapshots", action = "store_true",
+		help = "take new golden token snapshots of all test files instead of checking against them")
+	options = parser.parse_args()
 
 	INDEX_FILENAME = 'index.html'
 	AMALGAMATION_FILENAME = 'amalgamation.html'
-	INDEX_FILE_BASE_PATH = sys.argv[1]
+	MANIFEST_FILENAME = 'test-manifest.json'
+	SNAPSHOTS_DIRECTORY = 'snapshots'
+	INDEX_FILE_BASE_PATH = options.base_path
 	test_files = get_test_files()
 
+	manifest = mmt_batch.load_manifest(MANIFEST_FILENAME, 'mmt', 'mmtfast')
+	if options.full:
+		manifest.invalidate()
+
 	with io.open(INDEX_FILENAME, "w", encoding = "utf-8") as index_file, io.open(AMALGAMATION_FILENAME, "wb") as amalgamation_file:
 		(num_succeeding_lines, num_failures) = run_tests(
 			test_files = test_files,
 			index_file = index_file,
 			index_file_base_path = INDEX_FILE_BASE_PATH,
 			amalgamation_file = amalgamation_file,
-			amalgamation_filename = AMALGAMATION_FILENAME
+			amalgamation_filename = AMALGAMATION_FILENAME,
+			manifest = manifest
 		)
 
+		for diverging_file in run_standalone_lexer_test(test_files, manifest):
+			print("The standalone lexer and MMTLexer yield different tokens for " + diverging_file)
+			num_failures += 1
+
+		for (diverging_file, (lexer_class, lexer_options)) in run_lexer_options_test(test_files):
+			print(lexer_class.__name__ + " with options " + repr(lexer_options) + " and MMTLexer yield different tokens for " + diverging_file)
+			num_failures += 1
+
+		for (state, rule_index, c) in run_dispatch_index_test(test_files):
+			print("The dispatch index leaves out rule {} of state {} at {!r}, which matches there".format(rule_index, state, c))
+			num_failures += 1
+
+		for message in run_profile_test(test_files):
+			print(message)
+			num_failures += 1
+
+		for name in run_linear_lexer_test():
+			print("The lexer option linear changes the tokens of the malformed input " + name + " of benchmark.py")
+			num_failures += 1
+
+		for name in run_delimited_lexer_test(test_files):
+			print("The lexer option delimited changes the tokens of " + name)
+			num_failures += 1
+
+		for diverging_file in run_incremental_lexer_test(test_files):
+			print("MMTIncrementalLexer and lexing from scratch yield different tokens after editing " + diverging_file)
+			num_failures += 1
+
+		for (text, start, end, replacement) in run_incremental_edit_cases():
+			print("MMTIncrementalLexer and lexing from scratch yield different tokens after replacing [{}, {}) of {!r} by {!r}".format(start, end, text, replacement))
+			num_failures += 1
+
+		for description in run_parallel_lexer_test(test_files):
+			print("lex_parallel and MMTLexer yield different tokens for " + description)
+			num_failures += 1
+
+		for differing_file in run_token_array_test(test_files):
+			print("The TokenArray and the tokens of MMTLexer differ for " + differing_file)
+			num_failures += 1
+
+		for differing_file in run_streaming_test(test_files):
+			print("Streaming and lexing at once yield different tokens for " + differing_file)
+			num_failures += 1
+
+		for message in run_relational_lexer_test() + run_relation_store_test():
+			print(message)
+			num_failures += 1
+
+		for (differing_file, options) in run_html_formatter_test(test_files):
+			print("MMTHtmlFormatter and HtmlFormatter yield different HTML for " + differing_file + " with options " + repr(options))
+			num_failures += 1
+
+		for (regex, expected_kinds, kinds) in run_regex_analyzer_test():
+			print("The regex analyzer reports " + repr(sorted(kinds)) + " instead of " + repr(sorted(expected_kinds)) + " on " + regex)
+			num_failures += 1
+
+		if options.update_snapshots:
+			for (failing_file, message) in SnapshotStore(SNAPSHOTS_DIRECTORY).update(test_files):
+				print("Cannot take a snapshot of " + failing_file + ": " + message)
+				num_failures += 1
+			print("Took new token snapshots of all test files into " + SNAPSHOTS_DIRECTORY)
+		else:
+			(differing_results, changed_results) = run_snapshot_test(test_files, SNAPSHOTS_DIRECTORY)
+			for result in differing_results:
+				print(result.message)
+				num_failures += 1
+			for result in changed_results:
+				print("Warning: " + result.message + ", run with --update-snapshots")
+
 		if num_failures is 0:
 			print("\nSuccess! %d lines lexed successfully.\n" % (num_succeeding_lines))
 			sys.exit(0)
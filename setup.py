@@ -46,5 +46,17 @@ setup(
 			mmtdefault = mmtpygments.mmt_style:MMTDefaultStyle
 		[pygments.lexers]
 			mmt = mmtpygments.mmt_lexer:MMTLexer
+			mmtfast = mmtpygments.mmt_fast_lexer:MMTFastLexer
+		[pygments.filters]
+			mmtcompact = mmtpygments.mmt_compact_filter:CompactFilter
+		[pygments.formatters]
+			mmthtml = mmtpygments.mmt_html_formatter:MMTHtmlFormatter
+		[console_scripts]
+			mmtpygmentize = mmtpygments.mmt_batch:main
+			mmtpygments-server = mmtpygments.mmt_server:main
+			mmtpygmentize-client = mmtpygments.mmt_client:main
+			mmtpygments-minted = mmtpygments.mmt_minted:main
+			mmtpygments-relations = mmtpygments.mmt_relations:main
+			mmtpygments-snapshots = mmtpygments.mmt_snapshots:main
 	'''
 )